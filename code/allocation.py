@@ -10,6 +10,8 @@ import csv
 from scipy.stats import mannwhitneyu, ks_2samp, chi2_contingency, ttest_ind
 from statsmodels.stats.proportion import proportions_ztest
 from scripts import plot_utils, regression, cohort_utils, load_data
+from scripts import round_stream, outcome_store, panel, publication_store
+from scripts import variance_diagnostic
 
 from matplotlib import rcParams
 rcParams['font.family'] = 'sans-serif'
@@ -27,12 +29,38 @@ parser = argparse.ArgumentParser()
 parser.add_argument("field", type=str, help="Field you want to consider")
 parser.add_argument("date", type=str, help="Date to append to frame file")
 parser.add_argument("allocate", type=str, help="Construct control group?")
+parser.add_argument("--iterations", type=int, default=iterations,
+                    help="Placebo allocation rounds (the most the DiD script "
+                         "fits when it stops adaptively)")
+parser.add_argument("--variance-reduction", type=str, default=None,
+                    choices=['stratified'],
+                    help="Stratify the bootstrap placebo birth years")
+parser.add_argument("--variance-diagnostic", action='store_true',
+                    help="Also measure the variance reduction on the DiD "
+                         "shock and slope (allocates and fits many extra "
+                         "placebo rounds)")
+parser.add_argument("--stream", type=str, default=None,
+                    help="Also stream the outcome batches to this ring "
+                         "directory, for difference_in_differences.py "
+                         "--stream")
+parser.add_argument("--stream-depth", type=int, default=8,
+                    help="Most unread batches in the stream ring")
+parser.add_argument("--tsv", action='store_true',
+                    help="Also write the outcomes as TSV files (the format "
+                         "of the released data)")
 
 args = parser.parse_args()
+if args.variance_diagnostic and args.variance_reduction is None:
+    parser.error("--variance-diagnostic requires --variance-reduction")
 print(args.field, args.date)
 FIELD = args.field
 DATE = args.date
 ALLOCATE = args.allocate
+iterations = args.iterations
+VARIANCE_REDUCTION = args.variance_reduction
+ring = None
+if args.stream is not None:
+    ring = round_stream.RoundRing(args.stream, args.stream_depth).open()
 
 if FIELD in ["History", "Business"]:
     FILE_ENDING = 'raw'
@@ -90,6 +118,9 @@ subset_cols = [
         'current_parleave', 'pid', 'sid']
 subset = subset[subset_cols].copy(deep=True)
 
+# Publications of everyone in the subset, as flat arrays keyed by survey id
+publications = publication_store.PublicationStore.from_frame(subset, 'sid')
+
 print(subset[~subset.dblp_pubs.isnull()].shape, subset.shape)
 
 print("Completed merging frame and responses!")
@@ -169,6 +200,10 @@ women = subset[subset['gender'] == 1].copy(deep=True)
 men = subset[subset['gender'] == 2].copy(deep=True)
 print("Number of women:\t", women.shape, "\tNumber of men:\t", men.shape)
 
+# Publication trends of the people in `subset` computed so far, shared by the
+# figures below (they only aggregate them)
+trends = cohort_utils.TrendCache(publications)
+
 # ### Plots of productivity relative to career age
 
 # These functions generate productivity trajectories organized relative to
@@ -180,9 +215,11 @@ fig, ax = plt.subplots(ncols=1, nrows=1, figsize=custom_figsize, sharex=True,
 kwargs = {'linestyle': '-', 'marker': 'o', 'fillstyle': 'left'}
 (pop_name, female_pop, male_pop, ) = ('Total', women, men)
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 print(df_w_adj_pubs.shape, df_m_adj_pubs.shape)
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -239,9 +276,11 @@ kwargs = {'linestyle': 'dotted', 'marker': 'o', 'markerfacecolor': 'white',
 pop_name = 'Not Parents'
 (female_pop, male_pop) = (women[women.chage1.isna()], men[men.chage1.isna()])
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
 df_m_adj_pubs.loc[:, 'cumulative'] = df_m_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -326,9 +365,11 @@ kwargs = {'linestyle': '-', 'marker': 'o', 'fillstyle': 'left'}
 pop_name = 'Parent'
 (female_pop, male_pop) = (women[~women.chage1.isna()], men[~men.chage1.isna()])
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year')
+    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_asst_job_year',
+    cache=trends)
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
 df_m_adj_pubs.loc[:, 'cumulative'] = df_m_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -368,10 +409,12 @@ print('Men: ', productivity_m[10], 'Women: ', productivity_w[10])
 # Calculate the number of years missing for mothers to reach fathers (relative
 # to their child's birth)
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth')
+    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth',
+    cache=trends)
 df_w_adj_pubs = df_w_adj_pubs[df_w_adj_pubs.t > 0]
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth')
+    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth',
+    cache=trends)
 df_m_adj_pubs = df_m_adj_pubs[df_m_adj_pubs.t > 0]
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -402,10 +445,12 @@ pop_name = 'Parent'
 (female_pop, male_pop) = (women[women.children_no == 1],
                           men[men.children_no == 1])
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth')
+    female_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth',
+    cache=trends)
 df_w_adj_pubs = df_w_adj_pubs[df_w_adj_pubs.t > 0]
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth')
+    male_pop, -5, 10, adjusted=ADJUSTED, relative_to='first_child_birth',
+    cache=trends)
 df_m_adj_pubs = df_m_adj_pubs[df_m_adj_pubs.t > 0]
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -423,10 +468,12 @@ pop_name = 'Parent'
 (female_pop, male_pop) = (women[women.children_no >= 2],
                           men[men.children_no >= 2])
 df_w_adj_pubs = cohort_utils.compute_publication_trend(
-    female_pop, -5, 10, adjusted=False, relative_to='first_child_birth')
+    female_pop, -5, 10, adjusted=False, relative_to='first_child_birth',
+    cache=trends)
 df_w_adj_pubs = df_w_adj_pubs[df_w_adj_pubs.t > 0]
 df_m_adj_pubs = cohort_utils.compute_publication_trend(
-    male_pop, -5, 10, adjusted=False, relative_to='first_child_birth')
+    male_pop, -5, 10, adjusted=False, relative_to='first_child_birth',
+    cache=trends)
 df_m_adj_pubs = df_m_adj_pubs[df_m_adj_pubs.t > 0]
 
 df_w_adj_pubs.loc[:, 'cumulative'] = df_w_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
@@ -444,7 +491,8 @@ fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(4, 3))
 
 df_adj_pubs = cohort_utils.compute_publication_trend(
     pd.concat([women, men]), -5, 10, adjusted=ADJUSTED,
-    relative_to='first_asst_job_year')
+    relative_to='first_asst_job_year',
+    cache=trends)
 df_adj_pubs.loc[:, 'cumulative'] = df_adj_pubs.groupby(['i', 'round'])['y'].cumsum()
 
 avg_in_first_five = []
@@ -492,31 +540,22 @@ plt.savefig('../plots/descriptive/pubs_over_time_%s.pdf' % FIELD.lower(),
 # Plots of productivity relative to parenthood
 # Here we are putting all of this publication and authorship data together for
 # modeling outside of this notebook.
-df_w = cohort_utils.compute_publication_trend(women, -5, 10, adjusted=ADJUSTED)
+df_w = cohort_utils.compute_publication_trend(women, -5, 10, adjusted=ADJUSTED,
+                                              cache=trends)
 assert len(df_w['i'].unique()) > 0
 
-df_m = cohort_utils.compute_publication_trend(men, -5, 10, adjusted=ADJUSTED)
+df_m = cohort_utils.compute_publication_trend(men, -5, 10, adjusted=ADJUSTED,
+                                              cache=trends)
 assert len(df_m['i'].unique()) > 0
 
 # Plot men and women's average productivity
-productivity_m = np.array([df_m[df_m['t'] == t]['y'].mean()
-                           for t in regression.T], dtype=float)
-productivity_w = np.array([df_w[df_w['t'] == t]['y'].mean()
-                           for t in regression.T], dtype=float)
-
-productivity_trajectory = [None]*N_samples
-for i in range(N_samples):
-    sample = regression.get_sample(df_w)
-    productivity_trajectory[i] = [sample[sample['t'] == t]['y'].mean()
-                                  for t in regression.T]
-std_w = scipy.stats.sem(productivity_trajectory, axis=0)
-
-productivity_trajectory = [None]*N_samples
-for i in range(N_samples):
-    sample = regression.get_sample(df_m)
-    productivity_trajectory[i] = [sample[sample['t'] == t]['y'].mean()
-                                  for t in regression.T]
-std_m = scipy.stats.sem(productivity_trajectory, axis=0)
+productivity_m = panel.PanelSummary(df_m).mean(regression.T)
+productivity_w = panel.PanelSummary(df_w).mean(regression.T)
+
+std_w = regression.get_bootstrap_trajectories(df_w, N_samples,
+                                              cumulative=False)
+std_m = regression.get_bootstrap_trajectories(df_m, N_samples,
+                                              cumulative=False)
 
 fig, ax = plt.subplots(ncols=1, nrows=1, figsize=plot_utils.SINGLE_FIG_SIZE)
 
@@ -1017,10 +1056,18 @@ control = df_control[(df_control['gender'] == 'F')]
 treated = df_treated[(df_treated['gender'] == 'F')]
 
 predictions_control_samples = cohort_utils.allocate_placebo(
-    treated, control, iterations=iterations)
+    treated, control, iterations=iterations,
+    variance_reduction=VARIANCE_REDUCTION)
+if args.variance_diagnostic:
+    print("Variance of mean placebo shock and slope, plain vs %s:" %
+          VARIANCE_REDUCTION,
+          variance_diagnostic.variance_reduction_diagnostic(
+              treated, control, 100, 'bootstrap', VARIANCE_REDUCTION,
+              adjusted=ADJUSTED, publications=publications))
 
 df_w_raw_pubs_treated = cohort_utils.compute_publication_trend(
-    treated, -5, 10, adjusted=ADJUSTED)
+    treated, -5, 10, adjusted=ADJUSTED,
+    publications=publications)
 
 # Drop sensitive variables
 df_w_raw_pubs_treated['pre_2000'] = (df_w_raw_pubs_treated['s'] <= MIDPOINT)
@@ -1031,32 +1078,45 @@ df_w_raw_pubs_treated_sub['pi'] = df_w_raw_pubs_treated_sub['pi'].map(pi_mapping
 df_w_raw_pubs_treated_sub['y'] = df_w_raw_pubs_treated_sub['y'].round(4)
 df_w_raw_pubs_treated_sub = df_w_raw_pubs_treated.drop(['c'], axis=1)
 
-df_w_raw_pubs_treated_sub.to_csv(
-    '../data/treated/%s_publication_outcomes_women_%s_%s.tsv' %
-    (FILE_ENDING, FIELD.lower(), DATE),
-    sep='\t', na_rep='', index=False)
+path = outcome_store.outcome_path('../data', 'treated', FILE_ENDING, 'women',
+                                  FIELD, DATE)
+outcomes = outcome_store.OutcomeWriter(path, path + '.tsv' if args.tsv
+                                       else None)
+outcomes.write(df_w_raw_pubs_treated_sub)
+outcomes.close()
+if ring is not None:
+    ring.put('women_treated', df_w_raw_pubs_treated_sub)
 
-df_w_raw_pubs_control = cohort_utils.compute_publication_trend(
+w_control_panel = cohort_utils.compute_publication_trend(
     control, -5, 10, adjusted=ADJUSTED, control=True,
-    predicted_k_birth=predictions_control_samples, iterations=iterations)
-
-# Drop sensitive variables
-df_w_raw_pubs_control['pre_2000'] = (df_w_raw_pubs_control['s'] <= MIDPOINT)
-df_w_raw_pubs_control_sub = df_w_raw_pubs_control[['y', 't', 'c', 'i',
-                                                   'i_t', 'round', 'pi',
-                                                   'pre_2000']]
-df_w_raw_pubs_control_sub['pi'] = df_w_raw_pubs_control_sub['pi'].map(pi_mapping)
-df_w_raw_pubs_control_sub['y'] = df_w_raw_pubs_control_sub['y'].round(4)
-df_w_raw_pubs_control_sub = df_w_raw_pubs_control_sub.drop(['c'], axis=1)
-
-df_w_raw_pubs_control_sub.to_csv(
-    '../data/control/%s_publication_outcomes_women_%s_%s.tsv' %
-    (FILE_ENDING, FIELD.lower(), DATE),
-    sep='\t', na_rep='', index=False)
+    predicted_k_birth=predictions_control_samples, iterations=iterations,
+    compact=True,
+    publications=publications)
+
+# Drop sensitive variables, one batch of placebo rounds at a time
+path = outcome_store.outcome_path('../data', 'control', FILE_ENDING, 'women',
+                                  FIELD, DATE)
+outcomes = outcome_store.OutcomeWriter(path, path + '.tsv' if args.tsv
+                                       else None)
+for _, rounds in w_control_panel.iter_rounds(100):
+    rounds['pre_2000'] = (rounds['s'] <= MIDPOINT)
+    rounds = rounds[['y', 't', 'c', 'i', 'i_t', 'round', 'pi',
+                     'pre_2000']]
+    rounds['pi'] = rounds['pi'].map(pi_mapping)
+    rounds['y'] = rounds['y'].round(4)
+    rounds = rounds.drop(['c'], axis=1)
+    outcomes.write(rounds)
+    if ring is not None:
+        ring.put('women_control', rounds)
+outcomes.close()
+
+# Control rows at career start and at the (placebo) birth
+df_w_raw_pubs_control = pd.concat([
+    w_control_panel.materialize(c=0),
+    w_control_panel.materialize(t=0)]).drop_duplicates(['round', 'i', 't'])
 
 print("Done.\t",
-      len(df_w_raw_pubs_treated['i'].unique()),
-      len(df_w_raw_pubs_control['i'].unique()))
+      len(df_w_raw_pubs_treated['i'].unique()), len(w_control_panel))
 
 # Indistinguishable with respect to age at career start
 print(
@@ -1125,10 +1185,18 @@ control = df_control[(df_control['gender'] == 'M')]
 treated = df_treated[(df_treated['gender'] == 'M')]
 
 predictions_control_samples = cohort_utils.allocate_placebo(
-    treated, control, iterations=iterations)
+    treated, control, iterations=iterations,
+    variance_reduction=VARIANCE_REDUCTION)
+if args.variance_diagnostic:
+    print("Variance of mean placebo shock and slope, plain vs %s:" %
+          VARIANCE_REDUCTION,
+          variance_diagnostic.variance_reduction_diagnostic(
+              treated, control, 100, 'bootstrap', VARIANCE_REDUCTION,
+              adjusted=ADJUSTED, publications=publications))
 
 df_m_raw_pubs_treated = cohort_utils.compute_publication_trend(
-    treated, -5, 10, adjusted=ADJUSTED)
+    treated, -5, 10, adjusted=ADJUSTED,
+    publications=publications)
 
 # Drop sensitive variables
 df_m_raw_pubs_treated['pre_2000'] = (df_m_raw_pubs_treated['s'] <= MIDPOINT)
@@ -1139,30 +1207,47 @@ df_m_raw_pubs_treated_sub['pi'] = df_m_raw_pubs_treated_sub['pi'].map(pi_mapping
 df_m_raw_pubs_treated_sub['y'] = df_m_raw_pubs_treated_sub['y'].round(4)
 df_m_raw_pubs_treated_sub = df_m_raw_pubs_treated_sub.drop(['c'], axis=1)
 
-df_m_raw_pubs_treated_sub.to_csv(
-    '../data/treated/%s_publication_outcomes_men_%s_%s.tsv' %
-    (FILE_ENDING, FIELD.lower(), DATE),
-    sep='\t', na_rep='', index=False)
+path = outcome_store.outcome_path('../data', 'treated', FILE_ENDING, 'men',
+                                  FIELD, DATE)
+outcomes = outcome_store.OutcomeWriter(path, path + '.tsv' if args.tsv
+                                       else None)
+outcomes.write(df_m_raw_pubs_treated_sub)
+outcomes.close()
+if ring is not None:
+    ring.put('men_treated', df_m_raw_pubs_treated_sub)
 
-df_m_raw_pubs_control = cohort_utils.compute_publication_trend(
+m_control_panel = cohort_utils.compute_publication_trend(
     control, -5, 10, adjusted=ADJUSTED, control=True,
-    predicted_k_birth=predictions_control_samples, iterations=iterations)
-
-# Drop sensitive variables
-df_m_raw_pubs_control['pre_2000'] = (df_m_raw_pubs_control['s'] <= MIDPOINT)
-df_m_raw_pubs_control_sub = df_m_raw_pubs_control[['y', 't', 'c', 'age', 'i',
-                                                   'i_t', 'round', 'pi',
-                                                   'pre_2000']]
-df_m_raw_pubs_control_sub['pi'] = df_m_raw_pubs_control_sub['pi'].map(pi_mapping)
-df_m_raw_pubs_control_sub['y'] = df_m_raw_pubs_control_sub['y'].round(4)
-df_m_raw_pubs_control_sub = df_m_raw_pubs_control_sub.drop(['c'], axis=1)
-
-df_m_raw_pubs_control_sub.to_csv(
-    '../data/control/%s_publication_outcomes_men_%s_%s.tsv' %
-    (FILE_ENDING, FIELD.lower(), DATE), sep='\t', na_rep='', index=False)
+    predicted_k_birth=predictions_control_samples, iterations=iterations,
+    compact=True,
+    publications=publications)
+
+# Drop sensitive variables, one batch of placebo rounds at a time
+path = outcome_store.outcome_path('../data', 'control', FILE_ENDING, 'men',
+                                  FIELD, DATE)
+outcomes = outcome_store.OutcomeWriter(path, path + '.tsv' if args.tsv
+                                       else None)
+for _, rounds in m_control_panel.iter_rounds(100):
+    rounds['pre_2000'] = (rounds['s'] <= MIDPOINT)
+    rounds = rounds[['y', 't', 'c', 'age', 'i', 'i_t', 'round', 'pi',
+                     'pre_2000']]
+    rounds['pi'] = rounds['pi'].map(pi_mapping)
+    rounds['y'] = rounds['y'].round(4)
+    rounds = rounds.drop(['c'], axis=1)
+    outcomes.write(rounds)
+    if ring is not None:
+        ring.put('men_control', rounds)
+outcomes.close()
+if ring is not None:
+    ring.close()
+
+# Control rows at career start and at the (placebo) birth
+df_m_raw_pubs_control = pd.concat([
+    m_control_panel.materialize(c=0),
+    m_control_panel.materialize(t=0)]).drop_duplicates(['round', 'i', 't'])
 
 print("Done.\t", len(df_m_raw_pubs_treated['i'].unique()),
-      len(df_m_raw_pubs_control.dropna()['i'].unique()))
+      len(m_control_panel))
 
 # Indistinguishable with respect to age at career start
 print(
@@ -1245,7 +1330,8 @@ mod = smf.ols(formula='age ~ s', data=data)
 res = mod.fit()
 print(res.summary())
 
-# Demonstrate several strategies for alignment
+# Demonstrate several strategies for alignment (only the rows at the placebo
+# birth, t = 0, are needed below)
 control_groups = {}
 strategies = ['bootstrap', 'linear', 'quadratic', 'lognormal']
 for strategy in strategies:
@@ -1259,7 +1345,9 @@ for strategy in strategies:
         treated, control, iterations=iterations, strategy=strategy)
     df_m_control = cohort_utils.compute_publication_trend(
         control, -5, 10, adjusted=ADJUSTED, control=True,
-        predicted_k_birth=predictions_control_samples, iterations=iterations)
+        predicted_k_birth=predictions_control_samples, iterations=iterations,
+        compact=True,
+        publications=publications).materialize(t=0)
 
     control = df_control[(df_control['gender'] == 'F')]
     treated = df_treated[(df_treated['gender'] == 'F')]
@@ -1269,7 +1357,9 @@ for strategy in strategies:
         treated, control, iterations=iterations, strategy=strategy)
     df_w_control = cohort_utils.compute_publication_trend(
         control, -5, 10, adjusted=ADJUSTED, control=True,
-        predicted_k_birth=predictions_control_samples, iterations=iterations)
+        predicted_k_birth=predictions_control_samples, iterations=iterations,
+        compact=True,
+        publications=publications).materialize(t=0)
 
     control_groups[strategy] = pd.concat([df_m_control, df_w_control])
 
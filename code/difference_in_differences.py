@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from scripts import regression, plot_utils, cohort_utils
-from scipy.stats import ttest_ind, mannwhitneyu, sem, ttest_1samp
+from scripts import regression, plot_utils, cohort_utils, panel, did_fitter
+from scripts import round_stream, outcome_store
+from scipy.stats import ttest_ind, mannwhitneyu
 from matplotlib import gridspec
-from multiprocessing import Pool
 
 import statsmodels.formula.api as smf
 import matplotlib.pyplot as plt
@@ -34,18 +34,22 @@ def get_params(res, param_name):
     return {'coef': est, 'upper': upr, 'lower': lwr, 'p_value': p_value}
 
 
-def fit_model(formula, data):
-    mod = smf.ols(formula=formula, data=data)
-    res = mod.fit()
-    return res
-
-
 if __name__ == '__main__':
     # This script accepts a field and date as a command line argument
     parser = argparse.ArgumentParser()
     parser.add_argument("field", type=str, help="Field you want to consider")
     parser.add_argument("date", type=str, help="To append to frame file")
     parser.add_argument("ymax", type=str, help="Publications scale")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="Stop fitting placebo rounds once the Monte "
+                             "Carlo standard error of the shock and slope "
+                             "is below this (default: fit all rounds)")
+    parser.add_argument("--batch-size", type=int, default=250,
+                        help="Placebo rounds fit between convergence checks "
+                             "(with --stream, the batches as streamed)")
+    parser.add_argument("--stream", type=str, default=None,
+                        help="Fit placebo rounds as allocation.py --stream "
+                             "writes them to this ring directory")
     args = parser.parse_args()
     print(args.field, args.date, args.ymax)
 
@@ -70,58 +74,103 @@ if __name__ == '__main__':
 
     plot_utils.ACCENT_COLOR, plot_utils.ALMOST_BLACK = color_mapping[FIELD]
 
-    # Build model for men:
-    gender = 'men'
-    df_m_treated = pd.read_csv(
-        '../data/treated/%s_publication_outcomes_%s_%s_%s.tsv' %
-        (FILE_ENDING, gender, FIELD.lower(), DATE), sep='\t')
-    df_m_control = pd.read_csv(
-        '../data/control/%s_publication_outcomes_%s_%s_%s.tsv' %
-        (FILE_ENDING, gender, FIELD.lower(), DATE), sep='\t')
-
-    # Build model for women:
-    gender = 'women'
-    df_w_treated = pd.read_csv(
-        '../data/treated/%s_publication_outcomes_%s_%s_%s.tsv' %
-        (FILE_ENDING, gender, FIELD.lower(), DATE), sep='\t')
-    df_w_control = pd.read_csv(
-        '../data/control/%s_publication_outcomes_%s_%s_%s.tsv' %
-        (FILE_ENDING, gender, FIELD.lower(), DATE), sep='\t')
-
-    print(len(df_m_control['i'].unique()), len(df_m_treated['i'].unique()))
-    print(len(df_w_control['i'].unique()), len(df_w_treated['i'].unique()))
-
-    df_m_control['parent'] = False
-    df_m_treated['parent'] = True
-    df_m_control['gender'] = 'M'
-    df_m_treated['gender'] = 'M'
-    df_m_control['is_female'] = False
-    df_m_treated['is_female'] = False
+    parent_formula = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
+                  C(parent):C(t>0) + C(parent):C(t>0):t'
+    female_formula = 'y ~ t + C(t > 0) + t:C(t > 0) + C(is_female) + \
+              C(is_female):t + C(is_female):C(t > 0) + C(is_female):C(t > 0):t'
+
+    # What the comparisons below take from the control panels; the panels
+    # themselves are only kept where they are fit from shared memory
+    m_control = panel.PanelAggregates(regression.T, N_samples*10)
+    w_control = panel.PanelAggregates(regression.T, N_samples*10)
+
+    if args.stream is not None:
+        # Fit the placebo rounds while allocation.py is still producing them,
+        # and aggregate the control rounds as they pass; only the (single
+        # round) treated panels are kept.
+        labels = {'men_treated': (True, False), 'men_control': (False, False),
+                  'women_treated': (True, True),
+                  'women_control': (False, True)}
+        aggregates = {'men_control': m_control, 'women_control': w_control}
+        treated = {}
+
+        def labelled(batches):
+            for source, rows in batches:
+                rows['parent'], rows['is_female'] = labels[source]
+                if source in aggregates:
+                    aggregates[source].update(rows)
+                else:
+                    treated[source] = rows
+                yield source, rows
+
+        families = {
+          'fathers': (parent_formula + ' + pi', 'men_treated',
+                      ['men_control'], 'parent'),
+          'mothers': (parent_formula + ' + pi', 'women_treated',
+                      ['women_control'], 'parent'),
+          'not_parents': (female_formula + ' + pi', None,
+                          ['men_control', 'women_control'], 'is_female'),
+          'fathers_no_pi': (parent_formula, 'men_treated',
+                            ['men_control'], 'parent'),
+          'mothers_no_pi': (parent_formula, 'women_treated',
+                            ['women_control'], 'parent')}
+        family_results = did_fitter.fit_stream(
+          families, labelled(round_stream.RoundRing(args.stream)),
+          max(os.cpu_count() - 1, 1), tolerance=args.tolerance)
+
+        df_m_treated = treated['men_treated']
+        df_w_treated = treated['women_treated']
+    else:
+        # Build model for men:
+        gender = 'men'
+        df_m_treated = outcome_store.read_outcomes(outcome_store.outcome_path(
+            '../data', 'treated', FILE_ENDING, gender, FIELD, DATE))
+        df_m_control = outcome_store.read_outcomes(outcome_store.outcome_path(
+            '../data', 'control', FILE_ENDING, gender, FIELD, DATE))
+
+        # Build model for women:
+        gender = 'women'
+        df_w_treated = outcome_store.read_outcomes(outcome_store.outcome_path(
+            '../data', 'treated', FILE_ENDING, gender, FIELD, DATE))
+        df_w_control = outcome_store.read_outcomes(outcome_store.outcome_path(
+            '../data', 'control', FILE_ENDING, gender, FIELD, DATE))
+
+        df_m_control['parent'] = False
+        df_m_treated['parent'] = True
+        df_m_control['is_female'] = False
+        df_m_treated['is_female'] = False
+
+        df_w_control['parent'] = False
+        df_w_treated['parent'] = True
+        df_w_control['is_female'] = True
+        df_w_treated['is_female'] = True
+
+        m_control.update(df_m_control)
+        w_control.update(df_w_control)
+
+    print(len(m_control.sums), len(df_m_treated['i'].unique()))
+    print(len(w_control.sums), len(df_w_treated['i'].unique()))
 
     # df_m_control['baby_pre_tenure'] = df_m_control.c < df_m_control.t
     # df_m_treated['baby_pre_tenure'] = df_m_treated.c < df_m_treated.t
-
-    df_m_control['cumulative'] = df_m_control.groupby(['i', 'round'])['y'].cumsum()
-    df_m_treated['cumulative'] = df_m_treated.groupby(['i', 'round'])['y'].cumsum()
-
-    df_w_control['parent'] = False
-    df_w_treated['parent'] = True
-    df_w_control['gender'] = 'F'
-    df_w_treated['gender'] = 'F'
-    df_w_control['is_female'] = True
-    df_w_treated['is_female'] = True
-
     # df_w_control['baby_pre_tenure'] = df_w_control.c < df_w_control.t
     # df_w_treated['baby_pre_tenure'] = df_w_treated.c < df_w_treated.t
 
-    df_w_control['cumulative'] = df_w_control.groupby(['i', 'round'])['y'].cumsum()
-    df_w_treated['cumulative'] = df_w_treated.groupby(['i', 'round'])['y'].cumsum()
+    # Per-event-time aggregates of each panel, for the trajectory plots
+    m_treated_summary = panel.PanelSummary(df_m_treated)
+    m_control_summary = m_control.summary
+    w_treated_summary = panel.PanelSummary(df_w_treated)
+    w_control_summary = w_control.summary
+
+    # Control rows at the (placebo) birth, for the comparisons at t = 0
+    df_m_control_0 = m_control.at_birth
+    df_w_control_0 = w_control.at_birth
 
     # Statistical Similarities between Control and Treatment Groups
     print("\nDifferences between parents / non-parents respect to \
            productivity?")
     parents = pd.concat([df_m_treated, df_w_treated])
-    non_parents = pd.concat([df_m_control, df_w_control])
+    non_parents = pd.concat([df_m_control_0, df_w_control_0])
 
     parents_y = parents[parents.t == 0]['y'].dropna()
     not_parents_y = non_parents[(non_parents.t == 0)]['y'].dropna()
@@ -143,7 +192,7 @@ if __name__ == '__main__':
     print("\nDifferences between fathers / non-fathers respect to \
            productivity?")
     fathers_y = df_m_treated[df_m_treated.t == 0]['y'].dropna()
-    non_fathers_y = df_m_control[(df_m_control.t == 0)]['y'].dropna()
+    non_fathers_y = df_m_control_0['y'].dropna()
 
     print(ttest_ind(fathers_y, non_fathers_y, equal_var=False))
 
@@ -162,7 +211,7 @@ if __name__ == '__main__':
     print("\nDifferences between mothers / non-mothers respect to \
           productivity?")
     mothers_y = df_w_treated[df_w_treated.t == 0]['y'].dropna()
-    not_mothers_y = df_w_control[(df_w_control.t == 0)]['y'].dropna()
+    not_mothers_y = df_w_control_0['y'].dropna()
 
     print(ttest_ind(mothers_y, not_mothers_y, equal_var=False))
     mothers_sem = mothers_y.var()/len(mothers_y)
@@ -179,65 +228,63 @@ if __name__ == '__main__':
 
     print("\nFATHERS")
     print("Indistinguishable with respect to age at first birth?")
-    if ('age' in df_m_control.columns) and ('age' in df_m_treated.columns):
+    if ('age' in df_m_control_0.columns) and ('age' in df_m_treated.columns):
         print(ttest_ind(
-          df_m_control[df_m_control.t == 0]['age'],
+          df_m_control_0['age'],
           df_m_treated[df_m_treated.t == 0]['age'],
           equal_var=False),
-          ((df_m_control[df_m_control.t == 0]['age'].mean(),
-            df_m_control[df_m_control.t == 0]['age'].std()),
+          ((df_m_control_0['age'].mean(),
+            df_m_control_0['age'].std()),
            (df_m_treated[df_m_treated.t == 0]['age'].mean(),
             df_m_treated[df_m_treated.t == 0]['age'].std())))
 
     # print("Indistinguishable with respect to career age at first birth?")
     # print(ttest_ind(
-    #   df_m_control[df_m_control.t == 0]['c'],
+    #   df_m_control_0['c'],
     #   df_m_treated[df_m_treated.t == 0]['c'],
     #   equal_var=False),
-    #   ((df_m_control[df_m_control.t == 0]['c'].mean(),
-    #     df_m_control[df_m_control.t == 0]['c'].std()),
+    #   ((df_m_control_0['c'].mean(),
+    #     df_m_control_0['c'].std()),
     #    (df_m_treated[df_m_treated.t == 0]['c'].mean(),
     #     df_m_treated[df_m_treated.t == 0]['c'].std())))
 
     print("Indistinguishable with respect to prestige?")
     print(mannwhitneyu(
-      df_m_control[(df_m_control['round'] == 0) & (df_m_control.t == 0)]['pi'],
+      df_m_control_0[df_m_control_0['round'] == 0]['pi'],
       df_m_treated[df_m_treated.t == 0]['pi']),
-      ((df_m_control[(df_m_control['round'] == 0) &
-                     (df_m_control.t == 0)]['pi'].mean(),
-        df_m_control[(df_m_control['round'] == 0) &
-                     (df_m_control.t == 0)]['pi'].std()),
+      ((df_m_control_0[df_m_control_0['round'] == 0]['pi'].mean(),
+        df_m_control_0[df_m_control_0['round'] == 0]['pi'].std()),
        (df_m_treated[df_m_treated.t == 0]['pi'].mean(),
         df_m_treated[df_m_treated.t == 0]['pi'].std())))
 
     print("\nMOTHERS")
     print("Indistinguishable with respect to age at first birth?")
-    if ('age' in df_w_control.columns) and ('age' in df_w_treated.columns):
+    if ('age' in df_w_control_0.columns) and ('age' in df_w_treated.columns):
         print(ttest_ind(
           df_w_treated[df_w_treated.t == 0]['age'],
-          df_w_control[df_w_control.t == 0]['age'],
+          df_w_control_0['age'],
           equal_var=False),
-          ((df_w_control[df_w_control.t == 0]['age'].mean(),
-            df_w_control[df_w_control.t == 0]['age'].std()),
+          ((df_w_control_0['age'].mean(),
+            df_w_control_0['age'].std()),
            (df_w_treated[df_w_treated.t == 0]['age'].mean(),
             df_w_treated[df_w_treated.t == 0]['age'].std())))
 
     # print("Indistinguishable with respect to career age at first birth?")
     # print(ttest_ind(
     #   df_w_treated[df_w_treated.t == 0]['c'],
-    #   df_w_control[df_w_control.t == 0]['c'],
+    #   df_w_control_0['c'],
     #   equal_var=False),
-    #   ((df_w_control[df_w_control.t == 0]['c'].mean(),
-    #     df_w_control[df_w_control.t == 0]['c'].std()),
+    #   ((df_w_control_0['c'].mean(),
+    #     df_w_control_0['c'].std()),
     #    (df_w_treated[df_w_treated.t == 0]['c'].mean(),
     #     df_w_treated[df_w_treated.t == 0]['c'].std())))
 
     print("Indistinguishable with respect to prestige?")
     print(mannwhitneyu(
-      df_w_control[df_w_control.t == 0]['pi'],
+      df_w_control_0['pi'],
       df_w_treated[df_w_treated.t == 0]['pi']),
-      ((df_w_control[df_w_control.t == 0]['pi'].mean(),
-        df_w_control[df_w_control.t == 0]['pi'].std()),
+      ((df_w_control_0['pi'].mean(),
+        df_w_control_0['pi'].std()),
        (df_w_treated[df_w_treated.t == 0]['pi'].mean(),
         df_w_treated[df_w_treated.t == 0]['pi'].std())))
 
@@ -245,8 +292,7 @@ if __name__ == '__main__':
     print("\nParallel trends?")
     pre_times = [-5, -4, -3, -2]
 
-    pre_trend_slopes = df_w_control[
-      df_w_control.t.isin(pre_times)].groupby(['i'])['y'].mean()
+    pre_trend_slopes = w_control.person_means(pre_times)
     print('Women w/o kids:\t', np.nanmean(pre_trend_slopes),
           np.nanstd(pre_trend_slopes))
 
@@ -256,10 +302,9 @@ if __name__ == '__main__':
           np.nanstd(pre_trend_slopes))
     print(ttest_ind(
       df_w_treated[df_w_treated.t.isin(pre_times)].groupby(['i'])['y'].mean(),
-      df_w_control[df_w_control.t.isin(pre_times)].groupby(['i'])['y'].mean()))
+      w_control.person_means(pre_times)))
 
-    pre_trend_slopes = df_m_control[
-      df_m_control.t.isin(pre_times)].groupby(['i'])['y'].mean()
+    pre_trend_slopes = m_control.person_means(pre_times)
     print('\nMen w/o kids:\t',
           np.nanmean(pre_trend_slopes),
           np.nanstd(pre_trend_slopes))
@@ -271,7 +316,7 @@ if __name__ == '__main__':
           np.nanstd(pre_trend_slopes))
     print(ttest_ind(
       df_m_treated[df_m_treated.t.isin(pre_times)].groupby(['i'])['y'].mean(),
-      df_m_control[df_m_control.t.isin(pre_times)].groupby(['i'])['y'].mean()))
+      m_control.person_means(pre_times)))
 
     print("\nTrends in the difference in difference plots")
 
@@ -458,49 +503,56 @@ if __name__ == '__main__':
 
     # print(sm.stats.anova_lm(res_less, res))
 
-    women_params = []
-    men_params = []
-    women_results = []
-    men_results = []
-    women_shock_estimates = []
-    men_shock_estimates = []
-    women_slope_estimates = []
-    men_slope_estimates = []
-    women_expectations = []
-    men_expectations = []
+    if args.stream is None:
+        # Publish the panels' model columns once, for all pool workers
+        shared_columns = ['y', 't', 'pi', 'parent', 'is_female']
+        shared_m_treated = panel.SharedPanel.publish(df_m_treated,
+                                                     shared_columns)
+        shared_m_control = panel.SharedPanel.publish(df_m_control,
+                                                     shared_columns)
+        shared_w_treated = panel.SharedPanel.publish(df_w_treated,
+                                                     shared_columns)
+        shared_w_control = panel.SharedPanel.publish(df_w_control,
+                                                     shared_columns)
+
+        # All comparisons share one pool. Where every round shares the
+        # treated rows, workers fit the normal equations with the treated
+        # block's contribution computed once.
+        families = {
+          'fathers': (parent_formula + ' + pi', shared_m_treated,
+                      [shared_m_control], 'parent'),
+          'mothers': (parent_formula + ' + pi', shared_w_treated,
+                      [shared_w_control], 'parent'),
+          'not_parents': (female_formula + ' + pi', None,
+                          [shared_m_control, shared_w_control], 'is_female'),
+          'fathers_no_pi': (parent_formula, shared_m_treated,
+                            [shared_m_control], 'parent'),
+          'mothers_no_pi': (parent_formula, shared_w_treated,
+                            [shared_w_control], 'parent')}
+        family_results = did_fitter.fit_families(
+          families, max(os.cpu_count() - 1, 1), tolerance=args.tolerance,
+          batch_size=args.batch_size)
+
+        for shared in [shared_m_treated, shared_m_control,
+                       shared_w_treated, shared_w_control]:
+            shared.unlink()
+
+    print("\nPlacebo rounds used")
+    print(did_fitter.precision_report(family_results, families))
 
     print("Modeling men with children versus men without children")
 
-    formula = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
-                  C(parent):C(t>0) + C(parent):C(t>0):t + pi'
+    # Running summaries of the coefficients and t = 0 expectation per round
+    men_estimates = family_results['fathers']
 
-    pool = Pool(os.cpu_count() - 1)
-    multiple_results = []
-    for iteration in df_m_control['round'].unique():
-        men_data = pd.concat([
-          df_m_control[df_m_control['round'] == iteration], df_m_treated])
-        multiple_results.append(pool.apply_async(fit_model, (formula, men_data)))
+    # Get the shock andd slope estimates for men and women
+    men_shock_estimates = men_estimates.ci(
+      'C(parent)[T.True]:C(t > 0)[T.True]')
+    men_slope_estimates = men_estimates.ci(
+      'C(parent)[T.True]:C(t > 0)[T.True]:t')
 
-    print("Loaded tasks asynchronously")
-
-    for result in multiple_results:
-        men_res = result.get(timeout=None)
-
-        # Get all the parameters of the model fit
-        men_params.append(men_res.params)
-        men_results.append(men_res)
-
-        # Get the shock andd slope estimates for men and women
-        men_shock_estimates.append(
-          get_params(men_res, 'C(parent)[T.True]:C(t > 0)[T.True]'))
-        men_slope_estimates.append(
-          get_params(men_res, 'C(parent)[T.True]:C(t > 0)[T.True]:t'))
-
-        # Get expected value at t = 0 (among parents)
-        men_expectations.append(
-          np.mean(men_res.predict(men_data[(men_data.t == 0) & men_data.parent])))
-
-    pool.close()
+    # Get expected value at t = 0 (among parents)
+    men_expectations = men_estimates.mean('expectation')
 
     parameter_names = {'beta_0': 'Intercept', 'beta_1': 't',
                        'beta_2': 'C(t > 0)[T.True]',
@@ -513,87 +565,44 @@ if __name__ == '__main__':
 
     for coef_short, coef_long in parameter_names.items():
         print(coef_short)
-        temp = [get_params(men_res, coef_long)['coef'] for men_res in men_results]
-        print('%.3f (std: %.3f, sem: %.3f, CI: [%.3f, %.3f])' % (np.mean(temp),
-              np.std(temp), sem(temp), compute_ci(pd.Series(temp))['lower'],
-              compute_ci(pd.Series(temp))['upper']))
-        print(ttest_1samp(temp, popmean=0))
+        temp = men_estimates.summary(coef_long)
+        print('%.3f (std: %.3f, sem: %.3f, CI: [%.3f, %.3f])' % (temp['mean'],
+              temp['std'], temp['sem'], temp['lower'], temp['upper']))
+        print(temp['ttest'])
 
     print("\nModeling women with children versus women without children")
 
-    pool = Pool(os.cpu_count() - 1)
-    multiple_results = []
-
-    for iteration in df_w_control['round'].unique():
-        women_data = pd.concat(
-          [df_w_control[df_w_control['round'] == iteration], df_w_treated])
-        multiple_results.append(pool.apply_async(fit_model, (formula, women_data)))
+    women_estimates = family_results['mothers']
 
-    print("Loaded tasks asynchronously")
+    # Get the shock andd slope estimates for men and women
+    women_shock_estimates = women_estimates.ci(
+      'C(parent)[T.True]:C(t > 0)[T.True]')
+    women_slope_estimates = women_estimates.ci(
+      'C(parent)[T.True]:C(t > 0)[T.True]:t')
 
-    for result in multiple_results:
-        women_res = result.get(timeout=None)
-
-        women_params.append(women_res.params)
-        women_results.append(women_res)
-
-        # Get the shock andd slope estimates for men and women
-        women_shock_estimates.append(
-          get_params(women_res, 'C(parent)[T.True]:C(t > 0)[T.True]'))
-        women_slope_estimates.append(
-          get_params(women_res, 'C(parent)[T.True]:C(t > 0)[T.True]:t'))
-
-        # Get expected value at t = 0 (among parents)
-        women_expectations.append(np.mean(
-          women_res.predict(women_data[(women_data.t == 0) & women_data.parent])))
+    # Get expected value at t = 0 (among parents)
+    women_expectations = women_estimates.mean('expectation')
 
     for coef_short, coef_long in parameter_names.items():
         print(coef_short)
-        temp = [get_params(women_res, coef_long)['coef'] for
-                women_res in women_results]
+        temp = women_estimates.summary(coef_long)
         print('%.3f (std: %.3f, sem: %.3f, CI: [%.3f, %.3f])' %
-              (np.mean(temp), np.std(temp), sem(temp),
-               compute_ci(pd.Series(temp))['lower'],
-               compute_ci(pd.Series(temp))['upper']))
-        print(ttest_1samp(temp, popmean=0))
-
-    pool.close()
+              (temp['mean'], temp['std'], temp['sem'], temp['lower'],
+               temp['upper']))
+        print(temp['ttest'])
 
     print("\nModeling women without children versus men without children")
 
-    pool = Pool(os.cpu_count() - 1)
-    multiple_results = []
-
-    not_parents_shock_estimates = []
-    not_parents_slope_estimates = []
-    not_parents_expectations = []
-    not_parents_results = []
-
-    formula = 'y ~ t + C(t > 0) + t:C(t > 0) + C(is_female) + C(is_female):t + \
-              C(is_female):C(t > 0) + C(is_female):C(t > 0):t + pi'
-
-    for iteration in df_m_control['round'].unique():
-        not_parents_data = pd.concat(
-          [df_m_control[df_m_control['round'] == iteration],
-           df_w_control[df_w_control['round'] == iteration]])
-        multiple_results.append(pool.apply_async(
-          fit_model, (formula, not_parents_data)))
+    formula = female_formula + ' + pi'
+    not_parents_estimates = family_results['not_parents']
 
-    print("Loaded tasks asynchronously")
-    for result in multiple_results:
-        not_parents_res = result.get(timeout=None)
+    not_parents_shock_estimates = not_parents_estimates.ci(
+      'C(is_female)[T.True]:C(t > 0)[T.True]')
+    not_parents_slope_estimates = not_parents_estimates.ci(
+      'C(is_female)[T.True]:C(t > 0)[T.True]:t')
 
-        not_parents_results.append(not_parents_res)
-
-        not_parents_shock_estimates.append(
-          get_params(not_parents_res, 'C(is_female)[T.True]:C(t > 0)[T.True]'))
-        not_parents_slope_estimates.append(
-          get_params(not_parents_res, 'C(is_female)[T.True]:C(t > 0)[T.True]:t'))
-
-        # Expected value at t = 0 among women
-        not_parents_expectations.append(np.mean(not_parents_res.predict(
-            not_parents_data[(not_parents_data.t == 0) &
-                             not_parents_data.is_female])))
+    # Expected value at t = 0 among women
+    not_parents_expectations = not_parents_estimates.mean('expectation')
 
     parameter_names = {'beta_0': 'Intercept', 'beta_1': 't',
                        'beta_2': 'C(t > 0)[T.True]',
@@ -606,15 +615,11 @@ if __name__ == '__main__':
 
     for coef_short, coef_long in parameter_names.items():
         print(coef_short)
-        temp = [get_params(not_parents_res, coef_long)['coef'] for
-                not_parents_res in not_parents_results]
+        temp = not_parents_estimates.summary(coef_long)
         print('%.3f (std: %.3f, sem: %.3f, CI: [%.3f, %.3f])' %
-              (np.mean(temp), np.std(temp), sem(temp),
-               compute_ci(pd.Series(temp))['lower'],
-               compute_ci(pd.Series(temp))['upper']))
-        print(ttest_1samp(temp, popmean=0))
-
-    pool.close()
+              (temp['mean'], temp['std'], temp['sem'], temp['lower'],
+               temp['upper']))
+        print(temp['ttest'])
 
     print("\nModeling women with children versus men with children")
 
@@ -650,10 +655,9 @@ if __name__ == '__main__':
     fig, ax = plt.subplots(ncols=2, nrows=1,
                            figsize=plot_utils.DOUBLE_FIG_SIZE, sharey=True)
 
-    trend = np.array([df_m_control[df_m_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
-    std = regression.get_bootstrap_trajectories(
-      df_m_control, N_samples, cumulative=False)
+    trend = m_control_summary.mean(regression.T)
+    std = regression.matrix_bootstrap_trajectories(
+      *m_control.person_time_matrix(), N_samples, cumulative=False)
 
     ax[0].plot(regression.T, trend, label='w/o Children', linestyle='dotted',
                marker='o', markerfacecolor='white',
@@ -661,9 +665,7 @@ if __name__ == '__main__':
     ax[0].fill_between(regression.T, trend-2*std, trend+2*std,
                        color=plot_utils.ALMOST_BLACK, alpha=0.2)
 
-    adjusted_trend = np.array(
-      [df_m_treated[df_m_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = m_treated_summary.mean(regression.T)
     std = regression.get_bootstrap_trajectories(df_m_treated, N_samples,
                                                 cumulative=False)
 
@@ -682,11 +684,11 @@ if __name__ == '__main__':
                  frameon=False, ncol=1)
 
     ax[0].text(0.95, 0.2, r'$\hat{\beta}_{6}$: %.2f [%.2f, %.2f]' %
-               tuple(compute_ci(pd.DataFrame(men_shock_estimates).coef).values()),
+               tuple(men_shock_estimates.values()),
                ha='right', va='center', transform=ax[0].transAxes,
                fontsize=plot_utils.LEGEND_SIZE)
     ax[0].text(0.95, 0.1, r'$\hat{\beta}_{7}$: %.2f [%.2f, %.2f]' %
-               tuple(compute_ci(pd.DataFrame(men_slope_estimates).coef).values()),
+               tuple(men_slope_estimates.values()),
                ha='right', va='center', transform=ax[0].transAxes,
                fontsize=plot_utils.LEGEND_SIZE)
 
@@ -695,20 +697,17 @@ if __name__ == '__main__':
     plot_utils.finalize(ax[0])
 
     # Plot women's average productivity with and without kids
-    trend = np.array([df_w_control[df_w_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
+    trend = w_control_summary.mean(regression.T)
 
-    std = regression.get_bootstrap_trajectories(df_w_control, N_samples,
-                                                cumulative=False)
+    std = regression.matrix_bootstrap_trajectories(
+      *w_control.person_time_matrix(), N_samples, cumulative=False)
     ax[1].plot(regression.T, trend, label='w/o Children', linestyle='dotted',
                marker='o', markerfacecolor='white',
                color=plot_utils.ACCENT_COLOR)
     ax[1].fill_between(regression.T, trend-2*std, trend+2*std,
                        color=plot_utils.ACCENT_COLOR, alpha=0.2)
 
-    adjusted_trend = np.array(
-      [df_w_treated[df_w_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = w_treated_summary.mean(regression.T)
     std = regression.get_bootstrap_trajectories(
       df_w_treated, N_samples, cumulative=False)
 
@@ -724,12 +723,12 @@ if __name__ == '__main__':
 
     ax[1].text(
       0.95, 0.2, r'$\hat{\beta}_{6}$: %.2f [%.2f, %.2f]' %
-      tuple(compute_ci(pd.DataFrame(women_shock_estimates).coef).values()),
+      tuple(women_shock_estimates.values()),
       ha='right', va='center', transform=ax[1].transAxes,
       fontsize=plot_utils.LEGEND_SIZE)
     ax[1].text(
       0.95, 0.1, r'$\hat{\beta}_{7}$: %.2f [%.2f, %.2f]' %
-      tuple(compute_ci(pd.DataFrame(women_slope_estimates).coef).values()),
+      tuple(women_slope_estimates.values()),
       ha='right', va='center', transform=ax[1].transAxes,
       fontsize=plot_utils.LEGEND_SIZE)
 
@@ -754,13 +753,13 @@ if __name__ == '__main__':
     print("Percentage changes to productivity (immediately):")
     estimates = {
       'men_w_kid_vs_men_wo_kid':
-      compute_ci(pd.DataFrame(men_shock_estimates).coef)['mean']/np.mean(men_expectations),
+      men_shock_estimates['mean']/np.mean(men_expectations),
       'women_w_kid_vs_women_wo_kid':
-      compute_ci(pd.DataFrame(women_shock_estimates).coef)['mean']/np.mean(women_expectations),
+      women_shock_estimates['mean']/np.mean(women_expectations),
       'women_w_kid_vs_men_w_kid':
       compute_ci(pd.DataFrame(parents_shock_estimates).coef)['mean']/np.mean(parents_expectations),
       'women_wo_kid_vs_men_wo_kid':
-      compute_ci(pd.DataFrame(not_parents_shock_estimates).coef)['mean']/np.mean(not_parents_expectations)
+      not_parents_shock_estimates['mean']/np.mean(not_parents_expectations)
     }
 
     fig = plt.figure(figsize=(7.25, 3.25), dpi=1000)
@@ -769,8 +768,7 @@ if __name__ == '__main__':
     ax2 = plt.subplot(gs[1])
 
     # Men without kids
-    trend = np.array([df_m_control[df_m_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
+    trend = m_control_summary.mean(regression.T)
     ax.plot(regression.T[:5], trend[:5], marker='o',
             markerfacecolor='w', color=plot_utils.ALMOST_BLACK,
             linestyle='dotted', clip_on=False, zorder=1e2)
@@ -779,17 +777,14 @@ if __name__ == '__main__':
             zorder=1e2)
 
     # Men with kids
-    adjusted_trend = np.array(
-      [df_m_treated[df_m_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = m_treated_summary.mean(regression.T)
     ax.plot(regression.T[:5], adjusted_trend[:5], linestyle='-', marker='o',
             color=plot_utils.ALMOST_BLACK, clip_on=False, zorder=1e2)
     ax.plot(regression.T[6:], adjusted_trend[6:], linestyle='-', marker='o',
             color=plot_utils.ALMOST_BLACK, clip_on=False, zorder=1e2)
 
     # Women without kids
-    trend = np.array([df_w_control[df_w_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
+    trend = w_control_summary.mean(regression.T)
     ax.plot(regression.T[:5], trend[:5], linestyle='dotted', marker='o',
             markerfacecolor='w', color=plot_utils.ACCENT_COLOR, clip_on=False,
             zorder=1e2,)
@@ -798,9 +793,7 @@ if __name__ == '__main__':
             zorder=1e2)
 
     # Women without kids
-    adjusted_trend = np.array(
-      [df_w_treated[df_w_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = w_treated_summary.mean(regression.T)
     ax.plot(regression.T[:5], adjusted_trend[:5], marker='o',
             color=plot_utils.ACCENT_COLOR, linestyle='-', clip_on=False,
             zorder=1e2)
@@ -883,69 +876,30 @@ if __name__ == '__main__':
                 (FILE_ENDING, FIELD.lower(), DATE),
                 dpi=500)
 
-    women_params = []
-    men_params = []
-    women_shock_estimates = []
-    men_shock_estimates = []
-    women_slope_estimates = []
-    men_slope_estimates = []
-
-    for iteration in df_m_control['round'].unique():
-        men_data = pd.concat([df_m_control[df_m_control['round'] == iteration],
-                              df_m_treated])
-        # df_m.sample(n=len(df_m_control), replace=True, random_state=iteration)])
-        # men_data = men_data[men_data.c > men_data.t]
-        women_data = pd.concat([df_w_control[df_w_control['round'] == iteration],
-                                df_w_treated])
-        # df_w.sample(n=len(df_w_control), replace=True, random_state=iteration)])
-        # women_data = women_data[women_data.c > women_data.t]
-
-        formula = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
-                      C(parent):C(t>0) + C(parent):C(t>0):t'
-        women_mod = smf.ols(formula=formula, data=women_data)
-        women_res = women_mod.fit()
-
-        men_mod = smf.ols(formula=formula, data=men_data)
-        men_res = men_mod.fit()
-
-        women_params.append(women_res.params)
-        men_params.append(men_res.params)
-
-        women_shock_estimates.append(
-          get_params(women_res, 'C(parent)[T.True]:C(t > 0)[T.True]'))
-        men_shock_estimates.append(
-          get_params(men_res, 'C(parent)[T.True]:C(t > 0)[T.True]'))
-
-        women_slope_estimates.append(
-          get_params(women_res, 'C(parent)[T.True]:C(t > 0)[T.True]:t'))
-        men_slope_estimates.append(
-          get_params(men_res, 'C(parent)[T.True]:C(t > 0)[T.True]:t'))
-
-    def get_linear_fit(params):
+    # Fits without prestige, from the shared pool above
+    men_no_pi_estimates = family_results['fathers_no_pi']
+    women_no_pi_estimates = family_results['mothers_no_pi']
+
+    def get_linear_fit(estimates):
         linear_fit_params = {}
 
         # Pre-treatment intercepts & slopes for non-parents
-        linear_fit_params['beta_0'] = np.mean([param['Intercept']
-                                              for param in params])
-        linear_fit_params['beta_1'] = np.mean([param['t'] for param in params])
+        linear_fit_params['beta_0'] = estimates.mean('Intercept')
+        linear_fit_params['beta_1'] = estimates.mean('t')
 
         # ... and for parents.
-        linear_fit_params['beta_4'] = np.mean([param['C(parent)[T.True]']
-                                              for param in params])
-        linear_fit_params['beta_5'] = np.mean([param['C(parent)[T.True]:t']
-                                              for param in params])
+        linear_fit_params['beta_4'] = estimates.mean('C(parent)[T.True]')
+        linear_fit_params['beta_5'] = estimates.mean('C(parent)[T.True]:t')
 
         # Post-treatment intercepts & slopes for non-parents
-        linear_fit_params['beta_2'] = np.mean([param['C(t > 0)[T.True]']
-                                              for param in params])
-        linear_fit_params['beta_3'] = np.mean([param['t:C(t > 0)[T.True]']
-                                              for param in params])
+        linear_fit_params['beta_2'] = estimates.mean('C(t > 0)[T.True]')
+        linear_fit_params['beta_3'] = estimates.mean('t:C(t > 0)[T.True]')
 
         # ... and for parents
-        linear_fit_params['beta_6'] = np.mean(
-          [param['C(parent)[T.True]:C(t > 0)[T.True]'] for param in params])
-        linear_fit_params['beta_7'] = np.mean(
-          [param['C(parent)[T.True]:C(t > 0)[T.True]:t'] for param in params])
+        linear_fit_params['beta_6'] = estimates.mean(
+          'C(parent)[T.True]:C(t > 0)[T.True]')
+        linear_fit_params['beta_7'] = estimates.mean(
+          'C(parent)[T.True]:C(t > 0)[T.True]:t')
 
         return linear_fit_params
 
@@ -974,18 +928,15 @@ if __name__ == '__main__':
     fig, ax = plt.subplots(ncols=2, nrows=1,
                            figsize=plot_utils.DOUBLE_FIG_SIZE, sharey=True)
 
-    men_fit = get_linear_fit(men_params)
-    trend = np.array([df_m_control[df_m_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
+    men_fit = get_linear_fit(men_no_pi_estimates)
+    trend = m_control_summary.mean(regression.T)
     ax[0].scatter(regression.T, trend, label='w/o Children', marker='o',
                   color=plot_utils.ALMOST_BLACK, alpha=0.5)
     ax[0].plot(np.arange(-5, 10, 0.1),
                [model(men_fit, t, False) for t in np.arange(-5, 10, 0.1)],
                linestyle='dotted', color=plot_utils.ALMOST_BLACK)
 
-    adjusted_trend = np.array(
-      [df_m_treated[df_m_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = m_treated_summary.mean(regression.T)
     ax[0].scatter(regression.T, adjusted_trend, label='w/ Children', marker='o',
                   color=plot_utils.ACCENT_COLOR, alpha=0.5)
     ax[0].plot(np.arange(-5, 10, 0.1),
@@ -1009,18 +960,15 @@ if __name__ == '__main__':
     #
     # Plot women's average productivity with and without kids
     #
-    women_fit = get_linear_fit(women_params)
-    trend = np.array([df_w_control[df_w_control['t'] == t]['y'].mean(skipna=True)
-                      for t in regression.T])
+    women_fit = get_linear_fit(women_no_pi_estimates)
+    trend = w_control_summary.mean(regression.T)
     ax[1].scatter(regression.T, trend, label='w/o Children', marker='o',
                   color=plot_utils.ALMOST_BLACK, alpha=0.5)
     ax[1].plot(np.arange(-5, 10, 0.1),
                [model(women_fit, t, False) for t in np.arange(-5, 10, 0.1)],
                linestyle='dotted', color=plot_utils.ALMOST_BLACK)
 
-    adjusted_trend = np.array(
-      [df_w_treated[df_w_treated['t'] == t]['y'].mean(skipna=True)
-       for t in regression.T])
+    adjusted_trend = w_treated_summary.mean(regression.T)
     ax[1].scatter(regression.T, adjusted_trend, label='w/ Children', marker='o',
                   color=plot_utils.ACCENT_COLOR, alpha=0.5)
     ax[1].plot(np.arange(-5, 10, 0.1),
@@ -1048,15 +996,12 @@ if __name__ == '__main__':
     #
     fig, ax = plt.subplots(ncols=1, nrows=1,
                            figsize=plot_utils.SINGLE_FIG_SIZE)
-    trend = np.array([df_m_control[df_m_control['t'] == t]['y'].mean()
-                      for t in regression.T])
-    adjusted_trend = np.array([df_m_treated[df_m_treated['t'] == t]['y'].mean()
-                              for t in regression.T])
+    trend = m_control_summary.mean(regression.T)
+    adjusted_trend = m_treated_summary.mean(regression.T)
 
-    diffs = [[(df_m_control[(df_m_control['t'] == t)].y.sample(n=1).values[0] - df_m_treated[df_m_treated['t'] == t].y.sample(n=1).values[0])
-              for i in range(N_samples*10)] for t in regression.T]
-    sems = np.array(
-      [np.nanstd(diff)/np.count_nonzero(~np.isnan(diff)) for diff in diffs])
+    diffs = m_control.draws - \
+        panel.sample_by_t(df_m_treated, regression.T, N_samples*10)
+    sems = np.nanstd(diffs, axis=1)/np.count_nonzero(~np.isnan(diffs), axis=1)
 
     ax.plot(regression.T, adjusted_trend-trend, linestyle='-', marker='o',
             color=plot_utils.ALMOST_BLACK,
@@ -1068,15 +1013,12 @@ if __name__ == '__main__':
     #
     # Plot women's average productivity with and without kids
     #
-    trend = np.array(
-      [df_w_control[df_w_control['t'] == t]['y'].mean() for t in regression.T])
-    adjusted_trend = np.array(
-      [df_w_treated[df_w_treated['t'] == t]['y'].mean() for t in regression.T])
+    trend = w_control_summary.mean(regression.T)
+    adjusted_trend = w_treated_summary.mean(regression.T)
 
-    diffs = [[(df_w_control[(df_w_control['t'] == t)].y.sample(n=1).values[0] - df_w_treated[df_w_treated['t'] == t].y.sample(n=1).values[0])
-              for i in range(N_samples*10)] for t in regression.T]
-    sems = np.array(
-      [np.nanstd(diff)/np.count_nonzero(~np.isnan(diff)) for diff in diffs])
+    diffs = w_control.draws - \
+        panel.sample_by_t(df_w_treated, regression.T, N_samples*10)
+    sems = np.nanstd(diffs, axis=1)/np.count_nonzero(~np.isnan(diffs), axis=1)
 
     ax.plot(regression.T, adjusted_trend-trend, linestyle='-', marker='o',
             color=plot_utils.ACCENT_COLOR,
@@ -1259,15 +1201,17 @@ if __name__ == '__main__':
     #
     fig, ax = plt.subplots(ncols=1, nrows=1,
                            figsize=plot_utils.SINGLE_FIG_SIZE, sharey=True)
-    trend = cohort_utils.generate_average_cumulative(df_m_control).tolist()
-    std = regression.get_bootstrap_trajectories(df_m_control, N_samples)
+    trend = m_control_summary.cumulative_mean(regression.T)
+    std = regression.matrix_bootstrap_trajectories(
+      *m_control.person_time_matrix(), N_samples)
     ax.plot(regression.T, trend, label='Men', linestyle='-', marker='o',
             color=plot_utils.ALMOST_BLACK)
     ax.fill_between(regression.T, trend-2*std, trend+2*std,
                     color=plot_utils.ALMOST_BLACK, alpha=0.2)
 
-    adjusted_trend = cohort_utils.generate_average_cumulative(df_w_control).tolist()
-    std = regression.get_bootstrap_trajectories(df_w_control, N_samples)
+    adjusted_trend = w_control_summary.cumulative_mean(regression.T)
+    std = regression.matrix_bootstrap_trajectories(
+      *w_control.person_time_matrix(), N_samples)
     ax.plot(regression.T, adjusted_trend, label='Women', linestyle='-',
             marker='o', color=plot_utils.ACCENT_COLOR)
     ax.fill_between(regression.T, adjusted_trend-2*std, adjusted_trend+2*std,
@@ -1284,12 +1228,12 @@ if __name__ == '__main__':
 
     ax.text(
       0.95, 0.2, r'$\hat{\beta}_{6}$: %.2f [%.2f, %.2f]' %
-      tuple(compute_ci(pd.DataFrame(not_parents_shock_estimates).coef).values()),
+      tuple(not_parents_shock_estimates.values()),
       ha='right', va='center', transform=ax.transAxes,
       fontsize=plot_utils.LEGEND_SIZE)
     ax.text(
       0.95, 0.1, r'$\hat{\beta}_{7}$: %.2f [%.2f, %.2f]' %
-      tuple(compute_ci(pd.DataFrame(not_parents_slope_estimates).coef).values()),
+      tuple(not_parents_slope_estimates.values()),
       ha='right', va='center', transform=ax.transAxes,
       fontsize=plot_utils.LEGEND_SIZE)
 
@@ -1310,8 +1254,7 @@ if __name__ == '__main__':
     #
     fig, ax = plt.subplots(ncols=1, nrows=1,
                            figsize=plot_utils.SINGLE_FIG_SIZE, sharey=True)
-    trend = np.array(
-      [df_m_treated[df_m_treated['t'] == t]['y'].mean() for t in regression.T])
+    trend = m_treated_summary.mean(regression.T)
     std = regression.get_bootstrap_trajectories(df_m_treated, N_samples,
                                                 cumulative=False)
     ax.plot(regression.T, trend, label='Men', linestyle='-', marker='o',
@@ -1319,8 +1262,7 @@ if __name__ == '__main__':
     ax.fill_between(regression.T, trend-2*std, trend+2*std,
                     color=plot_utils.ALMOST_BLACK, alpha=0.2)
 
-    adjusted_trend = np.array(
-      [df_w_treated[df_w_treated['t'] == t]['y'].mean() for t in regression.T])
+    adjusted_trend = w_treated_summary.mean(regression.T)
     std = regression.get_bootstrap_trajectories(df_w_treated, N_samples,
                                                 cumulative=False)
     ax.plot(regression.T, adjusted_trend, label='Women', linestyle='-',
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import re
+import unicodedata
+
+import numpy as np
+
+
+"""
+Batch detection of a faculty member's position on the author lists of their
+publications.
+
+Names are normalized once (case, diacritics, punctuation, DBLP homonym
+suffixes such as "0001"). Each publication is first resolved by an exact
+match on the normalized name, then by a unique match on first initial and
+last name. Only publications left unresolved fall back to a fuzzy match,
+scored like fuzz.ratio with an edit distance computed for all of their
+authors at once.
+"""
+
+DBLP_SUFFIX = re.compile(r'\s+\d{4}$')
+NON_LETTERS = re.compile(r'[^a-z\s]')
+
+# Normalized names seen so far, keyed by the raw name
+_normalized_names = {}
+
+
+def normalize_name(name):
+    """ Lowercase, ASCII-folded name without punctuation or DBLP suffix """
+    normalized = _normalized_names.get(name)
+    if normalized is None:
+        normalized = DBLP_SUFFIX.sub('', name.strip())
+        if not normalized.isascii():
+            normalized = unicodedata.normalize('NFKD', normalized)
+            normalized = ''.join(c for c in normalized
+                                 if not unicodedata.combining(c))
+        normalized = NON_LETTERS.sub(' ', normalized.lower())
+        normalized = ' '.join(normalized.split())
+        _normalized_names[name] = normalized
+    return normalized
+
+
+def initials_key(normalized):
+    """ First initial and last name of a normalized name, e.g. "j smith" """
+    tokens = normalized.split()
+    if len(tokens) < 2:
+        return normalized
+    return tokens[0][0] + ' ' + tokens[-1]
+
+
+def similarity_scores(target, candidates):
+    """
+    fuzz.ratio style similarity (0-100) between target and each candidate,
+    i.e. 2 * LCS / (len(target) + len(candidate)), computed for all
+    candidates at once.
+    """
+    if len(candidates) == 0:
+        return np.zeros(0, dtype=int)
+
+    lengths = np.array([len(c) for c in candidates])
+    width = max(lengths.max(), 1)
+    codes = np.full((len(candidates), width), -1, dtype=np.int32)
+    for k, candidate in enumerate(candidates):
+        codes[k, :len(candidate)] = [ord(c) for c in candidate]
+
+    # Longest common subsequence, one row of the DP table per target char
+    previous = np.zeros((len(candidates), width + 1), dtype=np.int32)
+    for char in target:
+        current = np.zeros_like(previous)
+        matches = codes == ord(char)
+        for j in range(width):
+            current[:, j + 1] = np.where(
+                matches[:, j], previous[:, j] + 1,
+                np.maximum(previous[:, j + 1], current[:, j]))
+        previous = current
+    lcs = previous[np.arange(len(candidates)), lengths]
+
+    total = len(target) + lengths
+    # Two empty names are equal, as in fuzz.ratio
+    ratio = np.where(total > 0, 2.0 * lcs / np.maximum(total, 1), 1)
+    return np.round(100 * ratio).astype(int)
+
+
+def match_author_positions(faculty_name, author_lists):
+    """
+    Position of the faculty member on each author list (-1 for empty lists).
+    """
+    n_pubs = len(author_lists)
+    lengths = np.array([len(authors) for authors in author_lists], dtype=int)
+    positions = np.full(n_pubs, -1, dtype=int)
+    if lengths.sum() == 0:
+        return positions
+
+    names = [normalize_name(name) for authors in author_lists
+             for name in authors]
+    pub_ids = np.repeat(np.arange(n_pubs), lengths)
+    starts = np.cumsum(lengths) - lengths
+    within = np.arange(len(names)) - starts[pub_ids]
+
+    target = normalize_name(faculty_name)
+    normalized = np.array(names, dtype=object)
+
+    # Exact match on the normalized name (first occurrence on a paper)
+    exact = np.flatnonzero(normalized == target)
+    pubs, first = np.unique(pub_ids[exact], return_index=True)
+    positions[pubs] = within[exact[first]]
+
+    # Unique match on first initial and last name
+    target_key = initials_key(target)
+    keys = np.array([initials_key(name) for name in names], dtype=object)
+    initial = np.flatnonzero((keys == target_key) &
+                             (positions[pub_ids] < 0))
+    unique = np.bincount(pub_ids[initial], minlength=n_pubs) == 1
+    initial = initial[unique[pub_ids[initial]]]
+    positions[pub_ids[initial]] = within[initial]
+
+    # Fuzzy match for everything left, all remaining authors at once
+    unresolved = (positions[pub_ids] < 0) & (lengths[pub_ids] > 0)
+    candidates = np.flatnonzero(unresolved)
+    if len(candidates) > 0:
+        scores = similarity_scores(target, [names[k] for k in candidates])
+        # Highest score per paper, ties go to the earliest author
+        order = np.lexsort((within[candidates], -scores, pub_ids[candidates]))
+        best = candidates[order]
+        pubs, first = np.unique(pub_ids[best], return_index=True)
+        positions[pubs] = within[best[first]]
+
+    return positions
@@ -2,11 +2,17 @@
 
 import numpy as np
 import pandas as pd
+import patsy
+import scipy.stats
 import statsmodels.formula.api as smf
 
 # Fuzzy string matching for first/middle/last authorship detection
 from fuzzywuzzy import fuzz
 
+from scripts.author_matching import match_author_positions
+from scripts.panel import OffsetPanel
+from scripts.publication_store import missing_publications
+
 
 # DBLP Adjustments from "The misleading narrative..."
 GROW_SLOPE = 0.131873
@@ -29,6 +35,41 @@ def adjust(x):
     return (grow_adjust(x) * dblp_adjust(x))
 
 
+# Calendar years covered by dense yearly publication counts
+FIRST_YEAR = 1900
+LAST_YEAR = 2030
+YEARS = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+CENSOR_YEAR = 2020  # Publication counts from this year on are incomplete
+
+
+def year_factors(adjusted=True):
+    """
+    Factor applied to each year's publication count (over YEARS): the DBLP
+    adjustment if requested, and NaN for censored years.
+    """
+    factors = adjust(YEARS.astype(float)) if adjusted else np.ones(len(YEARS))
+    factors[YEARS >= CENSOR_YEAR] = np.nan
+    return factors
+
+
+def yearly_publication_counts(pubs, author_name=None, author_position=None):
+    """
+    Number of publications in each of YEARS, optionally restricted to
+    first/last authored publications.
+    """
+    if author_position is None:
+        years = [entry[0] for entry in pubs]
+    else:
+        role = FAP if author_position == "first" else LAP
+        roles = publication_roles(author_name, pubs)
+        years = [entry[0] for entry, pub_role in zip(pubs, roles)
+                 if pub_role == role]
+
+    years = np.asarray(years, dtype=float) - FIRST_YEAR
+    years = years[(years >= 0) & (years < len(YEARS))]
+    return np.bincount(years.astype(int), minlength=len(YEARS))
+
+
 # Authorship roles
 FAP = 0
 MAP = 1
@@ -52,53 +93,136 @@ def get_author_role(faculty_name, author_list):
         return MAP
 
 
+def roles_from_positions(positions, lengths):
+    """ Author role (FAP, MAP or LAP) from position on the author list """
+    roles = np.full(len(positions), MAP, dtype=int)
+    roles[(positions == lengths - 1) & (positions > 0)] = LAP
+    roles[positions == 0] = FAP
+    return roles
+
+
+def publication_roles(faculty_name, pubs):
+    """
+    Author role (FAP, MAP or LAP) of the faculty member on each publication,
+    matched in one batch. Roles are cached only on a PublicationStore (see
+    store_roles).
+    """
+    author_lists = [list(entry[1]) for entry in pubs]
+    positions = match_author_positions(faculty_name, author_lists)
+    lengths = np.array([len(authors) for authors in author_lists])
+    return roles_from_positions(positions, lengths)
+
+
 strategies = ['bootstrap', 'linear', 'quadratic', 'lognormal']
 
+# Variance reduction methods available for each strategy
+variance_reductions = {'bootstrap': ['stratified'],
+                       'lognormal': ['lhs', 'antithetic']}
+
 
-def allocate_placebo(treated, control, iterations=500, strategy='bootstrap'):
+def allocate_placebo(treated, control, iterations=500, strategy='bootstrap',
+                     rng=None, variance_reduction=None):
     if strategy not in strategies:
         raise NotImplementedError
+    if variance_reduction is not None and \
+       variance_reduction not in variance_reductions.get(strategy, []):
+        raise NotImplementedError
 
     if strategy == 'bootstrap':
-        return bootstrap_allocation(treated, control, iterations)
+        return bootstrap_allocation(treated, control, iterations, rng=rng,
+                                    stratified=(variance_reduction ==
+                                                'stratified'))
+    elif rng is not None and strategy in ['linear', 'quadratic']:
+        # Their resample of round i is seeded by i, as DataFrame.sample
+        raise ValueError('The %s strategy does not take an rng' % strategy)
     elif strategy == 'linear':
         return linear_allocation(treated, control, iterations)
     elif strategy == 'quadratic':
         return quadratic_allocation(treated, control, iterations)
     elif strategy == 'lognormal':
-        return lognormal_allocation(treated, control, iterations)
+        return lognormal_allocation(treated, control, iterations, rng=rng,
+                                    variance_reduction=variance_reduction)
 
 
-def bootstrap_allocation(treated, control, iterations):
-    predictions = []
-    for i, row in control.iterrows():
-        parent_birth_year = row.p_birth_year
-        delta = 0
+def stratified_uniforms(iterations, n, rng):
+    """
+    (iterations x n) uniforms where each column has exactly one value in
+    each of the strata [k/iterations, (k + 1)/iterations), in random order.
+    Every entry is still uniform on [0, 1), so each round is a valid draw.
+    """
+    strata = rng.permuted(np.tile(np.arange(iterations)[:, np.newaxis],
+                                  (1, n)), axis=0)
+    return (strata + rng.random((iterations, n))) / iterations
 
-        less_than_parent = (treated.p_birth_year <=
-                            (parent_birth_year + delta))
-        greater_than_parent = (treated.p_birth_year >=
-                               (parent_birth_year - delta))
 
-        comparison_group = treated[less_than_parent & greater_than_parent]
-        if len(comparison_group) == 0:
-            sample_pred = [np.nan]*iterations
+def normal_scores(iterations, n, rng, variance_reduction=None):
+    """
+    (iterations x n) standard normal draws: i.i.d., Latin hypercube ('lhs')
+    or antithetic pairs in consecutive rounds ('antithetic').
+    """
+    if variance_reduction == 'lhs':
+        return scipy.stats.norm.ppf(stratified_uniforms(iterations, n, rng))
+    if variance_reduction == 'antithetic':
+        half = rng.standard_normal(((iterations + 1) // 2, n))
+        return np.stack([half, -half], axis=1).reshape(-1, n)[:iterations]
+    return rng.standard_normal((iterations, n))
+
+
+def bootstrap_allocation(treated, control, iterations, rng=None,
+                         stratified=False):
+    """
+    Draw a placebo child birth year for every control person and iteration.
+    Each draw is sampled (with replacement) from the child birth years of
+    treated people sharing the control person's birth year. Treated people are
+    bucketed by birth year once, and every bucket is filled with a single
+    batched draw of shape (iterations, n_control_in_bucket).
+    With stratified=True, each control person's draws cover the quantiles of
+    their bucket's empirical distribution evenly across iterations.
+    Returns an (iterations x n_control) array; NaN where no parent matches.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    k_birth_years = {
+        p_birth_year: group.values
+        for p_birth_year, group in treated.groupby('p_birth_year')[
+            'k_birth_year']}
+
+    control_birth_years = control.p_birth_year.values
+    predictions = np.full((iterations, len(control)), np.nan)
+    for p_birth_year in np.unique(control_birth_years):
+        if p_birth_year not in k_birth_years:
+            continue
+        columns = np.flatnonzero(control_birth_years == p_birth_year)
+        if stratified:
+            values = np.sort(k_birth_years[p_birth_year])
+            u = stratified_uniforms(iterations, len(columns), rng)
+            predictions[:, columns] = values[
+                np.minimum((u * len(values)).astype(int), len(values) - 1)]
         else:
-            sample_pred = comparison_group.k_birth_year.sample(
-                    n=iterations, replace=True).values
+            predictions[:, columns] = rng.choice(
+                k_birth_years[p_birth_year], size=(iterations, len(columns)),
+                replace=True)
+
+    return predictions
 
-        predictions.append(sample_pred)
 
-    return np.array(predictions).transpose()
+LINEAR_FORMULA = ('k_birth_year ~ p_birth_year + gender + '
+                  'first_asst_job_year + prestige_frame')
+QUADRATIC_FORMULA = ('k_birth_year ~ p_birth_year + p_birth_year**2 + gender + '
+                     'first_asst_job_year + prestige_frame')
 
 
-def linear_allocation(treated, control, iterations):
+def linear_allocation(treated, control, iterations, batched=True):
+    if batched:
+        return batched_ols_allocation(treated, control, iterations,
+                                      LINEAR_FORMULA)
+
     predictions = []
     for i in range(iterations):
         # Build a model for a subset of the treated data
         sampled = treated.sample(n=len(treated), replace=True, random_state=i)
-        formula = 'k_birth_year ~ p_birth_year + gender + first_asst_job_year + prestige_frame'
-        mod = smf.ols(formula=formula, data=sampled)
+        mod = smf.ols(formula=LINEAR_FORMULA, data=sampled)
         res = mod.fit()
 
         # Return the predictions of this model
@@ -109,13 +233,16 @@ def linear_allocation(treated, control, iterations):
     return predictions
 
 
-def quadratic_allocation(treated, control, iterations):
+def quadratic_allocation(treated, control, iterations, batched=True):
+    if batched:
+        return batched_ols_allocation(treated, control, iterations,
+                                      QUADRATIC_FORMULA)
+
     predictions = []
     for i in range(iterations):
         # Build a model for a subset of the treated data
         sampled = treated.sample(n=len(treated), replace=True, random_state=i)
-        formula = 'k_birth_year ~ p_birth_year + p_birth_year**2 + gender + first_asst_job_year + prestige_frame'
-        mod = smf.ols(formula=formula, data=sampled)
+        mod = smf.ols(formula=QUADRATIC_FORMULA, data=sampled)
         res = mod.fit()
 
         # Return the predictions of this model for the control group
@@ -125,7 +252,89 @@ def quadratic_allocation(treated, control, iterations):
     return predictions
 
 
-def lognormal_allocation(treated, control, iterations):
+def bootstrap_weights(n, seeds):
+    """
+    Row weights (len(seeds) x n) of the bootstrap resamples drawn by
+    DataFrame.sample(n=n, replace=True, random_state=i) for i in seeds.
+    """
+    weights = np.empty((len(seeds), n))
+    for k, i in enumerate(seeds):
+        draws = np.random.RandomState(i).choice(n, size=n, replace=True)
+        weights[k] = np.bincount(draws, minlength=n)
+    return weights
+
+
+def batched_ols_allocation(treated, control, iterations, formula,
+                           chunk_size=1000):
+    """
+    Fit the OLS model once per bootstrap replicate of the treated group and
+    predict (rounded) child birth years for the control group.
+    The design matrix is built once; each replicate is a row-weight vector
+    and all replicates' normal equations are solved as a stack. Replicate i
+    uses the same resample as treated.sample(..., random_state=i).
+    Replicates whose design is rank deficient (e.g. every draw has the same
+    parent birth year) are fit with statsmodels instead, whose pseudoinverse
+    solution depends on the parameterization.
+    Returns an (iterations x n_control) array.
+    """
+    y, X = patsy.dmatrices(formula, treated, return_type='dataframe')
+    X_control = patsy.build_design_matrices(
+        [X.design_info], control, return_type='dataframe')[0]
+    X_control = X_control.reindex(control.index)
+
+    # Center non-constant columns so the normal equations stay well
+    # conditioned (calendar years are nearly collinear with the intercept).
+    # With an intercept this is a reparameterization; predictions are equal.
+    offsets = np.where(np.ptp(X.values, axis=0) > 0, X.values.mean(axis=0), 0)
+    design = X.values - offsets
+    design_control = X_control.values - offsets
+    outcome = y.values[:, 0]
+    k = design.shape[1]
+
+    # Every replicate's X'WX and X'Wy from one matrix product each
+    products = (design[:, :, None] * design[:, None, :]).reshape(-1, k*k)
+    moments = design * outcome[:, None]
+
+    # Patsy drops rows with missing values, map the remaining rows back
+    rows = treated.index.get_indexer(X.index)
+
+    predictions = np.empty((iterations, len(control)))
+    for start in range(0, iterations, chunk_size):
+        stop = min(start + chunk_size, iterations)
+        weights = bootstrap_weights(len(treated), range(start, stop))[:, rows]
+        gram = (weights @ products).reshape(-1, k, k)
+        moment = weights @ moments
+
+        full_rank = np.linalg.matrix_rank(gram, hermitian=True) == k
+        params = np.linalg.solve(gram[full_rank],
+                                 moment[full_rank][:, :, None])[:, :, 0]
+        predictions[start:stop][full_rank] = \
+            np.round(params @ design_control.T)
+
+        for i in np.arange(start, stop)[~full_rank]:
+            sampled = treated.sample(n=len(treated), replace=True,
+                                     random_state=i)
+            res = smf.ols(formula=formula, data=sampled).fit()
+            predictions[i] = np.round(
+                res.predict(control).reindex(control.index))
+
+    return predictions
+
+
+def lognormal_allocation(treated, control, iterations, rng=None,
+                         variance_reduction=None):
+    """
+    Draw the parent's age at birth from a lognormal fit to treated people of
+    the same birth year, from rng (np.random by default). With a
+    variance_reduction ('lhs' or 'antithetic'), the underlying normal draws
+    are stratified or paired across iterations.
+    """
+    if variance_reduction is not None:
+        if rng is None:
+            rng = np.random.default_rng()
+        scores = normal_scores(iterations, len(control), rng,
+                               variance_reduction)
+
     predictions = []
     for _, row in control.iterrows():
         parent_birth_year = row.p_birth_year
@@ -139,8 +348,15 @@ def lognormal_allocation(treated, control, iterations):
         comparison_group = treated[less_than_parent & greater_than_parent]
         if len(comparison_group) == 0:
             sample_age_preds = [np.nan]*iterations
+        elif variance_reduction is not None:
+            sample_age_preds = np.exp(
+                (comparison_group.k_birth_year -
+                 comparison_group.p_birth_year).mean() +
+                (comparison_group.k_birth_year -
+                 comparison_group.p_birth_year).std() *
+                scores[:, len(predictions)])
         else:
-            sample_age_preds = np.random.lognormal(
+            sample_age_preds = (np.random if rng is None else rng).lognormal(
                 mean=(comparison_group.k_birth_year -
                       comparison_group.p_birth_year).mean(),
                 sigma=(comparison_group.k_birth_year -
@@ -154,20 +370,31 @@ def lognormal_allocation(treated, control, iterations):
     return np.array(predictions).transpose()
 
 
-def construct_covariates(trend, person, k_birth_year, i,
-                         time, iteration, id_key):
+def person_covariates(person, id_key):
+    """
+    Time-invariant covariates of a person, (p_birth_year, tt_start_year, pi,
+    sid), or None if the person cannot be placed in the panel.
+    """
     p_birth_year = 2017.0 - person['age (actual)']  # Survey was run in 2017
 
     if person['prestige_frame'] is None:
-        return []
+        return None
     pi = person['prestige_frame']
 
     tt_start_year = person['first_asst_job_year']
     if (tt_start_year == '{}') or np.isnan(tt_start_year) or \
        (person['first_asst_job_year'] - p_birth_year) < 0:
-        return []
+        return None
+
+    return p_birth_year, tt_start_year, pi, person[id_key]
 
-    sid = person[id_key]
+
+def construct_covariates(trend, person, k_birth_year, i,
+                         time, iteration, id_key):
+    covariates = person_covariates(person, id_key)
+    if covariates is None:
+        return []
+    p_birth_year, tt_start_year, pi, sid = covariates
 
     # Add that productivity, career age, and event time to a data frame
     rows = []
@@ -192,136 +419,276 @@ def construct_covariates(trend, person, k_birth_year, i,
     return rows
 
 
-def compute_publication_trend(cohort, t_lower, t_upper, adjusted=True,
-                              author_position=None, control=False,
-                              predicted_k_birth=None, iterations=1,
-                              relative_to='first_child_birth', id_key='sid'):
-    rows = []
-    # Iterate through the population. For those with kids, count how many
-    # papers each person has in a given year from the range [t_lower, t_upper].
-    for count, (i, row) in enumerate(cohort.iterrows()):
-        if np.isnan(row['age (actual)']) or (row['dblp_pubs'] is np.nan) or \
-         (row['dblp_pubs'] is None):
+def store_roles(publications, rows, names):
+    """
+    Author role (FAP, MAP or LAP) on each publication of a PublicationStore,
+    resolved (once per store) for the people in rows, named names.
+    """
+    roles = publications.roles
+    for row, name in zip(rows, names):
+        if row < 0:
+            continue
+        span = publications.span(row)
+        if span.stop == span.start or roles[span.start] >= 0:
             continue
+        author_lists = [list(publications.authors[ids])
+                        for ids in publications.author_lists(row)]
+        positions = match_author_positions(name, author_lists)
+        lengths = np.array([len(authors) for authors in author_lists])
+        roles[span] = roles_from_positions(positions, lengths)
+    return roles
 
-        k_birth_years = []
-        if not control:
-            k_birth_years = [row[relative_to]]
-        else:
-            for iteration in range(iterations):
-                k_birth_years.append(predicted_k_birth[iteration][count])
+
+def publication_index(cohort, author_position=None, publications=None,
+                      id_key='sid'):
+    """
+    Dense yearly publication counts (n_cohort x len(YEARS)) of every person
+    in the cohort, built once so that any event time window is a slice.
+    Rows of people without publication data are zero. With a
+    PublicationStore (keyed by id_key), counts are taken from its arrays.
+    """
+    counts = np.zeros((len(cohort), len(YEARS)), dtype=int)
+    if publications is not None:
+        rows = publications.rows(cohort[id_key], cohort['dblp_pubs'])
+        owners, pubs = publications.select(rows)
+        if author_position is not None:
+            role = FAP if author_position == "first" else LAP
+            mine = store_roles(publications, rows, cohort['name'])[pubs] == role
+            owners, pubs = owners[mine], pubs[mine]
+        years = publications.pub_year[pubs] - FIRST_YEAR
+        keep = (years >= 0) & (years < len(YEARS))
+        np.add.at(counts, (owners[keep], years[keep]), 1)
+        return counts
+
+    for count, (pubs, name) in enumerate(zip(cohort['dblp_pubs'],
+                                             cohort['name'])):
+        if missing_publications(pubs):
+            continue
+        counts[count] = yearly_publication_counts(pubs, name, author_position)
+    return counts
+
+
+def panel_persons(cohort, k_birth, id_key='sid'):
+    """
+    Positions (in the cohort) of the people who can be placed in a panel for
+    (placebo) child birth years k_birth, and a DataFrame of their
+    time-invariant covariates.
+    """
+    eligible = []
+    persons = []
+    # Iterate through the population. Only people with publication data and
+    # (placebo) children born before the survey can be placed in the panel.
+    for count, (i, row) in enumerate(cohort.iterrows()):
+        if np.isnan(row['age (actual)']) or \
+           missing_publications(row['dblp_pubs']):
+            continue
 
         # If this year is in the future (relative to the survey date), then we
         # cannot consider this person in the control group.
-        if np.any([(k_birth_year == '{}') or np.isnan(k_birth_year) or
-                   (k_birth_year >= 2017) for k_birth_year in k_birth_years]):
+        k_birth_years = k_birth[:, count]
+        if np.any(np.isnan(k_birth_years) | (k_birth_years >= 2017)):
+            continue
+
+        covariates = person_covariates(row, id_key)
+        if covariates is None:
             continue
+        p_birth_year, tt_start_year, pi, sid = covariates
+
+        eligible.append(count)
+        persons.append([i, sid, p_birth_year, tt_start_year, pi])
+
+    persons = pd.DataFrame(persons, columns=['i', 'sid', 'p_birth_year',
+                                             'tt_start_year', 'pi'])
+    return eligible, persons
+
+
+def compute_publication_trend(cohort, t_lower, t_upper, adjusted=True,
+                              author_position=None, control=False,
+                              predicted_k_birth=None, iterations=1,
+                              relative_to='first_child_birth', id_key='sid',
+                              compact=False, cache=None, publications=None):
+    """
+    Publication counts of each person in the cohort for event times
+    [t_lower, t_upper] relative to their (placebo) child's birth.
+    With compact=True, an OffsetPanel is returned instead of one row per
+    person, round and event time. Trends of observed births can be taken
+    from (and added to) a TrendCache. Publications are read from a
+    PublicationStore keyed by id_key, if given, instead of dblp_pubs.
+    """
+    if cache is not None and not control and not compact:
+        return cache.publication_trend(cohort, t_lower, t_upper, adjusted,
+                                       author_position, relative_to, id_key)
 
-        # Name used for finding first/last author publication trends
-        author_name = row['name']
+    if not control:
+        k_birth = pd.to_numeric(cohort[relative_to], errors='coerce').values
+        k_birth = k_birth[np.newaxis, :]
+    else:
+        k_birth = np.asarray(predicted_k_birth, dtype=float)[:iterations]
 
-        # Get productivity
-        for iteration, k_birth_year in enumerate(k_birth_years):
-            trend = []
-            T = range(t_lower, t_upper + 1)
+    panel = compute_publication_panel(cohort, t_lower, t_upper, k_birth,
+                                      adjusted=adjusted,
+                                      author_position=author_position,
+                                      id_key=id_key, publications=publications)
+    if compact:
+        return panel
+    return panel.materialize(order='person')
 
-            for j in T:
-                yearly_pubs = 0
-                if author_position is None:
-                    pubs = [entry[0] for entry in row['dblp_pubs']]
-                    yearly_pubs = np.count_nonzero(
-                        np.array(pubs) == (k_birth_year + j))
-                elif author_position == "last":
-                    la_pubs = [entry[0] for entry in row['dblp_pubs'] if
-                               get_author_role(author_name, entry[1]) == LAP]
-                    yearly_pubs = np.count_nonzero(
-                        np.array(la_pubs) == (k_birth_year + j))
-                elif author_position == "first":
-                    fa_pubs = [entry[0] for entry in row['dblp_pubs'] if
-                               get_author_role(author_name, entry[1]) == FAP]
-                    yearly_pubs = np.count_nonzero(
-                        np.array(fa_pubs) == (k_birth_year + j))
 
-                if (k_birth_year + j) >= 2020:
-                    trend.append(np.nan)
-                    continue
+def compute_publication_panel(cohort, t_lower, t_upper, k_birth,
+                              adjusted=True, author_position=None,
+                              id_key='sid', publications=None):
+    """
+    Publication trends as an OffsetPanel: each person's yearly publication
+    counts are stored once, alongside their (placebo) child birth years
+    k_birth, an (n_rounds x n_cohort) array.
+    """
+    eligible, persons = panel_persons(cohort, k_birth, id_key)
+    counts = publication_index(cohort.iloc[eligible], author_position,
+                               publications, id_key)
 
-                adjustment = 1
-                if adjusted:
-                    adjustment = adjust(k_birth_year + j)
+    return OffsetPanel(counts, year_factors(adjusted), FIRST_YEAR,
+                       k_birth[:, eligible], persons, t_lower, t_upper)
 
-                trend.append(yearly_pubs*adjustment)
 
-            rows.extend(construct_covariates(trend, row, k_birth_year,
-                                             i, T, iteration, id_key))
+class TrendCache(object):
+    """
+    Publication trend rows of every person computed so far, keyed by
+    (anchor column, t window, adjusted, author_position, id_key) and by the
+    person's index label. A trend of a cohort only computes the people not
+    seen before, and is assembled from the cached rows of its people in
+    cohort order. Cohorts must be subsets of one faculty frame (a person's
+    id_key value is checked against the one cached for their label). New
+    trends read the PublicationStore of that frame, if given.
+    """
 
-    return pd.DataFrame(rows, columns=['y', 't', 'age', 's', 'c', 'i_t',
-                                       'i', 'pi', 'round', 'sid'])
+    def __init__(self, publications=None):
+        self.trends = {}
+        self.ids = {}
+        self.publications = publications
+
+    def publication_trend(self, cohort, t_lower, t_upper, adjusted=True,
+                          author_position=None,
+                          relative_to='first_child_birth', id_key='sid'):
+        key = (relative_to, t_lower, t_upper, adjusted, author_position,
+               id_key)
+        rows, positions = self.trends.get(key, (None, {}))
+
+        missing = ~cohort.index.isin(list(positions))
+        for i, person_id in zip(cohort.index, cohort[id_key]):
+            cached_id = self.ids.setdefault(i, person_id)
+            if cached_id != person_id and not (pd.isna(cached_id) and
+                                               pd.isna(person_id)):
+                raise ValueError('Cohort is not a subset of the cached frame')
+
+        if missing.any() or rows is None:
+            new_rows = compute_publication_trend(
+                cohort[missing], t_lower, t_upper, adjusted=adjusted,
+                author_position=author_position, relative_to=relative_to,
+                id_key=id_key, publications=self.publications)
+            if rows is not None and len(rows) > 0:
+                new_rows = pd.concat([rows, new_rows], ignore_index=True)
+            rows = new_rows
+            # People without rows (not placeable in the panel) are cached too
+            positions = dict.fromkeys(list(positions) + list(cohort.index),
+                                      np.array([], dtype=int))
+            positions.update(rows.groupby('i').indices)
+            self.trends[key] = (rows, positions)
+
+        take = np.concatenate([positions[i] for i in cohort.index] +
+                              [np.array([], dtype=int)])
+        return rows.iloc[take].reset_index(drop=True)
+
+
+COAUTHOR_CENSOR_YEAR = 2019  # New coauthor counts from this year on are NaN
+
+
+def yearly_new_coauthors(pubs):
+    """
+    Number of coauthors first collaborated with in each of YEARS. The
+    person is subtracted from the count of their first publication year.
+    """
+    if len(pubs) == 0:
+        return np.zeros(len(YEARS), dtype=int)
 
+    lengths = [len(entry[1]) for entry in pubs]
+    years = np.repeat([entry[0] for entry in pubs], lengths).astype(int)
+    # Author IDs only need to be consistent within one person's publications
+    authors, _ = pd.factorize(np.array(
+        [name for entry in pubs for name in entry[1]], dtype=object))
+    return new_coauthor_counts(years, authors,
+                               min(entry[0] for entry in pubs))
 
-def compute_coauthor_trend(cohort, t_lower, t_upper, control=False,
-                           predicted_k_birth=None, iterations=1,
-                           relative_to='first_child_birth'):
-    rows = []
-    # Iterate through the population. For those with kids, count how many
-    # papers each person has in a given year from the range [t_lower, t_upper]
-    for count, (i, row) in enumerate(cohort.iterrows()):
-        if np.isnan(row['age (actual)']) or (row['dblp_pubs'] is np.nan) or \
-         (row['dblp_pubs'] is None):
-            continue
 
-        k_birth_years = []
-        if not control:
-            k_birth_years = [row[relative_to]]
-        else:
-            for iteration in range(iterations):
-                k_birth_years.append(predicted_k_birth[iteration][count])
+def new_coauthor_counts(years, authors, first_year):
+    """
+    yearly_new_coauthors from the year and author ID of every authorship and
+    the year of the person's first publication
+    """
+    counts = np.zeros(len(YEARS), dtype=int)
 
-        # If this year is in the future (relative to the survey date), then we
-        # cannot consider this person in the control group.
-        if np.any([(k_birth_year >= 2017) or np.isnan(k_birth_year)
-                   for k_birth_year in k_birth_years]):
+    # First collaboration year of each coauthor
+    order = np.lexsort((years, authors))
+    _, first = np.unique(authors[order], return_index=True)
+    first_years = years[order][first] - FIRST_YEAR
+    first_years = first_years[(first_years >= 0) &
+                              (first_years < len(YEARS))]
+    counts += np.bincount(first_years, minlength=len(YEARS))
+
+    start = first_year - FIRST_YEAR
+    if 0 <= start < len(YEARS):
+        counts[start] -= 1
+    return counts
+
+
+def coauthor_index(cohort, publications=None, id_key='sid'):
+    """
+    Dense yearly new coauthor counts (n_cohort x len(YEARS)) of every person
+    in the cohort. Rows of people without publication data are zero. With a
+    PublicationStore (keyed by id_key), counts are taken from its arrays.
+    """
+    counts = np.zeros((len(cohort), len(YEARS)), dtype=int)
+    if publications is not None:
+        rows = publications.rows(cohort[id_key], cohort['dblp_pubs'])
+        for count, row in enumerate(rows):
+            years = publications.years(row) if row >= 0 else []
+            if len(years) > 0:
+                counts[count] = new_coauthor_counts(
+                  *publications.authorships(row), years.min())
+        return counts
+
+    for count, pubs in enumerate(cohort['dblp_pubs']):
+        if missing_publications(pubs):
             continue
+        counts[count] = yearly_new_coauthors(pubs)
+    return counts
+
+
+def compute_coauthor_trend(cohort, t_lower, t_upper, control=False,
+                           predicted_k_birth=None, iterations=1,
+                           relative_to='first_child_birth', id_key='sid',
+                           compact=False, publications=None):
+    """
+    Number of new coauthors of each person in the cohort for event times
+    [t_lower, t_upper] relative to their (placebo) child's birth.
+    With compact=True, an OffsetPanel is returned instead of one row per
+    person, round and event time. Publications are read from a
+    PublicationStore keyed by id_key, if given, instead of dblp_pubs.
+    """
+    if not control:
+        k_birth = pd.to_numeric(cohort[relative_to], errors='coerce').values
+        k_birth = k_birth[np.newaxis, :]
+    else:
+        k_birth = np.asarray(predicted_k_birth, dtype=float)[:iterations]
+
+    eligible, persons = panel_persons(cohort, k_birth, id_key)
+    counts = coauthor_index(cohort.iloc[eligible], publications, id_key)
+    factors = np.where(YEARS >= COAUTHOR_CENSOR_YEAR, np.nan, 1.0)
 
-        # Get coauthors
-        post_kid_coauths = {}
-        for entry in row['dblp_pubs']:
-            if not entry[0] in post_kid_coauths:
-                post_kid_coauths[entry[0]] = []
-            post_kid_coauths[entry[0]].extend(entry[1])
-
-        # Number of new unique coauthors over time
-        total_coauth_set = set()
-        uniq_coauth_trend = []
-
-        for k, (year, coauths) in enumerate(sorted(post_kid_coauths.items())):
-            n_new_coauths = len(set(coauths).difference(total_coauth_set))
-            if k == 0:
-                # Subtract off the person from their coauthor list
-                n_new_coauths = n_new_coauths - 1
-            uniq_coauth_trend.append((year, n_new_coauths))
-            total_coauth_set.update(set(coauths))
-
-        # Trend relative to child's birth year
-        for iteration, k_birth_year in enumerate(k_birth_years):
-            trend = []
-            T = range(t_lower, t_upper + 1)
-
-            for j in T:
-                yearly_coauths = 0
-                if (k_birth_year + j) in dict(uniq_coauth_trend):
-                    yearly_coauths = dict(uniq_coauth_trend)[k_birth_year + j]
-
-                if (k_birth_year + j) >= 2019:
-                    yearly_coauths = np.nan
-
-                trend.append(yearly_coauths)
-
-            rows.extend(construct_covariates(trend, row, k_birth_year,
-                                             i, T, iteration))
-
-    return pd.DataFrame(rows, columns=['y', 't', 'age', 's', 'c', 'i_t',
-                                       'i', 'pi', 'round'])
+    panel = OffsetPanel(counts, factors, FIRST_YEAR, k_birth[:, eligible],
+                        persons, t_lower, t_upper)
+    if compact:
+        return panel
+    return panel.materialize(order='person')
 
 
 def generate_average_cumulative(df, agg='mean'):
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import patsy
+import scipy.stats
+
+from scripts.panel import SharedPanel, concat_rows
+from scripts.running_stats import RunningEstimates
+
+
+"""
+Difference-in-differences OLS fits for many placebo rounds.
+
+Every round fits the same formula to one fixed block of rows (e.g. the
+treated panel, identical in all rounds) plus that round's control rows.
+A DiDFitter builds the design for the formula once, caches X'X, X'y and y'y
+of the fixed block, and per round only adds the control block before
+solving the normal equations. Estimates, standard errors and p-values
+match statsmodels' OLS.
+
+All rounds of all model families are fit on one pool of workers (see
+fit_families). Workers read their rows from panels published once in shared
+memory (see panel.SharedPanel), so a task is just a family and a round
+number. They only send back one compact record per round (see
+result_dtype), which the parent folds into running summaries per family.
+Optionally, rounds are fit in batches until the Monte Carlo standard error
+of the shock and slope coefficients reaches a tolerance.
+
+fit_stream instead fits rounds as their rows are produced (e.g. read from a
+round_stream.RoundRing written by allocation.py): workers reduce each batch
+of rounds to per-round sufficient statistics, and the parent solves a round
+once the statistics of all of its sources are in.
+"""
+
+
+def result_dtype(k):
+    """
+    Record of one round's fit of a model with k coefficients: what the
+    running summaries take (coefficients and the t = 0 expectation). Each
+    round's standard errors and p-values are not sent, as the placebo
+    summaries are taken across rounds.
+    """
+    return np.dtype([('params', float, (k,)), ('expectation', float)])
+
+
+def design_columns(formula, data):
+    """ Names of the coefficients of formula, in the order they are fit """
+    return patsy.dmatrices(formula, data)[1].design_info.column_names
+
+
+class DiDResult(object):
+    """ The parts of a statsmodels RegressionResults used by the DiD script """
+
+    def __init__(self, params, bse, df_resid, nobs, expectation):
+        self.params = params
+        self.bse = bse
+        self.df_resid = df_resid
+        self.nobs = nobs
+        self.expectation = expectation
+
+        self.tvalues = params / bse
+        self.pvalues = pd.Series(
+            2*scipy.stats.t.sf(np.abs(self.tvalues), df_resid),
+            index=params.index)
+
+    def conf_int(self, alpha=0.05):
+        q = scipy.stats.t.ppf(1 - alpha/2.0, self.df_resid)
+        return pd.DataFrame({0: self.params - q*self.bse,
+                             1: self.params + q*self.bse})
+
+    def record(self):
+        """ The fit as a row of a result_dtype array """
+        return (self.params.values, self.expectation)
+
+
+class DiDFitter(object):
+    """
+    formula:   patsy formula of the model, e.g.
+               'y ~ t + C(t>0) + t:C(t>0) + C(parent) + ... + pi'
+    fixed:     rows shared by every round (None if there are none)
+    template:  rows containing every level of the formula's categorical
+               terms, used to build the design once (e.g. fixed + round 0)
+    group:     boolean column selecting the rows (at t = 0) over which the
+               expectation of the fitted model is averaged
+
+    Rows are given as DataFrames or as dicts of column arrays.
+    """
+
+    def __init__(self, formula, fixed, template, group='parent'):
+        y, X = patsy.dmatrices(formula, template, return_type='dataframe')
+        self.design_infos = [y.design_info, X.design_info]
+        self.columns = X.columns
+        self.group = group
+        self.fixed = self.empty_block() if fixed is None else \
+            self.block(fixed)
+
+    def empty_block(self):
+        k = len(self.columns)
+        return (np.zeros((k, k)), np.zeros(k), 0.0, 0, np.zeros(k), 0)
+
+    def block(self, data):
+        """
+        Sufficient statistics of a block of rows: X'X, X'y, y'y, number of
+        complete rows, and the sum and count of design rows in the
+        expectation group at t = 0.
+        """
+        if len(data['t']) == 0:
+            return self.empty_block()
+
+        # Rows with missing values are dropped, as statsmodels does
+        y, X = patsy.build_design_matrices(self.design_infos, data)
+        y = np.asarray(y)[:, 0]
+        X = np.asarray(X)
+
+        target = (np.asarray(data['t']) == 0) & \
+            np.asarray(data[self.group], dtype=bool)
+        if target.any():
+            X_target = np.asarray(patsy.build_design_matrices(
+                self.design_infos[1:],
+                {c: np.asarray(data[c])[target] for c in data})[0])
+        else:
+            X_target = np.zeros((0, len(self.columns)))
+
+        return (X.T @ X, X.T @ y, y @ y, len(y),
+                X_target.sum(axis=0), len(X_target))
+
+    def fit(self, *data):
+        """ Fit the model to the fixed rows plus one or more blocks of rows """
+        return self.solve(*[self.block(rows) for rows in data])
+
+    def solve(self, *blocks):
+        """ Fit the model to the fixed rows plus blocks' statistics """
+        XtX, Xty, yty, n, target_sum, n_target = [
+            sum(parts) for parts in zip(self.fixed, *blocks)]
+
+        cov = np.linalg.pinv(XtX)
+        beta = cov @ Xty
+        df_resid = n - np.linalg.matrix_rank(XtX)
+        ssr = yty - beta @ Xty
+        bse = np.sqrt(np.diag(cov) * ssr / df_resid)
+
+        expectation = target_sum @ beta / n_target if n_target else np.nan
+        return DiDResult(pd.Series(beta, index=self.columns),
+                         pd.Series(bse, index=self.columns),
+                         df_resid, n, expectation)
+
+
+def family_template(fixed, panels):
+    """ Rows of the first round (and fixed rows) of a model family """
+    rows = [panel.rows(0) for panel in panels]
+    if fixed is not None:
+        rows.append(fixed.rows())
+    return concat_rows(rows)
+
+
+# Fitters and shared panels of the worker process, by model family
+_families = {}
+
+
+def init_worker(families):
+    """
+    Pool initializer: attach to the shared panels and build the worker's
+    fitter of every model family once. `families` maps a family name to
+    (formula, fixed, panels, group), with the specs of the SharedPanel of the
+    rows shared by every round (or None) and of the SharedPanels whose rows
+    of a round are fit together.
+    """
+    attached = {}
+
+    def attach(spec):
+        key = tuple(sorted(name for name, _, _ in spec['columns'].values()))
+        if key not in attached:
+            attached[key] = SharedPanel.attach(spec)
+        return attached[key]
+
+    for family, (formula, fixed, panels, group) in families.items():
+        fixed = None if fixed is None else attach(fixed)
+        panels = [attach(spec) for spec in panels]
+        fitter = DiDFitter(formula, None if fixed is None else fixed.rows(),
+                           family_template(fixed, panels), group)
+        _families[family] = (fitter, panels, fixed)
+
+
+def fit_round(task):
+    """ Fit round k of a model family with the worker's fitter """
+    family, k = task
+    fitter, panels, _ = _families[family]
+    return family, k, fitter.fit(*[panel.rows(k) for panel in panels]).record()
+
+
+def shock_and_slope(group):
+    """ Coefficients of the shock and slope change of `group` at t > 0 """
+    shock = 'C(%s)[T.True]:C(t > 0)[T.True]' % group
+    return shock, shock + ':t'
+
+
+def converged(estimates, targets, tolerance):
+    """ Whether the Monte Carlo standard error of every target is small """
+    return estimates.n > 1 and all(estimates.sem(name) <= tolerance
+                                   for name in targets)
+
+
+def fit_families(families, processes, exact=False, tolerance=None,
+                 batch_size=250):
+    """
+    Fit every round of every model family on one pool of workers.
+    `families` maps a family name to (formula, fixed, panels, group) with
+    published SharedPanels. Rounds of all families are interleaved so that
+    every worker stays busy, and each record is streamed into its family's
+    RunningEstimates (coefficients plus 'expectation') as soon as it
+    arrives; per-round records are not kept. Returns {family: estimates}.
+
+    With a tolerance, rounds are fit in batches of batch_size and a family
+    stops once the Monte Carlo standard error of its shock and slope
+    coefficients is at most the tolerance (or its rounds run out). The rounds
+    used are then each estimates' `n`.
+    """
+    estimates = {}
+    n_rounds = {}
+    specs = {}
+    targets = {}
+    for family, (formula, fixed, panels, group) in families.items():
+        columns = design_columns(formula, family_template(fixed, panels))
+        estimates[family] = RunningEstimates(columns + ['expectation'],
+                                             exact=exact)
+        n_rounds[family] = min(panel.n_rounds for panel in panels)
+        specs[family] = (formula, None if fixed is None else fixed.spec,
+                         [panel.spec for panel in panels], group)
+        targets[family] = shock_and_slope(group)
+
+    if tolerance is None:
+        batch_size = max(max(n_rounds.values()), 1)
+    active = list(families)
+    with Pool(processes, initializer=init_worker, initargs=(specs,)) as pool:
+        for start in range(0, max(n_rounds.values()), batch_size):
+            tasks = [(family, k)
+                     for k in range(start, start + batch_size)
+                     for family in active if k < n_rounds[family]]
+            for family, k, record in pool.imap_unordered(fit_round, tasks,
+                                                         chunksize=8):
+                params, expectation = record
+                estimates[family].add(np.append(params, expectation))
+
+            if tolerance is not None:
+                active = [family for family in active
+                          if not converged(estimates[family],
+                                           targets[family], tolerance)]
+            if not active:
+                break
+
+    return estimates
+
+
+# Fitters of the worker process for streamed batches, by model family
+_stream_fitters = {}
+
+
+def block_rounds(task):
+    """ Sufficient statistics of every round of a streamed batch of rows """
+    family, formula, group, source, rows = task
+    fitter = _stream_fitters.get(family)
+    if fitter is None:
+        fitter = _stream_fitters[family] = DiDFitter(formula, None, rows,
+                                                     group)
+
+    order = np.argsort(rows['round'], kind='stable')
+    rounds = rows['round'][order]
+    starts = np.flatnonzero(np.r_[True, rounds[1:] != rounds[:-1]])
+    stops = np.append(starts[1:], len(rounds))
+    blocks = [(rounds[start], fitter.block(
+                  {c: values[order[start:stop]] for c, values in rows.items()}))
+              for start, stop in zip(starts, stops) if stop > start]
+    return family, source, blocks
+
+
+def fit_stream(families, batches, processes, exact=False, depth=None,
+               tolerance=None):
+    """
+    Fit every round of every model family as its rows stream in.
+    `families` maps a family name to (formula, fixed, sources, group), where
+    fixed names the source whose (single) batch holds the rows shared by
+    every round, or is None, and the rows of a round of all `sources` are
+    fit together. `batches` yields (source, rows) with whole rounds per batch;
+    a family's fixed batch must come before the batches of its sources.
+    At most `depth` tasks (a family's batch; two per process by default)
+    are in flight, so memory does not grow with the number of rounds. Returns
+    {family: estimates}, as fit_families.
+
+    With a tolerance, a family stops once the Monte Carlo standard error of
+    its shock and slope coefficients is at most the tolerance, checked after
+    each of its batches: its later batches are not fit, and the rounds used
+    are its estimates' `n`. `batches` is still read to the end, so that a
+    producer writing into a bounded ring is never left waiting.
+    """
+    depth = depth or 2*processes
+    fitters = {}
+    estimates = {}
+    partial = {family: {} for family in families}
+    stopped = set()
+
+    def start(family, fixed, template):
+        formula, _, _, group = families[family]
+        fitters[family] = DiDFitter(formula, fixed, template, group)
+        estimates[family] = RunningEstimates(
+            list(fitters[family].columns) + ['expectation'], exact=exact)
+
+    def collect(result):
+        family, source, blocks = result
+        if family in stopped:
+            return
+        sources = families[family][2]
+        for k, block in blocks:
+            parts = partial[family].setdefault(k, {})
+            parts[source] = block
+            if len(parts) == len(sources):
+                del partial[family][k]
+                res = fitters[family].solve(*[parts[s] for s in sources])
+                estimates[family].add(np.append(res.params.values,
+                                                res.expectation))
+        if tolerance is not None and converged(
+                estimates[family], shock_and_slope(families[family][3]),
+                tolerance):
+            stopped.add(family)
+            partial[family].clear()
+
+    in_flight = deque()
+    with Pool(processes) as pool:
+        for source, rows in batches:
+            rows = {c: np.asarray(rows[c]) for c in rows}
+            for family, (formula, fixed, sources, group) in families.items():
+                if source == fixed:
+                    start(family, rows, rows)
+                elif source in sources and family not in stopped:
+                    if family not in fitters:
+                        start(family, None, rows)
+                    in_flight.append(pool.apply_async(
+                        block_rounds, ((family, formula, group, source,
+                                        rows),)))
+            while len(in_flight) > depth:
+                collect(in_flight.popleft().get())
+        while in_flight:
+            collect(in_flight.popleft().get())
+
+    return {family: estimates[family] for family in families
+            if family in estimates}
+
+
+def precision_report(estimates, families):
+    """ Rounds used and Monte Carlo standard error of shock and slope """
+    lines = []
+    for family, family_estimates in estimates.items():
+        shock, slope = shock_and_slope(families[family][3])
+        mcse = 'shock %.4g, slope %.4g' % (family_estimates.sem(shock),
+                                           family_estimates.sem(slope))
+        lines.append('%s: %d rounds (MCSE %s)' % (family, family_estimates.n,
+                                                  mcse))
+    return '\n'.join(lines)
@@ -1,8 +1,14 @@
 
 import pandas as pd
 import numpy as np
-import csv
+import os
+import multiprocessing
 
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts import reference_data, snapshot
+from scripts.parse import institution_parser
+from scripts.reference_data import PRESTIGE, PARENTAL_LEAVE
 from scripts.parse.institution_parser import INST_NAME_ALIASES
 
 BUSI_HIS_RESPONSES = '../data/survey_data/his_busi_survey/main_sep2019.xlsx'
@@ -16,8 +22,42 @@ CS_RESPONSES = '../data/survey_data/cs_survey/data_15oct2017_final2f.xlsx'
 CS_FRAME = '../data/survey_data/cs_survey/frame_jun8_2018.xlsx'
 CS_PUBS = '../data/survey_data/cs_pubs/cs_prior_productivity_authorship_feb5_2020.json'
 
-PRESTIGE = '../data/survey_data/faculty_2011/%s_vertexlist.txt'
-PARENTAL_LEAVE = '../data/survey_data/parental_leave/parental_leave_policies_apr_2018.tsv'
+
+BUSI_HIS_WORKBOOKS = [BUSI_HIS_RESPONSES, HIS_FRAME_HEADS, HIS_FRAME_ALL,
+                      BUSI_FRAME_HEADS, BUSI_FRAME_ALL]
+CS_WORKBOOKS = [CS_FRAME, CS_RESPONSES]
+
+# Snapshot of the merged and cleaned faculty frame (see load_all_faculty)
+FACULTY_SNAPSHOT = '../data/survey_data/faculty_snapshot'
+
+# Everything the faculty frame is built from, including this cleaning code
+FACULTY_SOURCES = [
+    BUSI_HIS_RESPONSES, HIS_FRAME_HEADS, HIS_FRAME_ALL, BUSI_FRAME_HEADS,
+    BUSI_FRAME_ALL, BUSI_HIS_PUBS, CS_RESPONSES, CS_FRAME, CS_PUBS,
+    PRESTIGE % 'Business', PRESTIGE % 'History', PRESTIGE % 'CS',
+    PARENTAL_LEAVE, os.path.abspath(__file__),
+    os.path.abspath(reference_data.__file__),
+    os.path.abspath(institution_parser.__file__)]
+
+CHILD_BIRTH_YEARS = ['chage1', 'chage2', 'chage3', 'chage4', 'chage5',
+                     'chage6', 'chage7', 'chage8', 'chage9']
+
+# Mis-typed child birth years: (column, value as entered, corrected value)
+CHILD_BIRTH_YEAR_FIXES = [
+    ('chage1', 200, 2000), ('chage1', 199, 1999), ('chage1', 1900, np.nan),
+    ('chage1', 69, 1969), ('chage1', 93, 1993), ('chage1', 61, 1961),
+    ('chage2', 218, 2018), ('chage2', 199, 1990), ('chage2', 69, 1969),
+    ('chage2', 95, 1995), ('chage2', 19885, 1985), ('chage2', 98, 1998),
+    ('chage2', 78, 1978), ('chage2', 2973, 1973), ('chage2', 70, 1970),
+    ('chage3', 74, 1974), ('chage3', 20016, 2016), ('chage3', 72, 1972),
+    ('chage3', 81, 1981), ('chage3', 97, 1997), ('chage3', 2, np.nan),
+    ('chage5', 1, np.nan)]
+
+# Numeric answers on publication aims and norms
+NORM_COLUMNS = ['aim_max', 'aim_min',
+                'desnorm_wchild', 'desnorm_wnochild', 'desnorm_mchild',
+                'desnorm_mnochild', 'injnorm_wchild', 'injnorm_wnochild',
+                'injnorm_mchild', 'injnorm_mnochild']
 
 codebook_age = dict(list(zip(range(1, 82, 1), range(1996, 1915, -1))))
 codebook_age[-77] = None
@@ -25,106 +65,107 @@ codebook_age[0] = None
 codebook_age[np.nan] = None
 
 
-def load_all_faculty():
+def recode(df, fixes):
+    """ Apply a table of (column, bad value, fixed value) column by column """
+    by_column = {}
+    for column, bad, fixed in fixes:
+        by_column.setdefault(column, {})[bad] = fixed
+    for column, replacements in by_column.items():
+        df[column] = df[column].replace(replacements)
+    return df
+
+
+def load_all_faculty(snapshot_dir=FACULTY_SNAPSHOT):
+    """
+    Survey responses of all fields, merged with the frames, publications,
+    prestige and parental leave data. Served from the snapshot in
+    snapshot_dir while none of FACULTY_SOURCES changed, and rebuilt (and
+    snapshot again) when any did. With snapshot_dir None, always rebuilt.
+    """
+    return snapshot.cached(snapshot_dir, FACULTY_SOURCES, build_all_faculty)
+
+
+def read_workbook(path):
+    return pd.read_excel(path)
+
+
+def read_workbooks(paths, processes=None):
+    """
+    {path: DataFrame} of the Excel workbooks at paths, decoded concurrently
+    by processes (one per workbook by default). Workers are forked, so the
+    calling script is not re-imported in them (it loads the data at import
+    time). Where fork is not available, workbooks are read one at a time.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return {path: read_workbook(path) for path in paths}
+    with ProcessPoolExecutor(processes or len(paths),
+                             mp_context=multiprocessing.get_context('fork')) \
+            as pool:
+        return dict(zip(paths, pool.map(read_workbook, paths)))
+
+
+def build_all_faculty():
+    # Decode all the workbooks at once, before any merging
+    workbooks = read_workbooks(BUSI_HIS_WORKBOOKS + CS_WORKBOOKS)
+
     # Read in Business / History responses
-    busi_his_merged = load_business_history_faculty()
+    busi_his_merged = load_business_history_faculty(workbooks)
 
     # Read in the CS publications and responses
-    cs_merged = load_cs_faculty()
+    cs_merged = load_cs_faculty(workbooks)
 
     # Merge all the responses together!
     df = pd.concat([busi_his_merged, cs_merged], axis=0, sort=False)
 
+    return clean_faculty(df)
+
+
+def clean_faculty(df):
+    """
+    Fix the child birth years, derive the parenthood columns from them and
+    treat non-numeric and negative (coded) norm answers as missing.
+    """
     # This child age field is a bit messy. Since we focus on first child,
     # these aren't too big a deal.
-    df.loc[df.chage1 == 200, 'chage1'] = 2000  # We should fix these.
-    df.loc[df.chage1 == 199, 'chage1'] = 1999
-    df.loc[df.chage1 == 1900, 'chage1'] = np.nan
-    df.loc[df.chage1 == 69, 'chage1'] = 1969
-    df.loc[df.chage1 == 93, 'chage1'] = 1993
-    df.loc[df.chage1 == 61, 'chage1'] = 1961
-
-    df.loc[df.chage2 == 218, 'chage2'] = 2018  # We should fix these.
-    df.loc[df.chage2 == 199, 'chage2'] = 1990
-    df.loc[df.chage2 == 69, 'chage2'] = 1969
-    df.loc[df.chage2 == 95, 'chage2'] = 1995
-    df.loc[df.chage2 == 19885, 'chage2'] = 1985
-    df.loc[df.chage2 == 98, 'chage2'] = 1998
-    df.loc[df.chage2 == 78, 'chage2'] = 1978
-    df.loc[df.chage2 == 2973, 'chage2'] = 1973
-    df.loc[df.chage2 == 70, 'chage2'] = 1970
-
-    df.loc[df.chage3 == 74, 'chage3'] = 1974  # We should fix these.
-    df.loc[df.chage3 == 20016, 'chage3'] = 2016
-    df.loc[df.chage3 == 72, 'chage3'] = 1972
-    df.loc[df.chage3 == 81, 'chage3'] = 1981
-    df.loc[df.chage3 == 97, 'chage3'] = 1997
-    df.loc[df.chage3 == 2, 'chage3'] = np.nan
-    df.loc[df.chage5 == 1, 'chage5'] = np.nan
-
-    # Calculate the year of each parent's first child birth (e.g., the year they became parents).
-    first_child_age = []
-    for i, row in df.iterrows():
-        first_child_age.append(np.min(row[['chage1', 'chage2', 'chage3',
-                                           'chage4', 'chage5', 'chage6',
-                                           'chage7', 'chage8', 'chage9']]))
-    df['first_child_birth'] = first_child_age
-
-    # How old is their youngest child at the time of the survey?
-    df['youngest'] = 2017 - df.loc[:, ['chage1', 'chage2', 'chage3', 'chage3',
-                                       'chage4', 'chage5', 'chage6', 'chage7',
-                                       'chage8', 'chage9']].max(axis=1)
+    df = recode(df, CHILD_BIRTH_YEAR_FIXES)
+
+    # Calculate the year of each parent's first child birth (e.g., the year
+    # they became parents), and how old their youngest child is at the time
+    # of the survey.
+    birth_years = df[CHILD_BIRTH_YEARS].astype(float)
+    df['first_child_birth'] = birth_years.min(axis=1)
+    df['youngest'] = 2017 - birth_years.max(axis=1)
 
     df['haskiddo'] = df.youngest < 5
     df['hasunder10'] = df.youngest < 10
 
-    # How many papers do faculty aim to publish
-    df['aim_max'] = pd.to_numeric(df.aim_max, errors='coerce')
-    df['aim_min'] = pd.to_numeric(df.aim_min, errors='coerce')
-
-    df.loc[df.aim_max < 0, 'aim_max'] = np.nan
-    df.loc[df.aim_min < 0, 'aim_min'] = np.nan
+    # How many papers do faculty aim to publish, and expectations and likely
+    # productivity levels of different groups (negative codes are missing)
+    norms = df[NORM_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    df[NORM_COLUMNS] = norms.mask(norms < 0)
     df['aim_avg'] = .5*(df.aim_max + df.aim_min)
 
-    # Expectations and likely productivity levels of different groups
-    df['desnorm_wchild'] = pd.to_numeric(df['desnorm_wchild'], errors='coerce')
-    df['desnorm_wnochild'] = pd.to_numeric(df['desnorm_wnochild'],
-                                           errors='coerce')
-    df['desnorm_mchild'] = pd.to_numeric(df['desnorm_mchild'], errors='coerce')
-    df['desnorm_mnochild'] = pd.to_numeric(df['desnorm_mnochild'],
-                                           errors='coerce')
-
-    df['injnorm_wchild'] = pd.to_numeric(df['injnorm_wchild'], errors='coerce')
-    df['injnorm_wnochild'] = pd.to_numeric(df['injnorm_wnochild'],
-                                           errors='coerce')
-    df['injnorm_mchild'] = pd.to_numeric(df['injnorm_mchild'], errors='coerce')
-    df['injnorm_mnochild'] = pd.to_numeric(df['injnorm_mnochild'],
-                                           errors='coerce')
-
-    df.loc[df.desnorm_wchild < 0, 'desnorm_wchild'] = np.nan
-    df.loc[df.desnorm_wnochild < 0, 'desnorm_wnochild'] = np.nan
-    df.loc[df.desnorm_mchild < 0, 'desnorm_mchild'] = np.nan
-    df.loc[df.desnorm_mnochild < 0, 'desnorm_mnochild'] = np.nan
-
-    df.loc[df.injnorm_wchild < 0, 'injnorm_wchild'] = np.nan
-    df.loc[df.injnorm_wnochild < 0, 'injnorm_wnochild'] = np.nan
-    df.loc[df.injnorm_mchild < 0, 'injnorm_mchild'] = np.nan
-    df.loc[df.injnorm_mnochild < 0, 'injnorm_mnochild'] = np.nan
-
     return df
 
 
-def load_business_history_faculty():
+def load_business_history_faculty(workbooks=None):
+    """
+    workbooks: {path: DataFrame} of BUSI_HIS_WORKBOOKS, if they were read
+    already (e.g. by build_all_faculty)
+    """
+    if workbooks is None:
+        workbooks = read_workbooks(BUSI_HIS_WORKBOOKS)
+
     # Read in history data
-    responses = pd.read_excel(BUSI_HIS_RESPONSES)
+    responses = workbooks[BUSI_HIS_RESPONSES]
     responses.shape
 
     responses = responses[responses.lastpage != 0]
     responses_consent = responses[responses.consent == 1]
     responses_consent.shape
 
-    his_ids = pd.read_excel(HIS_FRAME_HEADS)
-    his_ids_more = pd.read_excel(HIS_FRAME_ALL)
+    his_ids = workbooks[HIS_FRAME_HEADS]
+    his_ids_more = workbooks[HIS_FRAME_ALL]
 
     his_merged_on_dept_heads = pd.merge(his_ids, responses_consent,
                                         left_on='session_id',
@@ -143,8 +184,8 @@ def load_business_history_faculty():
                              his_merged_on_invited_his], axis=0, sort=False)
 
     # Read in business data
-    busi_ids = pd.read_excel(BUSI_FRAME_HEADS)
-    busi_ids_more = pd.read_excel(BUSI_FRAME_ALL)
+    busi_ids = workbooks[BUSI_FRAME_HEADS]
+    busi_ids_more = workbooks[BUSI_FRAME_ALL]
 
     busi_merged_on_dept_heads = pd.merge(busi_ids, responses_consent,
                                          left_on='session_id', right_on='pid',
@@ -171,53 +212,11 @@ def load_business_history_faculty():
     all_history['university_name_standard'] = all_history['u_university'].apply(
         lambda x: INST_NAME_ALIASES[x] if x in INST_NAME_ALIASES else x)
 
-    for field, field_data in [('Business', all_business), ('History', all_history)]:
-        pi_rank_mapping = {}
-        parental_leave_mapping = {}
-
-        # Extract prestige / ranking data and parental leave information
-        with open(PRESTIGE % field) as rankings, \
-             open(PARENTAL_LEAVE) as parental_leave:
-
-            pi_reader = csv.DictReader(rankings, dialect='excel-tab')
-            for row in pi_reader:
-                pi_rank_mapping[row['institution']] = row
-
-            leave_reader = csv.DictReader(parental_leave, dialect='excel-tab')
-            for row in leave_reader:
-                parental_leave_mapping[row['university_name']] = row
-
-        field_data['prestige_inv'] = field_data['university_name_standard'].apply(
-            lambda x: pi_rank_mapping[x]['pi'] if x in pi_rank_mapping else np.nan)
-        field_data['prestige_rank_inv'] = field_data['university_name_standard'].apply(
-            lambda x: pi_rank_mapping[x]['# u'] if x in pi_rank_mapping else np.nan)
-
-        field_data['prestige_inv'] = pd.to_numeric(field_data['prestige_inv'])
-        field_data['prestige_rank_inv'] = pd.to_numeric(field_data['prestige_rank_inv'])
-
-        field_data['parleave_objective_length_women_inv'] = pd.to_numeric(
-            field_data['university_name_standard'].apply(
-                lambda x: parental_leave_mapping[x]['paid_leave_weeks_woman']
-                if ((x in parental_leave_mapping) and
-                    (parental_leave_mapping[x]['missing'] == '0'))
-                else np.nan))
-        field_data['parleave_objective_type_women_inv'] = field_data['university_name_standard'].apply(
-            lambda x: parental_leave_mapping[x]['relief_woman']
-            if ((x in parental_leave_mapping) and
-                (parental_leave_mapping[x]['missing'] == '0'))
-            else np.nan)
-
-        field_data['parleave_objective_length_men_inv'] = pd.to_numeric(
-            field_data['university_name_standard'].apply(
-                lambda x: parental_leave_mapping[x]['paid_leave_weeks_man']
-                if ((x in parental_leave_mapping) and
-                    (parental_leave_mapping[x]['missing'] == '0'))
-                else np.nan))
-        field_data['parleave_objective_type_men_inv'] = field_data['university_name_standard'].apply(
-            lambda x: parental_leave_mapping[x]['relief_man']
-            if ((x in parental_leave_mapping) and
-                (int(parental_leave_mapping[x]['missing']) == 0))
-            else np.nan)
+    # Attach prestige and parental leave policies of their institutions
+    all_business = reference_data.attach_institution_data(
+        all_business, 'Business', suffix='_inv')
+    all_history = reference_data.attach_institution_data(
+        all_history, 'History', suffix='_inv')
 
     all_business['likely_department'] = "Business"
     all_history['likely_department'] = "History"
@@ -270,8 +269,15 @@ def load_business_history_faculty():
     return busi_his_merged
 
 
-def load_cs_faculty():
-    frame = pd.read_excel(CS_FRAME)
+def load_cs_faculty(workbooks=None):
+    """
+    workbooks: {path: DataFrame} of CS_WORKBOOKS, if they were read
+    already (e.g. by build_all_faculty)
+    """
+    if workbooks is None:
+        workbooks = read_workbooks(CS_WORKBOOKS)
+
+    frame = workbooks[CS_FRAME]
 
     # Let's recalculate these variables:
     frame.drop(['prestige', 'parleave_objective_length_women',
@@ -282,45 +288,12 @@ def load_cs_faculty():
     # Standardize university names (just a big lookup table)
     frame['university_name_standard'] = frame['university'].apply(lambda x: INST_NAME_ALIASES[x] if x in INST_NAME_ALIASES else x)
 
-    pi_rank_mapping = {}
-    parental_leave_mapping = {}
-
-    # Extract prestige / ranking data and parental leave information
-    with open(PRESTIGE % 'CS') as rankings, \
-         open(PARENTAL_LEAVE) as parental_leave:
-        pi_reader = csv.DictReader(rankings, dialect='excel-tab')
-        for row in pi_reader:
-            pi_rank_mapping[row['institution']] = row
-
-        leave_reader = csv.DictReader(parental_leave, dialect='excel-tab')
-        for row in leave_reader:
-            parental_leave_mapping[row['university_name']] = row
-
-    frame['prestige_inv'] = frame['university_name_standard'].apply(lambda x: pi_rank_mapping[x]['pi'] if x in pi_rank_mapping else np.nan)
-    frame['prestige_rank_inv'] = frame['university_name_standard'].apply(lambda x: pi_rank_mapping[x]['# u'] if x in pi_rank_mapping else np.nan)
-
-    frame['prestige_inv'] = pd.to_numeric(frame['prestige_inv'])
-    frame['prestige_rank_inv'] = pd.to_numeric(frame['prestige_rank_inv'])
-
-    frame['parleave_objective_length_women'] = pd.to_numeric(frame['university_name_standard'].apply(
-        lambda x: parental_leave_mapping[x]['paid_leave_weeks_woman']
-        if ((x in parental_leave_mapping) and
-            (parental_leave_mapping[x]['missing'] == '0')) else np.nan))
-    frame['parleave_objective_type_women'] = frame['university_name_standard'].apply(
-        lambda x: parental_leave_mapping[x]['relief_woman']
-        if ((x in parental_leave_mapping) and
-            (parental_leave_mapping[x]['missing'] == '0')) else np.nan)
-
-    frame['parleave_objective_length_men'] = pd.to_numeric(frame['university_name_standard'].apply(
-        lambda x: parental_leave_mapping[x]['paid_leave_weeks_man']
-        if ((x in parental_leave_mapping) and
-            (parental_leave_mapping[x]['missing'] == '0')) else np.nan))
-    frame['parleave_objective_type_men'] = frame['university_name_standard'].apply(
-        lambda x: parental_leave_mapping[x]['relief_man'] if ((x in parental_leave_mapping) and (int(parental_leave_mapping[x]['missing']) == 0)) else np.nan)
+    # Attach prestige and parental leave policies of their institutions
+    frame = reference_data.attach_institution_data(frame, 'CS')
 
     # Merge productivity
     productivity = pd.read_json(CS_PUBS)
-    cs_ans = pd.read_excel(CS_RESPONSES)
+    cs_ans = workbooks[CS_RESPONSES]
     cs_inv = pd.merge(frame, productivity, how='left', left_on='dblp',
                       right_on='dblp', validate='many_to_one',
                       suffixes=['', '_prod'])
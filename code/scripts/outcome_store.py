@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+"""
+Binary store of the publication outcome panels handed from allocation.py to
+difference_in_differences.py.
+
+A panel is stored in a directory next to where its TSV would be, e.g.
+../data/control/adj_publication_outcomes_women_cs_<date>/ (so the store is
+partitioned by group, field and gender). Rows are written in chunks of whole
+rounds, one .npy file per column and chunk, with compact dtypes (see
+COLUMN_DTYPES), and meta.json lists the columns and the round range of every
+chunk. Columns are read memory-mapped (copy-on-write, so frames can be
+modified without touching the files), and a range of rounds only touches
+the chunks that overlap it. meta.json is written when the writer closes,
+so a store directory without it is an incomplete write and is refused.
+
+Stores hold exactly the columns they are given, except that career age (c)
+is refused, as it is for the released TSV files.
+"""
+
+META = 'meta.json'
+
+# Compact dtypes of known columns. Integer columns whose values are out of
+# range are widened to int32 (or int64), and those with missing values are
+# stored as float32.
+COLUMN_DTYPES = {'y': np.float32, 't': np.int16, 'i': np.int32,
+                 'round': np.int32, 'i_t': np.int8, 'pi': np.int8,
+                 'pre_2000': np.bool_, 'age': np.float32, 's': np.int16}
+
+# Columns never written, to protect respondents' identity
+SENSITIVE_COLUMNS = ['c']
+
+
+def outcome_path(data_dir, group, file_ending, gender, field, date):
+    """ Path of a panel's store; its TSV file is this plus '.tsv' """
+    return os.path.join(data_dir, group, '%s_publication_outcomes_%s_%s_%s' %
+                        (file_ending, gender, field.lower(), date))
+
+
+def compact(values, dtype=None):
+    """ values in dtype if they fit, else in the closest compact dtype """
+    values = np.asarray(values)
+    if values.dtype == object:
+        try:
+            values = values.astype(float)
+        except (TypeError, ValueError):
+            return values.astype(str)
+    if dtype is None:
+        if values.dtype.kind == 'f':
+            dtype = np.float32
+        elif values.dtype.kind in 'iu':
+            dtype = np.int32
+        else:
+            return values
+
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        if not (np.all(np.isfinite(values)) and
+                np.all(values == np.round(values))):
+            return values.astype(np.float32)
+        for candidate in [dtype, np.dtype(np.int32), np.dtype(np.int64)]:
+            info = np.iinfo(candidate)
+            if values.size == 0 or (values.min() >= info.min and
+                                    values.max() <= info.max):
+                return values.astype(candidate)
+        return values.astype(np.float64)
+    return values.astype(dtype)
+
+
+class OutcomeWriter(object):
+    """
+    Write a panel to the store at `path`, one chunk of whole rounds at a time
+    (and to the TSV file `tsv` too, if given). Call close() when done.
+    """
+
+    def __init__(self, path, tsv=None):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        self.path = path
+        self.tsv = tsv
+        self.meta = {'columns': {}, 'chunks': []}
+
+    def write(self, rows):
+        sensitive = [c for c in SENSITIVE_COLUMNS if c in rows.columns]
+        if sensitive:
+            raise ValueError('Sensitive columns %s' % sensitive)
+
+        if self.tsv is not None:
+            rows.to_csv(self.tsv, sep='\t', na_rep='', index=False,
+                        mode='a' if self.meta['chunks'] else 'w',
+                        header=not self.meta['chunks'])
+
+        chunk = 'chunk_%05d' % len(self.meta['chunks'])
+        os.makedirs(os.path.join(self.path, chunk))
+        for column in rows.columns:
+            values = compact(rows[column].values, COLUMN_DTYPES.get(column))
+            np.save(os.path.join(self.path, chunk, column + '.npy'), values)
+            self.meta['columns'].setdefault(column, values.dtype.str)
+
+        rounds = rows['round'].values if 'round' in rows.columns else [0]
+        self.meta['chunks'].append({
+            'name': chunk, 'rows': len(rows),
+            'first_round': int(np.min(rounds)) if len(rows) else 0,
+            'last_round': int(np.max(rounds)) if len(rows) else -1})
+
+    def close(self):
+        with open(os.path.join(self.path, META), 'w') as meta:
+            json.dump(self.meta, meta)
+
+
+class OutcomeStore(object):
+    """ Read access to a stored panel """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as meta:
+            self.meta = json.load(meta)
+        self.columns = list(self.meta['columns'])
+
+    def chunks(self, rounds=None):
+        """ Chunks overlapping the rounds [start, stop) (all by default) """
+        if rounds is None:
+            return self.meta['chunks']
+        start, stop = rounds
+        return [chunk for chunk in self.meta['chunks']
+                if chunk['rows'] and chunk['first_round'] < stop and
+                chunk['last_round'] >= start]
+
+    def column(self, column, rounds=None):
+        """ Values of a column, memory-mapped if they lie in a single chunk """
+        parts = []
+        for chunk in self.chunks(rounds):
+            values = np.load(os.path.join(self.path, chunk['name'],
+                                          column + '.npy'), mmap_mode='c')
+            if rounds is not None and not (
+                    rounds[0] <= chunk['first_round'] and
+                    chunk['last_round'] < rounds[1]):
+                round_values = np.load(os.path.join(
+                    self.path, chunk['name'], 'round.npy'), mmap_mode='r')
+                values = values[(round_values >= rounds[0]) &
+                                (round_values < rounds[1])]
+            parts.append(values)
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.zeros(0, dtype=self.meta['columns'][column])
+        return np.concatenate(parts)
+
+    def read(self, columns=None, rounds=None):
+        """
+        DataFrame of the columns (all by default) for a round range, in
+        their stored dtypes. Columns lying in a single chunk are not copied:
+        the frame holds their memory maps.
+        """
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame({column: self.column(column, rounds)
+                             for column in columns}, columns=columns,
+                            copy=False)
+
+
+def read_outcomes(path, columns=None, rounds=None):
+    """
+    Rows of the panel stored at path, or of its TSV file path + '.tsv'
+    (e.g. the released data) if there is no store.
+    """
+    if os.path.exists(os.path.join(path, META)):
+        return OutcomeStore(path).read(columns, rounds)
+    if os.path.isdir(path):
+        raise ValueError('Incomplete outcome store %s (no %s)' % (path, META))
+
+    df = pd.read_csv(path + '.tsv', sep='\t', usecols=columns)
+    if rounds is not None:
+        df = df[(df['round'] >= rounds[0]) & (df['round'] < rounds[1])]
+    return df
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+"""
+Compact representation of placebo (control group) publication panels.
+
+For the control group, the only thing that changes between allocation rounds
+is the placebo child birth year. Instead of materializing one row per person,
+round and event time, an OffsetPanel stores each person's yearly publication
+counts once, plus an int16 matrix of per-round birth year offsets. Rows
+(y, t, age, s, c, ...) are built on demand for any round or slice of rounds.
+Treated panels are the special case of a single round.
+
+A SharedPanel publishes the columns of a long-format panel once in shared
+memory, so that worker processes can read any round's rows as views.
+
+A PanelSummary aggregates a long-format panel once per (subgroup, round,
+event time), so that average trajectories of any subgroup are read off the
+aggregates instead of rescanning the rows for every event time. A
+PanelAggregates holds everything the DiD script's comparisons take from a
+control panel, so that a streamed panel is summarized batch by batch
+instead of being read back in full.
+"""
+
+PANEL_COLUMNS = ['y', 't', 'age', 's', 'c', 'i_t', 'i', 'pi', 'round', 'sid']
+
+
+class OffsetPanel(object):
+    """
+    counts:      (n_people x n_years) publication counts per calendar year,
+                 where column 0 is `first_year`.
+    factors:     (n_years) multiplicative factor applied to each calendar
+                 year's count (adjustments, NaN for censored years).
+    k_birth:     (n_rounds x n_people) (placebo) child birth years.
+    persons:     DataFrame with one row per person and columns
+                 'i', 'sid', 'p_birth_year', 'tt_start_year' and 'pi'.
+    """
+
+    def __init__(self, counts, factors, first_year, k_birth, persons,
+                 t_lower, t_upper):
+        self.counts = counts
+        self.factors = factors
+        self.first_year = first_year
+        self.offsets = (np.asarray(k_birth) - first_year).astype(np.int16)
+        self.persons = persons.reset_index(drop=True)
+        self.T = np.arange(t_lower, t_upper + 1)
+
+    @property
+    def n_rounds(self):
+        return self.offsets.shape[0]
+
+    def __len__(self):
+        return len(self.persons)
+
+    def k_birth_years(self, rounds=None):
+        """ Placebo child birth years, (n_rounds x n_people) """
+        if rounds is None:
+            rounds = np.arange(self.n_rounds)
+        return self.offsets[rounds].astype(int) + self.first_year
+
+    def materialize(self, rounds=None, t=None, c=None, order='round'):
+        """
+        Build the long-format rows for the given rounds (all by default),
+        ordered by round, person and event time (or by person, round and
+        event time with order='person'). Rows can be restricted to a single
+        event time `t` and/or career age `c`.
+        """
+        if rounds is None:
+            rounds = np.arange(self.n_rounds)
+        rounds = np.atleast_1d(rounds)
+
+        offsets = self.offsets[rounds].astype(int)
+        year_index = offsets[:, :, np.newaxis] + self.T  # (rounds, people, T)
+        s = year_index + self.first_year
+
+        in_range = (year_index >= 0) & (year_index < self.counts.shape[1])
+        year_index = np.clip(year_index, 0, self.counts.shape[1] - 1)
+        people = np.arange(len(self))[np.newaxis, :, np.newaxis]
+        y = np.where(in_range, self.counts[people, year_index], 0) * \
+            self.factors[year_index]
+
+        p_birth_year = self.persons['p_birth_year'].values[:, np.newaxis]
+        tt_start_year = self.persons['tt_start_year'].values[:, np.newaxis]
+        age = s - p_birth_year
+        career_age = s - tt_start_year
+
+        # Ages should be positive
+        keep = age >= 0
+        t_full = np.broadcast_to(self.T, s.shape)
+        if t is not None:
+            keep &= (t_full == t)
+        if c is not None:
+            keep &= (career_age == c)
+
+        round_full = np.broadcast_to(rounds[:, np.newaxis, np.newaxis],
+                                     s.shape)
+        person_full = np.broadcast_to(people, s.shape)
+        if order == 'person':
+            y, t_full, age, s, career_age, round_full, person_full, keep = [
+                np.swapaxes(a, 0, 1) for a in
+                (y, t_full, age, s, career_age, round_full, person_full,
+                 keep)]
+        person_full = person_full[keep]
+
+        return pd.DataFrame({
+            'y': y[keep], 't': t_full[keep], 'age': age[keep],
+            's': s[keep].astype(float), 'c': career_age[keep],
+            'i_t': (t_full[keep] != -1).astype(int),
+            'i': self.persons['i'].values[person_full],
+            'pi': self.persons['pi'].values[person_full],
+            'round': round_full[keep],
+            'sid': self.persons['sid'].values[person_full]},
+            columns=PANEL_COLUMNS)
+
+    def iter_rounds(self, chunk_size=1):
+        """ Yield (rounds, rows) for consecutive chunks of rounds """
+        for start in range(0, self.n_rounds, chunk_size):
+            rounds = np.arange(start, min(start + chunk_size, self.n_rounds))
+            yield rounds, self.materialize(rounds)
+
+
+def iter_rounds(data):
+    """
+    Iterate (round, rows) over a control panel, given either as an
+    OffsetPanel or as a long-format DataFrame with a 'round' column.
+    """
+    if isinstance(data, OffsetPanel):
+        for rounds, rows in data.iter_rounds():
+            yield rounds[0], rows
+    else:
+        for iteration, rows in data.groupby('round', sort=True):
+            yield iteration, rows
+
+
+def concat_rows(rows):
+    """ Concatenate dicts of column arrays (on the columns they share) """
+    columns = [c for c in rows[0] if all(c in r for r in rows[1:])]
+    return {c: np.concatenate([np.asarray(r[c]) for r in rows])
+            for c in columns}
+
+
+def sample_by_t(df, T, n, rng=None):
+    """
+    (len(T) x n) values of y drawn with replacement from the rows of df at
+    each event time in T (NaN where there are none), as n calls of
+    df[df['t'] == t].y.sample(n=1), from one grouping of the rows.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    rows = df.groupby('t').indices
+    y = df['y'].values.astype(float)
+    return np.array([y[rng.choice(rows[t], n)] if t in rows
+                     else np.full(n, np.nan) for t in T])
+
+
+class SharedPanel(object):
+    """
+    Typed column arrays of a long-format panel in shared memory, ordered by
+    round, with an offset table: the rows of the k-th round are
+    offsets[k]:offsets[k + 1]. Create with publish() in the parent process
+    and attach() to its spec in workers.
+    """
+
+    def __init__(self, spec, blocks):
+        self.spec = spec
+        self.blocks = blocks
+        self.offsets = spec['offsets']
+        self.columns = {
+            column: np.ndarray((length,), dtype=np.dtype(dtype),
+                               buffer=blocks[column].buf)
+            for column, (_, dtype, length) in spec['columns'].items()}
+
+    @classmethod
+    def publish(cls, df, columns):
+        df = df.sort_values('round', kind='stable')
+        rounds = df['round'].values
+        starts = np.flatnonzero(np.r_[True, rounds[1:] != rounds[:-1]])
+        offsets = np.append(starts, len(df)) if len(df) else np.zeros(1, int)
+
+        spec = {'columns': {}, 'offsets': offsets}
+        blocks = {}
+        for column in columns:
+            values = np.ascontiguousarray(df[column].values)
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype,
+                       buffer=block.buf)[:] = values
+            spec['columns'][column] = (block.name, values.dtype.str,
+                                       len(values))
+            blocks[column] = block
+        return cls(spec, blocks)
+
+    @classmethod
+    def attach(cls, spec):
+        blocks = {column: shared_memory.SharedMemory(name=name)
+                  for column, (name, _, _) in spec['columns'].items()}
+        return cls(spec, blocks)
+
+    @property
+    def n_rounds(self):
+        return len(self.offsets) - 1
+
+    def rows(self, k=None):
+        """ Views of the k-th round's rows (all rows by default) """
+        if k is None:
+            return dict(self.columns)
+        start, stop = self.offsets[k], self.offsets[k + 1]
+        return {column: values[start:stop]
+                for column, values in self.columns.items()}
+
+    def unlink(self):
+        """ Release the shared memory (in the publishing process) """
+        self.columns = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+
+class PanelSummary(object):
+    """
+    Counts, sums and sums of squares of y, and counts and sums of each
+    person's cumulative y (per round, as generate_average_cumulative), for
+    every combination of the `by` columns, round and event time t, built in
+    a single groupby pass. Missing values of y are skipped, as in pandas.
+
+    The aggregates are sums, so a panel can also be summarized batch by batch
+    with update(), as long as every batch holds whole rounds.
+    """
+
+    def __init__(self, df=None, by=()):
+        self.by = list(by)
+        self.cells = None
+        if df is not None:
+            self.update(df)
+
+    def update(self, df):
+        """ Add the rows of df (whole rounds) to the aggregates """
+        y = df['y'].astype(float)
+        rounds = df['round'] if 'round' in df.columns else 0
+        cumulative = y.groupby([df['i'], rounds]).cumsum()
+
+        cells = pd.DataFrame({'n': y.notna(), 'sum': y.fillna(0),
+                              'sumsq': y.fillna(0)**2,
+                              'cum_n': cumulative.notna(),
+                              'cum_sum': cumulative.fillna(0)})
+        keys = [df[column] for column in self.by] + \
+            [pd.Series(rounds, index=df.index, name='round'), df['t']]
+        cells = cells.groupby(keys).sum()
+        self.cells = cells if self.cells is None else \
+            self.cells.add(cells, fill_value=0)
+
+    def totals(self, T, rounds=None, **where):
+        """ Aggregates per event time in T of the selected cells """
+        cells = self.cells
+        selected = np.ones(len(cells), dtype=bool)
+        for column, value in where.items():
+            selected &= cells.index.get_level_values(column) == value
+        if rounds is not None:
+            level = cells.index.get_level_values('round')
+            selected &= (level >= rounds[0]) & (level < rounds[1])
+        totals = cells[selected].groupby(level='t').sum()
+        return totals.reindex(T, fill_value=0)
+
+    def mean(self, T, rounds=None, **where):
+        """ Average y at each event time in T (NaN where there is none) """
+        totals = self.totals(T, rounds, **where)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (totals['sum'] / totals['n']).values
+
+    def sem(self, T, rounds=None, **where):
+        """ Standard error of the average y at each event time in T """
+        totals = self.totals(T, rounds, **where)
+        n = totals['n'].values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = (totals['sumsq'].values - totals['sum'].values**2 / n) / \
+                (n - 1)
+            return np.sqrt(np.maximum(var, 0) / n)
+
+    def cumulative_mean(self, T, rounds=None, **where):
+        """ Average cumulative y at each event time in T """
+        totals = self.totals(T, rounds, **where)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (totals['cum_sum'] / totals['cum_n']).values
+
+
+class PanelAggregates(object):
+    """
+    What the DiD script takes from a (control) panel, accumulated from
+    batches of whole rounds with update():
+
+    summary:     PanelSummary of the rows
+    sums/counts: sums and counts of non-NaN y per person (rows, sorted by
+                 i) and event time (columns), summed over rounds
+    at_birth:    the rows at t = 0
+    draws:       (len(T) x n_draws) values of y drawn with replacement from
+                 the rows at each event time in T, as sample_by_t
+
+    Each update replaces every draw at t by one of the batch's rows at t
+    with probability (batch rows at t) / (rows at t so far), which keeps the
+    draws uniform over all rows seen.
+    """
+
+    def __init__(self, T, n_draws=0, rng=None):
+        self.T = list(T)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.summary = PanelSummary()
+        self.sums = pd.DataFrame(columns=self.T, dtype=float)
+        self.counts = pd.DataFrame(columns=self.T, dtype=float)
+        self.draws = np.full((len(self.T), n_draws), np.nan)
+        self.seen = np.zeros(len(self.T), dtype=int)
+        self.births = []
+
+    def update(self, df):
+        """ Add the rows of df (whole rounds) to the aggregates """
+        self.summary.update(df)
+
+        grouped = df['y'].astype(float).groupby([df['i'], df['t']])
+        for total, cells in [('sums', grouped.sum()),
+                             ('counts', grouped.count())]:
+            cells = cells.unstack('t').reindex(columns=self.T, fill_value=0)
+            setattr(self, total, getattr(self, total).add(
+                cells.fillna(0), fill_value=0).sort_index())
+
+        self.births.append(df[df['t'] == 0])
+
+        rows = df.groupby('t').indices
+        y = df['y'].values.astype(float)
+        for j, t in enumerate(self.T):
+            if t not in rows:
+                continue
+            self.seen[j] += len(rows[t])
+            replace = self.rng.random(self.draws.shape[1]) < \
+                len(rows[t]) / self.seen[j]
+            self.draws[j, replace] = y[self.rng.choice(rows[t],
+                                                       replace.sum())]
+
+    @property
+    def at_birth(self):
+        if len(self.births) > 1:
+            self.births = [pd.concat(self.births, ignore_index=True)]
+        return self.births[0]
+
+    def person_time_matrix(self):
+        """ (sums, counts) arrays, as regression.person_time_matrix """
+        return self.sums.values.astype(float), \
+            self.counts.values.astype(float)
+
+    def person_means(self, times):
+        """ Each person's average y over the event times in `times` """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums[times].sum(axis=1) / \
+                self.counts[times].sum(axis=1)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+
+"""
+Publications of many people in flat arrays, instead of the dblp_pubs column
+of lists of [year, [authors...]] entries.
+
+The layout is compressed sparse rows: person k's publications are rows
+person_offsets[k]:person_offsets[k + 1] of pub_year and pub_type, and the
+authors of publication p are author_id[author_offsets[p]:author_offsets[p +
+1]], with author names interned once (authors[author_id]). People are looked up
+by a key column of the faculty frame (e.g. the survey id 'sid'), so any
+cohort drawn from that frame, or rebuilt from its rows, can use the store.
+A store is saved to and loaded from a single .npz file.
+"""
+
+NO_YEAR = -1  # pub_year of publications without a (numeric) year
+NO_TYPE = -1  # pub_type of publications whose entries record no type
+
+
+def missing_publications(pubs):
+    return (pubs is np.nan) or (pubs is None)
+
+
+class PublicationStore(object):
+    """
+    keys:            key of each person (e.g. their sid)
+    person_offsets:  (n_people + 1) first publication of each person
+    pub_year:        year of each publication
+    pub_type:        type of each publication, as an index into pub_types
+    author_offsets:  (n_publications + 1) first author of each publication
+    author_id:       author of each authorship, as an index into authors
+    """
+
+    def __init__(self, keys, person_offsets, pub_year, pub_type,
+                 author_offsets, author_id, authors, pub_types=()):
+        self.keys = pd.Index(keys)
+        self.person_offsets = np.asarray(person_offsets, dtype=np.int64)
+        self.pub_year = np.asarray(pub_year, dtype=np.int32)
+        self.pub_type = np.asarray(pub_type, dtype=np.int8)
+        self.author_offsets = np.asarray(author_offsets, dtype=np.int64)
+        self.author_id = np.asarray(author_id, dtype=np.int32)
+        self.authors = np.asarray(authors, dtype=str)
+        self.pub_types = np.asarray(pub_types, dtype=str)
+        # Author role of the person on each publication, once resolved
+        self.roles = np.full(len(self.pub_year), -1, dtype=np.int8)
+
+    @classmethod
+    def from_lists(cls, keys, publications):
+        """
+        Store of the publication lists of people with the given keys.
+        Entries are [year, [authors...]] (or just [year]), optionally followed
+        by a publication type. People without a list (NaN or None) are left
+        out. A person with a list must have a key, and a repeated key must
+        come with the same list (the same person's record, e.g. merged twice);
+        otherwise a ValueError is raised.
+        """
+        people = []
+        years = []
+        types = []
+        lengths = []
+        names = []
+        seen = {}
+        for key, pubs in zip(keys, publications):
+            if missing_publications(pubs):
+                continue
+            if pd.isna(key):
+                raise ValueError('Publications without a key')
+            if key in seen:
+                if seen[key] != pubs:
+                    raise ValueError('Different publications for key %r' %
+                                     (key,))
+                continue
+            seen[key] = pubs
+            people.append((key, len(pubs)))
+            for entry in pubs:
+                year = pd.to_numeric(entry[0], errors='coerce')
+                years.append(NO_YEAR if pd.isna(year) else int(year))
+                types.append(entry[2] if len(entry) > 2 else None)
+                authors = entry[1] if len(entry) > 1 else []
+                lengths.append(len(authors))
+                names.extend(authors)
+
+        authors, author_id = np.unique(np.array(names, dtype=str),
+                                       return_inverse=True)
+        pub_types = sorted(set(t for t in types if t is not None))
+        type_codes = {t: code for code, t in enumerate(pub_types)}
+        return cls([key for key, _ in people],
+                   np.r_[0, np.cumsum([n for _, n in people], dtype=np.int64)],
+                   years, [type_codes.get(t, NO_TYPE) for t in types],
+                   np.r_[0, np.cumsum(lengths, dtype=np.int64)],
+                   author_id, authors, pub_types)
+
+    @classmethod
+    def from_frame(cls, df, key='sid', column='dblp_pubs'):
+        """ Store of the publication lists in a column of a faculty frame """
+        return cls.from_lists(df[key], df[column])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def counts(self):
+        """ Number of publications of each person """
+        return np.diff(self.person_offsets)
+
+    def rows(self, keys, publications=None):
+        """
+        Row of each key in the store, -1 for people without publications.
+        If their publication lists are given, people with a list but no row
+        raise a ValueError.
+        """
+        rows = self.keys.get_indexer(pd.Index(keys))
+        if publications is not None:
+            listed = np.array([not missing_publications(pubs)
+                               for pubs in publications], dtype=bool)
+            if np.any(listed & (rows < 0)):
+                raise ValueError('People with publications missing from the '
+                                 'store')
+        return rows
+
+    def select(self, rows):
+        """
+        Every publication of the people in rows (rows < 0 have none): the
+        position in rows of its person, and its index in the store.
+        """
+        positions = np.flatnonzero(np.asarray(rows) >= 0)
+        rows = np.asarray(rows)[positions]
+        starts = self.person_offsets[rows]
+        lengths = self.person_offsets[rows + 1] - starts
+        owners = np.repeat(positions, lengths)
+        pubs = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+            np.arange(lengths.sum())
+        return owners, pubs
+
+    def span(self, row):
+        """ Slice of the publications of the person in a row """
+        return slice(self.person_offsets[row], self.person_offsets[row + 1])
+
+    def years(self, row):
+        """ Publication years of a person (a view) """
+        return self.pub_year[self.span(row)]
+
+    def author_lists(self, row):
+        """ Author IDs on each of a person's publications (views) """
+        span = self.span(row)
+        starts = self.author_offsets[span.start:span.stop + 1]
+        return [self.author_id[start:stop]
+                for start, stop in zip(starts[:-1], starts[1:])]
+
+    def authorships(self, row):
+        """ Year and author ID of every authorship of a person """
+        span = self.span(row)
+        first, last = self.author_offsets[span.start], \
+            self.author_offsets[span.stop]
+        lengths = np.diff(self.author_offsets[span.start:span.stop + 1])
+        return np.repeat(self.pub_year[span], lengths), \
+            self.author_id[first:last]
+
+    def publications(self, row):
+        """ A person's publications as dblp_pubs entries [year, [authors]] """
+        return [[int(year), list(self.authors[ids])]
+                for year, ids in zip(self.years(row), self.author_lists(row))]
+
+    def save(self, path):
+        np.savez(path, keys=np.asarray(self.keys),
+                 person_offsets=self.person_offsets, pub_year=self.pub_year,
+                 pub_type=self.pub_type, author_offsets=self.author_offsets,
+                 author_id=self.author_id, authors=self.authors,
+                 pub_types=self.pub_types)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import pandas as pd
+
+
+"""
+Institution-level reference data attached to the survey responses: prestige
+of each field's institutions (from the faculty hiring networks) and the
+parental leave policies of universities.
+
+Each table is read once per process, indexed by institution name, and
+attached to responses with one join on their standardized university name.
+Values are read as the strings in the files, as csv.DictReader would, and
+numeric columns are converted after the join.
+"""
+
+PRESTIGE = '../data/survey_data/faculty_2011/%s_vertexlist.txt'
+PARENTAL_LEAVE = '../data/survey_data/parental_leave/parental_leave_policies_apr_2018.tsv'
+
+# Derived column: (column of the parental leave table, numeric)
+PARENTAL_LEAVE_COLUMNS = {
+    'parleave_objective_length_women': ('paid_leave_weeks_woman', True),
+    'parleave_objective_type_women': ('relief_woman', False),
+    'parleave_objective_length_men': ('paid_leave_weeks_man', True),
+    'parleave_objective_type_men': ('relief_man', False)}
+
+# Tables read so far, by path
+_tables = {}
+
+
+def read_table(path, key):
+    """ Tab-separated table of strings indexed by its key column (cached) """
+    if path not in _tables:
+        table = pd.read_csv(path, sep='\t', dtype=str,
+                            keep_default_na=False)
+        # The last row of a repeated name wins, as in a dict built row by row
+        table = table.drop_duplicates(key, keep='last').set_index(key)
+        _tables[path] = table
+    return _tables[path]
+
+
+def prestige(field):
+    """ Prestige (pi) and rank (# u) of the field's institutions """
+    table = read_table(PRESTIGE % field, 'institution')
+    return pd.DataFrame({'prestige_inv': pd.to_numeric(table['pi']),
+                         'prestige_rank_inv': pd.to_numeric(table['# u'])},
+                        index=table.index)
+
+
+def parental_leave(suffix=''):
+    """
+    Paid leave weeks and type of relief for women and men, for universities
+    whose policy is not missing, with suffix appended to the column names.
+    """
+    table = read_table(PARENTAL_LEAVE, 'university_name')
+    reported = table[table['missing'] == '0']
+    return pd.DataFrame({name + suffix: reported[column]
+                         for name, (column, _) in
+                         PARENTAL_LEAVE_COLUMNS.items()},
+                        index=reported.index)
+
+
+def attach(df, table, key='university_name_standard'):
+    """ df with the columns of an institution table joined on its key """
+    return df.join(table, on=key)
+
+
+def attach_institution_data(df, field, suffix=''):
+    """
+    df with prestige_inv and prestige_rank_inv of the field, and the
+    parental leave columns (with suffix), by standardized university name.
+    """
+    df = attach(attach(df, prestige(field)), parental_leave(suffix))
+    for name, (_, numeric) in PARENTAL_LEAVE_COLUMNS.items():
+        if numeric:
+            df[name + suffix] = pd.to_numeric(df[name + suffix])
+    return df
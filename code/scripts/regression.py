@@ -133,52 +133,131 @@ def difference(df_1, df_2, t_1, t_2, cumulative=True):
     return res
 
 
-def get_sample(df):
-    n = df['i'].unique()
+def cluster_offsets(df, key='i'):
+    """
+    Row positions of df grouped by cluster (person): the rows of the k-th
+    cluster are rows[offsets[k]:offsets[k + 1]].
+    """
+    codes, clusters = pd.factorize(df[key], sort=True)
+    rows = np.argsort(codes, kind='stable')
+    offsets = np.zeros(len(clusters) + 1, dtype=int)
+    np.cumsum(np.bincount(codes, minlength=len(clusters)), out=offsets[1:])
+    return rows, offsets
+
+
+def bootstrap_indices(df, N, key='i', rng=None):
+    """
+    Row positions of N cluster bootstrap samples of df, stacked: sample k is
+    df.iloc[take[starts[k]:starts[k + 1]]]. A cluster drawn several times
+    appears that many times in its sample.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    rows, offsets = cluster_offsets(df, key)
+    n = len(offsets) - 1
+    if n == 0:
+        return np.zeros(0, dtype=int), np.zeros(N + 1, dtype=int)
+    draws = rng.integers(0, n, size=(N, n)).ravel()
+
+    # Expand every drawn cluster into the positions of its rows
+    sizes = np.diff(offsets)[draws]
+    ends = np.cumsum(sizes)
+    position = np.arange(ends[-1]) - np.repeat(ends - sizes, sizes)
+    take = rows[np.repeat(offsets[draws], sizes) + position]
+
+    starts = np.zeros(N + 1, dtype=int)
+    starts[1:] = ends[n - 1::n]
+    return take, starts
+
+
+def get_sample(df, rng=None):
     # Generate a sample with replacement
-    sample_ids = np.random.choice(n, len(n), replace=True)
-    sample = pd.DataFrame(columns=df.columns)
-    sample = sample.append(df[df['i'].isin(sample_ids)],
-                           ignore_index=True,
-                           sort=False)
+    take, _ = bootstrap_indices(df, 1, rng=rng)
     # Return just the one sample
-    return sample
+    return df.iloc[take].reset_index(drop=True)
 
 
-def get_bootstrap_interval(df, N):
+def get_bootstrap_interval(df, N, rng=None):
+    take, starts = bootstrap_indices(df, N, rng=rng)
     rel_productivity = [None]*N
     for i in range(N):
         # Consider one of our samples
-        sample = get_sample(df)
+        sample = df.iloc[take[starts[i]:starts[i + 1]]]
 
         # Build linear model across time for this sample
         mod = build_model(sample, t_val=None)
         alpha = [mod.params[LABEL % t] for t in T]
 
-        # Calculate the expectation of the sample across time
-        expectation = [np.mean(build_model(sample, t_val=t).predict())
-                       for t in T]
+        # Calculate the expectation of the sample across time. The per-t
+        # model has an intercept, so its mean prediction is the mean y of
+        # the rows it is fit to (those without missing y, c or pi).
+        complete = sample[['y', 'c', 'pi']].notna().all(axis=1)
+        expectation = sample[complete].groupby('t')['y'].mean().reindex(
+            T).values
         rel_productivity[i] = [alpha[j]/expectation[j] for j in range(len(T))]
 
-    # return np.std(rel_productivity, axis=0)
     return scipy.stats.sem(rel_productivity, axis=0)
 
 
-def get_bootstrap_trajectories(df, N, cumulative=True):
-    productivity_trajectory = [None]*N
-    for i in range(N):
-        # Consider one of our samples
-        sample = get_sample(df)
+def person_time_matrix(df, key='i'):
+    """
+    Pivot df into (persons x T) sums of y and counts of non-NaN y.
+    """
+    codes, persons = pd.factorize(df[key], sort=True)
+    t_index = pd.Index(T).get_indexer(df['t'].values)
+    y = df['y'].values.astype(float)
+    valid = (t_index >= 0) & ~np.isnan(y)
+
+    cells = codes[valid]*len(T) + t_index[valid]
+    shape = (len(persons), len(T))
+    sums = np.bincount(cells, weights=y[valid], minlength=shape[0]*shape[1])
+    counts = np.bincount(cells, minlength=shape[0]*shape[1])
+    return sums.reshape(shape), counts.reshape(shape).astype(float)
+
+
+def multinomial_bootstrap_weights(n, N, rng):
+    """ (N x n) number of times each of n clusters is drawn per replicate """
+    draws = rng.integers(0, n, size=(N, n))
+    rows = np.repeat(np.arange(N), n)
+    return np.bincount(rows*n + draws.ravel(),
+                       minlength=N*n).reshape(N, n).astype(float)
 
-        # Get the average trajectory of the sample
-        if cumulative:
-            productivity_trajectory[i] = np.cumsum(
-                [sample[sample['t'] == t]['y'].mean() for t in T])
-        else:
-            productivity_trajectory[i] = [sample[sample['t'] == t]['y'].mean()
-                                          for t in T]
 
-    # return scipy.stats.sem(productivity_trajectory, axis=0)
+def get_bootstrap_trajectories(df, N, cumulative=True, rng=None,
+                               chunk_size=1000):
+    """
+    Standard error of the mean of the bootstrap replicates of the average
+    trajectory (mean y for each t), resampling people. Each replicate is a
+    vector of multinomial weights over people, so all replicates' means come
+    from two matrix products.
+    """
+    sums, counts = person_time_matrix(df)
+    return matrix_bootstrap_trajectories(sums, counts, N, cumulative, rng,
+                                         chunk_size)
+
+
+def matrix_bootstrap_trajectories(sums, counts, N, cumulative=True, rng=None,
+                                  chunk_size=1000):
+    """
+    get_bootstrap_trajectories of the (persons x T) sums and counts of y, as
+    given by person_time_matrix (or accumulated by panel.PanelAggregates).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    productivity_trajectory = np.empty((N, len(T)))
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+        weights = multinomial_bootstrap_weights(len(sums), stop - start,
+                                                rng)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            productivity_trajectory[start:stop] = \
+                (weights @ sums) / (weights @ counts)
+
+    if cumulative:
+        productivity_trajectory = np.cumsum(productivity_trajectory, axis=1)
+
     return scipy.stats.sem(productivity_trajectory, axis=0)
 
 
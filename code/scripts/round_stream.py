@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import glob
+import os
+import time
+
+import pandas as pd
+
+
+"""
+On-disk ring of placebo round batches, to pipeline allocation and DiD
+fitting.
+
+The producer (allocation.py) puts each batch of rows under a source name,
+e.g. all rows of rounds 0-99 of 'women_control'. A batch is written as a
+numbered TSV in the ring directory and renamed into place once complete,
+and the producer waits while `depth` batches are still unread. The
+consumer (difference_in_differences.py) iterates the batches in the order
+they were put, deleting each once read, until the producer closes the ring.
+"""
+
+DONE = 'DONE'
+
+
+class RoundRing(object):
+    """
+    directory:  ring directory, shared by the producer and the consumer
+    depth:      most batches written but not yet read
+    poll:       seconds between checks for a new batch or for free space
+    """
+
+    def __init__(self, directory, depth=8, poll=0.2):
+        self.directory = directory
+        self.depth = depth
+        self.poll = poll
+        self.sequence = 0
+
+    def path(self, sequence, source):
+        return os.path.join(self.directory, '%06d.%s.tsv' % (sequence, source))
+
+    def pending(self):
+        return glob.glob(os.path.join(self.directory, '*.tsv'))
+
+    def open(self):
+        """ Start producing: clear what is left of a previous stream """
+        os.makedirs(self.directory, exist_ok=True)
+        for path in self.pending() + [os.path.join(self.directory, DONE)]:
+            if os.path.exists(path):
+                os.remove(path)
+        return self
+
+    def put(self, source, rows):
+        """ Write a batch of rows of source, waiting for space in the ring """
+        while len(self.pending()) >= self.depth:
+            time.sleep(self.poll)
+        path = self.path(self.sequence, source)
+        rows.to_csv(path + '.tmp', sep='\t', na_rep='', index=False)
+        os.replace(path + '.tmp', path)
+        self.sequence += 1
+
+    def close(self):
+        """ Mark the end of the stream, after the last batch """
+        with open(os.path.join(self.directory, DONE) + '.tmp', 'w') as done:
+            done.write('%d\n' % self.sequence)
+        os.replace(os.path.join(self.directory, DONE) + '.tmp',
+                   os.path.join(self.directory, DONE))
+
+    @staticmethod
+    def closed_at(done):
+        with open(done) as marker:
+            return int(marker.read())
+
+    def __iter__(self):
+        """ Yield (source, rows) for every batch, in order, as they arrive """
+        done = os.path.join(self.directory, DONE)
+        sequence = 0
+        while True:
+            paths = glob.glob(os.path.join(self.directory,
+                                           '%06d.*.tsv' % sequence))
+            if paths:
+                source = os.path.basename(paths[0]).split('.')[1]
+                rows = pd.read_csv(paths[0], sep='\t')
+                os.remove(paths[0])
+                sequence += 1
+                yield source, rows
+            elif os.path.exists(done) and self.closed_at(done) <= sequence:
+                break
+            else:
+                time.sleep(self.poll)
+        os.remove(done)
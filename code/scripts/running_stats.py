@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+
+import numpy as np
+import scipy.stats
+
+
+"""
+Constant-memory summaries of per-round estimates.
+
+RunningEstimates takes one vector of estimates per round (e.g. the DiD
+coefficients of a placebo round) and keeps, for every entry at once, a
+running mean and variance (Welford) and quantiles, so the usual summary
+(mean, std, sem, CI, one-sample t-test) is available without keeping the
+rounds themselves. Quantiles are exact for the first `buffer` rounds, after
+which they continue as P-square sketches (Jain & Chlamtac, 1985).
+"""
+
+TtestResult = namedtuple('TtestResult', ['statistic', 'pvalue', 'df'])
+
+
+class P2Quantile(object):
+    """ P-square estimate of quantile q of each entry of a vector stream """
+
+    def __init__(self, q, k):
+        self.q = q
+        self.k = k
+        self.initial = []
+        self.heights = None
+        self.positions = np.tile(np.arange(5, dtype=float), (k, 1))
+        self.desired = np.tile([0, 2*q, 4*q, 2 + 2*q, 4], (k, 1))
+        self.increments = np.array([0, q/2.0, q, (1 + q)/2.0, 1])
+
+    def seed(self, values):
+        """ Start the markers from (n x k) observed values, n >= 5 """
+        n = len(values)
+        ranks = np.round((n - 1) * self.increments).astype(int)
+        ranks = np.maximum(ranks, np.arange(5))
+        ranks = np.minimum(ranks, n - 5 + np.arange(5))
+        self.heights = np.sort(values, axis=0)[ranks].T.copy()
+        self.positions = np.tile(ranks.astype(float), (self.k, 1))
+        self.desired = np.tile((n - 1) * self.increments, (self.k, 1))
+        self.initial = []
+
+    def add(self, x):
+        if self.heights is None:
+            self.initial.append(np.asarray(x, dtype=float))
+            if len(self.initial) == 5:
+                self.heights = np.sort(np.array(self.initial).T, axis=1)
+                self.initial = []
+            return
+
+        rows = np.arange(self.k)
+        h, n = self.heights, self.positions
+
+        # Cell of each observation, extending the extreme markers if needed
+        h[:, 0] = np.minimum(h[:, 0], x)
+        h[:, 4] = np.maximum(h[:, 4], x)
+        cell = np.clip((x[:, np.newaxis] >= h[:, 1:4]).sum(axis=1), 0, 3)
+        n += np.arange(5) > cell[:, np.newaxis]
+        self.desired += self.increments
+
+        # Adjust the three middle markers
+        for i in range(1, 4):
+            d = self.desired[:, i] - n[:, i]
+            move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | \
+                   ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+            if not move.any():
+                continue
+            d = np.sign(d)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                parabolic = h[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                    (n[:, i] - n[:, i - 1] + d) * (h[:, i + 1] - h[:, i]) /
+                    (n[:, i + 1] - n[:, i]) +
+                    (n[:, i + 1] - n[:, i] - d) * (h[:, i] - h[:, i - 1]) /
+                    (n[:, i] - n[:, i - 1]))
+                j = i + d.astype(int)
+                linear = h[:, i] + d * (h[rows, j] - h[:, i]) / \
+                    (n[rows, j] - n[:, i])
+            inside = (h[:, i - 1] < parabolic) & (parabolic < h[:, i + 1])
+            h[:, i] = np.where(move, np.where(inside, parabolic, linear),
+                               h[:, i])
+            n[:, i] += np.where(move, d, 0)
+
+    def value(self):
+        if self.heights is None:
+            # Fewer than five observations: exact (linear interpolation)
+            if not self.initial:
+                return np.full(self.k, np.nan)
+            return np.quantile(np.array(self.initial), self.q, axis=0)
+        return self.heights[:, 2].copy()
+
+
+class RunningEstimates(object):
+    """
+    Running summaries of named per-round estimates. With exact=True all
+    rounds are kept and quantiles are always exact.
+    """
+
+    def __init__(self, names, quantiles=(0.025, 0.975), exact=False,
+                 buffer=1000):
+        self.names = list(names)
+        self.index = {name: j for j, name in enumerate(self.names)}
+        self.n = 0
+        self.mean_ = np.zeros(len(self.names))
+        self.m2 = np.zeros(len(self.names))
+        self.exact = exact
+        self.buffer = max(buffer, 5)
+        self.values = []
+        self.sketches = {q: P2Quantile(q, len(self.names)) for q in quantiles}
+
+    def add(self, x):
+        """ Add one round's vector of estimates """
+        x = np.asarray(x, dtype=float)
+        self.n += 1
+        delta = x - self.mean_
+        self.mean_ += delta / self.n
+        self.m2 += delta * (x - self.mean_)
+        if self.exact or self.n <= self.buffer:
+            self.values.append(x)
+        else:
+            if self.values:
+                # Switch from exact quantiles to sketches
+                for sketch in self.sketches.values():
+                    sketch.seed(np.array(self.values))
+                self.values = []
+            for sketch in self.sketches.values():
+                sketch.add(x)
+
+    def mean(self, name):
+        return self.mean_[self.index[name]]
+
+    def var(self, name, ddof=0):
+        if self.n - ddof <= 0:
+            return np.nan
+        return self.m2[self.index[name]] / (self.n - ddof)
+
+    def std(self, name, ddof=0):
+        return np.sqrt(self.var(name, ddof))
+
+    def sem(self, name):
+        """ Standard error of the mean (the Monte Carlo standard error) """
+        return np.sqrt(self.var(name, ddof=1) / self.n)
+
+    def quantile(self, name, q):
+        if self.values:
+            return np.quantile(np.array(self.values)[:, self.index[name]], q)
+        return self.sketches[q].value()[self.index[name]]
+
+    def ci(self, name, alpha=0.05):
+        """ Mean and empirical (1 - alpha) interval, as compute_ci """
+        return {'mean': self.mean(name),
+                'lower': self.quantile(name, alpha/2.0),
+                'upper': self.quantile(name, 1.0 - alpha/2.0)}
+
+    def ttest(self, name, popmean=0):
+        """ One-sample t-test of the rounds' mean against popmean """
+        statistic = (self.mean(name) - popmean) / self.sem(name)
+        df = self.n - 1
+        return TtestResult(statistic, 2*scipy.stats.t.sf(abs(statistic), df),
+                           df)
+
+    def summary(self, name, alpha=0.05):
+        """ mean, std, sem, CI and one-sample t-test of one estimate """
+        summary = self.ci(name, alpha)
+        summary.update({'std': self.std(name), 'sem': self.sem(name),
+                        'ttest': self.ttest(name)})
+        return summary
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+
+"""
+Snapshots of DataFrames that are expensive to build from their source files
+(e.g. the merged and cleaned faculty frame of load_data.load_all_faculty).
+
+A snapshot is a directory holding the frame in pandas' binary pickle format
+(frame.pkl), which keeps every column's dtype and the list-valued publication
+columns as they are, and meta.json with the fingerprint of every source file:
+its size, modification time and SHA-1 of its contents. A snapshot is only
+served while every source still matches its fingerprint. Files whose size
+and modification time are unchanged are trusted without hashing; files that
+were merely touched are re-hashed and, if their contents are the same, the
+snapshot stays valid.
+"""
+
+FRAME = 'frame.pkl'
+META = 'meta.json'
+
+
+def file_hash(path, block_size=1 << 20):
+    """ SHA-1 of the contents of a file """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path, previous=None):
+    """
+    Size, modification time and hash of a file. The hash of a previous
+    fingerprint is reused if the size and modification time are the same.
+    """
+    stat = os.stat(path)
+    if previous is not None and previous['size'] == stat.st_size and \
+            previous['mtime'] == stat.st_mtime:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime,
+            'sha1': file_hash(path)}
+
+
+def fingerprints(sources, previous=None):
+    """ Fingerprints of the source files, by path """
+    previous = previous or {}
+    return {path: fingerprint(path, previous.get(path)) for path in sources}
+
+
+def read_snapshot(directory, sources):
+    """
+    The frame of the snapshot in directory, or None if there is none or any
+    of the sources changed since it was written.
+    """
+    try:
+        with open(os.path.join(directory, META)) as meta:
+            meta = json.load(meta)
+    except (OSError, ValueError):
+        return None
+    if meta.get('pandas') != pd.__version__ or \
+            sorted(meta['sources']) != sorted(sources):
+        return None
+
+    try:
+        current = fingerprints(sources, meta['sources'])
+    except OSError:
+        return None
+    if any(current[path]['sha1'] != meta['sources'][path]['sha1']
+           for path in sources):
+        return None
+
+    try:
+        df = pd.read_pickle(os.path.join(directory, FRAME))
+    except Exception:
+        return None
+
+    if current != meta['sources']:
+        # Touched but unchanged: remember the new modification times
+        meta['sources'] = current
+        write_meta(directory, meta)
+    return df
+
+
+def write_meta(directory, meta):
+    with open(os.path.join(directory, META) + '.tmp', 'w') as out:
+        json.dump(meta, out, indent=1)
+    os.replace(os.path.join(directory, META) + '.tmp',
+               os.path.join(directory, META))
+
+
+def write_snapshot(directory, df, sources, source_fingerprints=None):
+    """
+    Write df as the snapshot of the sources, in the state of their
+    fingerprints (taken now by default). Pass the fingerprints taken before
+    df was built, so that sources edited during the build are seen as stale.
+    """
+    if source_fingerprints is None:
+        source_fingerprints = fingerprints(sources)
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, META)):
+        # Invalidate the old snapshot before replacing its frame
+        os.remove(os.path.join(directory, META))
+    meta = {'pandas': pd.__version__, 'sources': source_fingerprints}
+    df.to_pickle(os.path.join(directory, FRAME) + '.tmp')
+    os.replace(os.path.join(directory, FRAME) + '.tmp',
+               os.path.join(directory, FRAME))
+    write_meta(directory, meta)
+
+
+def cached(directory, sources, build):
+    """
+    The snapshot of the sources in directory, built with build() and written
+    if it is missing or stale. With directory None, just build().
+    """
+    if directory is None:
+        return build()
+    df = read_snapshot(directory, sources)
+    if df is None:
+        # Fingerprint the sources as they are when the build reads them
+        source_fingerprints = fingerprints(sources)
+        df = build()
+        write_snapshot(directory, df, sources, source_fingerprints)
+    return df
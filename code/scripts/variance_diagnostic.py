@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+from scripts import cohort_utils
+from scripts.did_fitter import DiDFitter, shock_and_slope
+
+
+"""
+Realized variance reduction of the placebo allocation methods (see
+cohort_utils.variance_reductions) on the DiD estimates they feed.
+
+Kept apart from cohort_utils, so that the allocation utilities do not
+depend on the fitting layer. Each call allocates and fits many sets of
+placebo rounds, so allocation.py only runs it with --variance-diagnostic.
+"""
+
+# DiD model of parents against placebo-allocated non-parents, as the
+# fathers/mothers families of difference_in_differences.py
+PLACEBO_DID_FORMULA = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
+                  C(parent):C(t>0) + C(parent):C(t>0):t + pi'
+
+
+def variance_reduction_diagnostic(treated, control, iterations, strategy,
+                                  variance_reduction, repeats=20, rng=None,
+                                  adjusted=True, publications=None,
+                                  formula=PLACEBO_DID_FORMULA):
+    """
+    Allocate `repeats` independent sets of `iterations` placebo rounds with
+    and without variance_reduction, fit the DiD model of the treated
+    against each round's control panel, and compare the variance (across
+    sets) of the mean shock and slope coefficients over the rounds. A ratio
+    r means one reduced round is worth about r plain rounds.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    treated_rows = cohort_utils.compute_publication_trend(
+        treated, -5, 10, adjusted=adjusted, publications=publications)
+    treated_rows['parent'] = True
+    targets = shock_and_slope('parent')
+
+    estimates = {}
+    for method in [None, variance_reduction]:
+        means = []
+        for _ in range(repeats):
+            k_birth = cohort_utils.allocate_placebo(
+                treated, control, iterations, strategy, rng=rng,
+                variance_reduction=method)
+            rows = cohort_utils.compute_publication_panel(
+                control, -5, 10, np.asarray(k_birth, dtype=float),
+                adjusted=adjusted, publications=publications).materialize()
+            rows['parent'] = False
+
+            fitter = DiDFitter(formula, treated_rows,
+                               pd.concat([treated_rows, rows]), 'parent')
+            fits = [fitter.fit(round_rows).params[list(targets)].values
+                    for _, round_rows in rows.groupby('round')]
+            means.append(np.mean(fits, axis=0))
+        estimates[method] = np.var(means, axis=0, ddof=1)
+
+    diagnostic = {}
+    for name, plain, reduced in zip(['shock', 'slope'], estimates[None],
+                                    estimates[variance_reduction]):
+        diagnostic[name] = {'plain': plain, 'reduced': reduced,
+                            'ratio': plain / reduced if reduced > 0
+                            else np.inf}
+    return diagnostic
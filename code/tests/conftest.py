@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The analysis scripts import their helpers as `scripts.<module>`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NAMES = ['Alice Smith', 'Bob Jones', 'Carol King', 'Dan Brown', 'Eve Stone']
+COAUTHORS = ['Xavier Young', 'Zoe Walker', 'Quinn Reed', 'Mia Nash',
+             'Abel Baker', 'Cleo Dunn']
+
+
+def make_cohort(n, seed=0):
+    """
+    Faculty frame of n people with DBLP publication lists. Person 3 has no
+    age, person 5 no publications and person 7 no first job year, so that
+    every branch of the eligibility checks is taken.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k in range(n):
+        age = float(rng.integers(30, 70))
+        p_birth_year = 2017 - age
+        pubs = []
+        for _ in range(rng.integers(0, 40)):
+            year = int(rng.integers(int(p_birth_year) + 20, 2020))
+            authors = list(rng.choice(COAUTHORS, rng.integers(0, 4),
+                                      replace=False))
+            authors.insert(rng.integers(0, len(authors) + 1), NAMES[k % 5])
+            pubs.append([year, authors])
+        rows.append({
+            'age (actual)': np.nan if k == 3 else age,
+            'dblp_pubs': None if k == 5 else pubs,
+            'name': NAMES[k % 5],
+            'prestige_frame': float(rng.random()),
+            'first_asst_job_year': np.nan if k == 7 else
+            float(p_birth_year + rng.integers(25, 35)),
+            'first_child_birth': float(p_birth_year + rng.integers(25, 40)),
+            'sid': 1000 + k, 'p_birth_year': p_birth_year, 'gender': 'F'})
+    df = pd.DataFrame(rows)
+    # Index labels that are not positions, as in a subset of the faculty frame
+    df.index = df.index*3 + 7
+    return df
+
+
+@pytest.fixture
+def cohort():
+    return make_cohort(40)
+
+
+@pytest.fixture
+def placebo_births(cohort):
+    """ (10 x n) placebo child birth years, one of them after the survey """
+    rng = np.random.default_rng(1)
+    k_birth = cohort.p_birth_year.values + rng.integers(25, 45,
+                                                        (10, len(cohort)))
+    k_birth = k_birth.astype(float)
+    k_birth[4, 10] = 2018
+    return k_birth
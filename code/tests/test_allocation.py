@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import cohort_utils
+
+
+def reference_bootstrap_allocation(treated, control, iterations):
+    """ bootstrap_allocation as it was, one control person at a time """
+    predictions = []
+    for _, row in control.iterrows():
+        comparison_group = treated[treated.p_birth_year == row.p_birth_year]
+        if len(comparison_group) == 0:
+            sample_pred = [np.nan]*iterations
+        else:
+            sample_pred = comparison_group.k_birth_year.sample(
+                    n=iterations, replace=True).values
+        predictions.append(sample_pred)
+
+    return np.array(predictions).transpose()
+
+
+@pytest.fixture
+def groups():
+    rng = np.random.default_rng(0)
+    treated = pd.DataFrame({
+        'p_birth_year': rng.integers(1950, 1960, 300).astype(float)})
+    treated['k_birth_year'] = treated.p_birth_year + rng.integers(25, 40, 300)
+    # Some control people have no treated person of their birth year
+    control = pd.DataFrame({'p_birth_year': np.r_[
+        rng.integers(1950, 1962, 50).astype(float), np.nan]})
+    return treated, control
+
+
+def test_bootstrap_allocation_matches_reference(groups):
+    treated, control = groups
+    np.random.seed(0)
+    expected = reference_bootstrap_allocation(treated, control, 4000)
+    predictions = cohort_utils.bootstrap_allocation(
+        treated, control, 4000, rng=np.random.default_rng(1))
+
+    assert predictions.shape == expected.shape
+    np.testing.assert_array_equal(np.isnan(predictions), np.isnan(expected))
+    for j, p_birth_year in enumerate(control.p_birth_year):
+        bucket = treated.k_birth_year[treated.p_birth_year == p_birth_year]
+        if len(bucket):
+            assert np.isin(predictions[:, j], bucket.values).all()
+    matched = ~np.isnan(expected[0])
+    np.testing.assert_allclose(predictions[:, matched].mean(axis=0),
+                               expected[:, matched].mean(axis=0), atol=0.5)
+
+
+def test_bootstrap_allocation_is_seeded(groups):
+    treated, control = groups
+    first, second = [cohort_utils.bootstrap_allocation(
+        treated, control, 5, rng=np.random.default_rng(3)) for _ in range(2)]
+    np.testing.assert_array_equal(first, second)
+
+
+@pytest.mark.parametrize('allocation', [cohort_utils.linear_allocation,
+                                        cohort_utils.quadratic_allocation])
+def test_batched_ols_allocation_matches_statsmodels(allocation):
+    rng = np.random.default_rng(2)
+    treated = pd.DataFrame({
+        'p_birth_year': rng.integers(1940, 1980, 120).astype(float),
+        'gender': rng.choice(['F', 'M'], 120),
+        'prestige_frame': rng.random(120)})
+    treated['first_asst_job_year'] = treated.p_birth_year + \
+        rng.integers(25, 35, 120)
+    treated['k_birth_year'] = treated.p_birth_year + \
+        rng.integers(25, 40, 120)
+    treated.loc[3, 'first_asst_job_year'] = np.nan
+    control = treated.drop(columns='k_birth_year').sample(
+        40, random_state=0)
+    control['p_birth_year'] += 1
+
+    # batched=False fits statsmodels' OLS on every resample, as before
+    expected = np.array(allocation(treated, control, 25, batched=False))
+    predictions = allocation(treated, control, 25)
+    assert predictions.shape == expected.shape
+    np.testing.assert_array_equal(predictions, expected)
+
+
+def test_stratified_bootstrap_covers_each_bucket(groups):
+    treated, control = groups
+    iterations = 500
+    predictions = cohort_utils.allocate_placebo(
+        treated, control, iterations, rng=np.random.default_rng(0),
+        variance_reduction='stratified')
+    np.testing.assert_array_equal(
+        np.isnan(predictions),
+        np.isnan(reference_bootstrap_allocation(treated, control, 1)[
+            [0]*iterations]))
+
+    # The k-th smallest draw comes from the k-th of `iterations` equal
+    # quantile ranges of the bucket's child birth years
+    k = np.arange(iterations)
+    for j, p_birth_year in enumerate(control.p_birth_year):
+        bucket = np.sort(treated.k_birth_year[
+            treated.p_birth_year == p_birth_year].values)
+        if len(bucket) == 0:
+            continue
+        lower = bucket[k*len(bucket) // iterations]
+        upper = bucket[np.minimum((k + 1)*len(bucket) // iterations,
+                                  len(bucket) - 1)]
+        draws = np.sort(predictions[:, j])
+        assert np.all((lower <= draws) & (draws <= upper))
+
+
+@pytest.mark.parametrize('variance_reduction', ['lhs', 'antithetic'])
+def test_lognormal_variance_reduction_keeps_the_fit(groups,
+                                                    variance_reduction):
+    treated, control = groups
+    plain = cohort_utils.allocate_placebo(
+        treated, control, 4000, 'lognormal', rng=np.random.default_rng(0))
+    reduced = cohort_utils.allocate_placebo(
+        treated, control, 4000, 'lognormal', rng=np.random.default_rng(1),
+        variance_reduction=variance_reduction)
+    np.testing.assert_array_equal(np.isnan(reduced), np.isnan(plain))
+    matched = ~np.isnan(plain[0])
+    np.testing.assert_allclose(reduced[:, matched].mean(axis=0),
+                               plain[:, matched].mean(axis=0), atol=0.3)
+
+
+def test_rng_is_refused_by_seeded_strategies(groups):
+    treated, control = groups
+    with pytest.raises(ValueError):
+        cohort_utils.allocate_placebo(treated, control, 5, 'linear',
+                                      rng=np.random.default_rng(0))
+
+
+@pytest.mark.parametrize('allocation', [cohort_utils.linear_allocation,
+                                        cohort_utils.quadratic_allocation])
+def test_rank_deficient_replicates_match_statsmodels(allocation):
+    # Few treated people: some resamples draw fewer distinct people than
+    # the model has coefficients
+    rng = np.random.default_rng(4)
+    treated = pd.DataFrame({
+        'p_birth_year': [1950.0, 1950.0, 1955.0, 1960.0, 1962.0, 1970.0],
+        'gender': 'M', 'prestige_frame': rng.random(6)})
+    treated['first_asst_job_year'] = treated.p_birth_year + \
+        rng.integers(25, 35, 6)
+    treated['k_birth_year'] = treated.p_birth_year + rng.integers(25, 40, 6)
+    control = pd.DataFrame({
+        'p_birth_year': rng.integers(1945, 1975, 20).astype(float),
+        'gender': 'M', 'prestige_frame': rng.random(20)})
+    control['first_asst_job_year'] = control.p_birth_year + 30
+    control.loc[7, 'first_asst_job_year'] = np.nan
+
+    distinct = [len(np.unique(np.random.RandomState(i).choice(6, 6)))
+                for i in range(60)]
+    assert min(distinct) < 4 <= max(distinct)
+
+    expected = np.array(allocation(treated, control, 60, batched=False))
+    predictions = allocation(treated, control, 60)
+    np.testing.assert_array_equal(predictions, expected)
+    assert np.isnan(predictions[:, 7]).all()
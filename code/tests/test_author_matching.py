@@ -0,0 +1,47 @@
+import random
+import string
+
+import numpy as np
+from fuzzywuzzy import fuzz
+
+from scripts import author_matching, cohort_utils
+
+
+def random_name(rng):
+    return ' '.join(rng.choice(string.ascii_uppercase) +
+                    ''.join(rng.choices(string.ascii_lowercase,
+                                        k=rng.randint(2, 8)))
+                    for _ in range(rng.randint(2, 3)))
+
+
+def test_similarity_scores_match_fuzz_ratio():
+    rng = random.Random(0)
+    candidates = [random_name(rng).lower() for _ in range(300)] + ['', 'j']
+    for target in ['john smith', 'jo', '']:
+        np.testing.assert_array_equal(
+            author_matching.similarity_scores(target, candidates),
+            [fuzz.ratio(target, candidate) for candidate in candidates])
+
+
+def test_positions_match_get_author_role():
+    rng = random.Random(1)
+    for _ in range(20):
+        name = random_name(rng)
+        pubs = []
+        for _ in range(15):
+            authors = [random_name(rng) for _ in range(rng.randint(1, 6))]
+            authors[rng.randrange(len(authors))] = name
+            pubs.append([2000, authors])
+        np.testing.assert_array_equal(
+            cohort_utils.publication_roles(name, pubs),
+            [cohort_utils.get_author_role(name, entry[1]) for entry in pubs])
+
+
+def test_normalized_name_variants():
+    author_lists = [['A B', 'J. Doe'], [], ['jane doe', 'Jane Doe'],
+                    ['X Y', 'Jane Doe 0001'], ['X Y', 'J Doe', 'J Doe']]
+    np.testing.assert_array_equal(
+        author_matching.match_author_positions('Jane Doe', author_lists),
+        [1, -1, 0, 1, 1])
+    assert author_matching.normalize_name('José  Müller-Lüdenscheidt 0002') \
+        == 'jose muller ludenscheidt'
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+
+from scripts.did_fitter import DiDFitter, design_columns, fit_families
+from scripts.panel import SharedPanel
+
+FORMULA = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
+                  C(parent):C(t>0) + C(parent):C(t>0):t + pi'
+
+
+def panel(n, rounds, parent, rng):
+    """ Long-format rows of n people over event times -5..10 per round """
+    t = np.tile(np.arange(-5, 11), n*rounds)
+    rows = pd.DataFrame({
+        't': t, 'round': np.repeat(np.arange(rounds), n*16),
+        'i': np.tile(np.repeat(np.arange(n), 16), rounds),
+        'pi': np.tile(np.repeat(rng.random(n), 16), rounds),
+        'parent': parent})
+    rows['y'] = rng.poisson(2.0 - 0.5*parent*(t > 0), len(rows)).astype(float)
+    rows.loc[rows.index[::37], 'y'] = np.nan
+    return rows
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    return panel(30, 1, True, rng), panel(40, 5, False, rng)
+
+
+def test_fit_matches_statsmodels(rows):
+    treated, control = rows
+    fitter = DiDFitter(FORMULA, treated,
+                       pd.concat([treated, control[control['round'] == 0]]))
+    for _, round_rows in control.groupby('round'):
+        data = pd.concat([round_rows, treated])
+        expected = smf.ols(FORMULA, data).fit()
+        result = fitter.fit(round_rows)
+
+        assert list(result.params.index) == list(expected.params.index)
+        assert list(result.params.index) == design_columns(FORMULA, data)
+        pd.testing.assert_series_equal(result.params, expected.params,
+                                       rtol=1e-8)
+        pd.testing.assert_series_equal(result.bse, expected.bse, rtol=1e-8)
+        pd.testing.assert_series_equal(result.pvalues, expected.pvalues,
+                                       rtol=1e-6, atol=1e-12)
+        np.testing.assert_allclose(result.conf_int().values,
+                                   expected.conf_int().values, rtol=1e-8)
+        assert result.df_resid == expected.df_resid
+        assert result.nobs == expected.nobs
+        target = data[(data['t'] == 0) & data['parent']]
+        assert np.isclose(result.expectation,
+                          np.mean(expected.predict(target)))
+
+
+def test_fit_without_fixed_rows(rows):
+    treated, control = rows
+    data = pd.concat([treated, control[control['round'] == 3]])
+    fitter = DiDFitter(FORMULA, None, data)
+    expected = smf.ols(FORMULA, data).fit()
+    result = fitter.fit(data.iloc[:500], data.iloc[500:])
+    pd.testing.assert_series_equal(result.params, expected.params, rtol=1e-8)
+    pd.testing.assert_series_equal(result.bse, expected.bse, rtol=1e-8)
+
+
+@pytest.mark.parametrize('tolerance, n_rounds', [(None, 5), (1e6, 2)])
+def test_fit_families_matches_per_round_fits(rows, tolerance, n_rounds):
+    treated, control = rows
+    fitter = DiDFitter(FORMULA, treated,
+                       pd.concat([treated, control[control['round'] == 0]]))
+    fits = [fitter.fit(round_rows)
+            for _, round_rows in control.groupby('round')][:n_rounds]
+
+    columns = ['y', 't', 'pi', 'parent']
+    fixed = SharedPanel.publish(treated, columns)
+    shared = SharedPanel.publish(control, columns)
+    try:
+        # With a large tolerance, fitting stops after the first batch
+        estimates = fit_families(
+            {'parents': (FORMULA, fixed, [shared], 'parent')}, 2,
+            exact=True, tolerance=tolerance, batch_size=2)['parents']
+    finally:
+        fixed.unlink()
+        shared.unlink()
+
+    assert estimates.n == n_rounds
+    for name in fitter.columns:
+        assert np.isclose(estimates.mean(name),
+                          np.mean([fit.params[name] for fit in fits]))
+    assert np.isclose(estimates.mean('expectation'),
+                      np.mean([fit.expectation for fit in fits]))
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import load_data
+from scripts.load_data import CHILD_BIRTH_YEARS, NORM_COLUMNS
+
+
+def reference_clean(df):
+    """ The cleaning of load_all_faculty as it was, fix by fix and row by row """
+    df.loc[df.chage1 == 200, 'chage1'] = 2000
+    df.loc[df.chage1 == 199, 'chage1'] = 1999
+    df.loc[df.chage1 == 1900, 'chage1'] = np.nan
+    df.loc[df.chage1 == 69, 'chage1'] = 1969
+    df.loc[df.chage1 == 93, 'chage1'] = 1993
+    df.loc[df.chage1 == 61, 'chage1'] = 1961
+
+    df.loc[df.chage2 == 218, 'chage2'] = 2018
+    df.loc[df.chage2 == 199, 'chage2'] = 1990
+    df.loc[df.chage2 == 69, 'chage2'] = 1969
+    df.loc[df.chage2 == 95, 'chage2'] = 1995
+    df.loc[df.chage2 == 19885, 'chage2'] = 1985
+    df.loc[df.chage2 == 98, 'chage2'] = 1998
+    df.loc[df.chage2 == 78, 'chage2'] = 1978
+    df.loc[df.chage2 == 2973, 'chage2'] = 1973
+    df.loc[df.chage2 == 70, 'chage2'] = 1970
+
+    df.loc[df.chage3 == 74, 'chage3'] = 1974
+    df.loc[df.chage3 == 20016, 'chage3'] = 2016
+    df.loc[df.chage3 == 72, 'chage3'] = 1972
+    df.loc[df.chage3 == 81, 'chage3'] = 1981
+    df.loc[df.chage3 == 97, 'chage3'] = 1997
+    df.loc[df.chage3 == 2, 'chage3'] = np.nan
+    df.loc[df.chage5 == 1, 'chage5'] = np.nan
+
+    first_child_age = []
+    for i, row in df.iterrows():
+        first_child_age.append(np.min(row[CHILD_BIRTH_YEARS]))
+    df['first_child_birth'] = first_child_age
+
+    df['youngest'] = 2017 - df.loc[:, ['chage1', 'chage2', 'chage3', 'chage3',
+                                       'chage4', 'chage5', 'chage6', 'chage7',
+                                       'chage8', 'chage9']].max(axis=1)
+
+    df['haskiddo'] = df.youngest < 5
+    df['hasunder10'] = df.youngest < 10
+
+    for column in NORM_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+        df.loc[df[column] < 0, column] = np.nan
+    df['aim_avg'] = .5*(df.aim_max + df.aim_min)
+
+    return df
+
+
+@pytest.fixture
+def responses():
+    rng = np.random.default_rng(0)
+    n = 200
+    years = rng.integers(1960, 2018, (n, len(CHILD_BIRTH_YEARS))).astype(float)
+    years[rng.random(years.shape) < 0.5] = np.nan
+    df = pd.DataFrame(years, columns=CHILD_BIRTH_YEARS)
+
+    # Every mis-typed year of the table, plus values that only look like one
+    # in another column (e.g. 200 as chage2)
+    bad = [(column, value) for column, value, _ in
+           load_data.CHILD_BIRTH_YEAR_FIXES]
+    bad += [('chage2', 200), ('chage4', 199), ('chage9', 1), ('chage1', 2)]
+    for k, (column, value) in enumerate(bad):
+        df.loc[3*k, column] = value
+    # People without any child birth year
+    df.loc[[1, 2], CHILD_BIRTH_YEARS] = np.nan
+
+    # Norms as read from the workbooks: numbers, negative codes (e.g. -77),
+    # text and blanks
+    answers = np.array([3, 0, 2.5, -77, -1, '4', 'a few', np.nan, None],
+                       dtype=object)
+    for column in NORM_COLUMNS:
+        df[column] = answers[rng.integers(0, len(answers), n)]
+
+    # Responses are concatenated from several frames, with repeated labels
+    df.index = np.arange(n) % 150
+    return df
+
+
+def test_clean_faculty_matches_reference(responses):
+    expected = reference_clean(responses.copy())
+    cleaned = load_data.clean_faculty(responses.copy())
+
+    assert expected['chage1'].isin([200, 199, 1900, 69, 93, 61]).sum() == 0
+    assert (cleaned['chage2'] == 200).any()
+    assert cleaned[NORM_COLUMNS].isna().any().all()
+    pd.testing.assert_frame_equal(cleaned, expected, check_dtype=False)
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import outcome_store
+
+
+def outcome_rounds(first_round, n_rounds, n=30, seed=0):
+    """ Rows as allocation.py writes them, for a batch of rounds """
+    rng = np.random.default_rng(seed + first_round)
+    t = np.tile(np.arange(-5, 11), n*n_rounds)
+    rows = pd.DataFrame({
+        'y': (rng.random(len(t))*3).round(4), 't': t,
+        # Person and round indices beyond the int16 range
+        'i': np.tile(np.repeat(rng.integers(0, 100000, n), 16), n_rounds),
+        'i_t': (t != -1).astype(int),
+        'round': np.repeat(np.arange(n_rounds), n*16) + first_round,
+        'pi': np.tile(np.repeat(rng.integers(0, 4, n), 16), n_rounds),
+        'pre_2000': rng.random(len(t)) < 0.5})
+    rows.loc[rows.index[::41], 'y'] = np.nan
+    return rows
+
+
+@pytest.fixture
+def written(tmp_path):
+    path = str(tmp_path / 'outcomes')
+    batches = [outcome_rounds(first, 3) for first in (0, 3, 40000)]
+    writer = outcome_store.OutcomeWriter(path, path + '.tsv')
+    for rows in batches:
+        writer.write(rows)
+    writer.close()
+    return path, pd.concat(batches, ignore_index=True)
+
+
+def test_store_matches_tsv(written):
+    path, rows = written
+    tsv = pd.read_csv(path + '.tsv', sep='\t')
+    stored = outcome_store.read_outcomes(path)
+
+    assert list(stored.columns) == list(rows.columns)
+    pd.testing.assert_frame_equal(stored, tsv, check_dtype=False, rtol=1e-6)
+    pd.testing.assert_frame_equal(stored, rows, check_dtype=False, rtol=1e-6)
+    assert stored['round'].max() == 40002
+
+
+@pytest.mark.parametrize('rounds', [(0, 6), (2, 4), (5, 40001), (7, 9)])
+def test_round_range_matches_filter(written, rounds):
+    path, rows = written
+    expected = rows[(rows['round'] >= rounds[0]) &
+                    (rows['round'] < rounds[1])].reset_index(drop=True)
+    stored = outcome_store.read_outcomes(path, ['y', 'i', 'round'], rounds)
+    pd.testing.assert_frame_equal(stored, expected[['y', 'i', 'round']],
+                                  check_dtype=False, rtol=1e-6)
+
+
+def test_tsv_fallback(written):
+    path, rows = written
+    shutil.rmtree(path)
+    tsv = outcome_store.read_outcomes(path, ['t', 'round'], (3, 6))
+    expected = rows[(rows['round'] >= 3) & (rows['round'] < 6)]
+    np.testing.assert_array_equal(tsv['t'], expected['t'])
+
+
+def test_incomplete_store_is_refused(written):
+    path, _ = written
+    # As left by a run that crashed before closing its writer
+    os.remove(os.path.join(path, outcome_store.META))
+    with pytest.raises(ValueError):
+        outcome_store.read_outcomes(path)
+
+
+def test_read_is_memory_mapped(written):
+    path, rows = written
+    store = outcome_store.OutcomeStore(path)
+    df = store.read(rounds=(3, 6))
+    assert isinstance(df['y'].values, np.memmap)
+    assert df['y'].dtype == np.float32
+
+    # Frames can be modified without changing the store
+    df.loc[df['t'] == 0, 'y'] = -1
+    df['i'] += 1
+    expected = rows[(rows['round'] >= 3) &
+                    (rows['round'] < 6)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(store.read(rounds=(3, 6)), expected,
+                                  check_dtype=False, rtol=1e-6)
+
+
+def test_compact_dtypes():
+    assert outcome_store.compact(np.array([-5, 10]), np.int16).dtype == \
+        np.int16
+    assert outcome_store.compact(np.array([0, 40000]), np.int16).dtype == \
+        np.int32
+    assert outcome_store.compact(np.array([0, 2**40]), np.int16).dtype == \
+        np.int64
+    values = outcome_store.compact(np.array([1.0, np.nan]), np.int8)
+    assert values.dtype == np.float32 and np.isnan(values[1])
+
+
+def test_sensitive_columns_are_refused(tmp_path):
+    writer = outcome_store.OutcomeWriter(str(tmp_path / 'outcomes'))
+    with pytest.raises(ValueError):
+        writer.write(pd.DataFrame({'y': [1.0], 'c': [3], 'round': [0]}))
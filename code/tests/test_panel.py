@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import cohort_utils, regression
+from scripts.panel import PANEL_COLUMNS, PanelAggregates, PanelSummary, \
+    iter_rounds, sample_by_t
+
+
+def reference_publication_trend(cohort, t_lower, t_upper, adjusted=True,
+                                author_position=None, k_birth=None):
+    """
+    compute_publication_trend as it was, one row per person, round and
+    event time. k_birth holds (n_rounds x n) placebo child birth years, or
+    is None for the observed ones.
+    """
+    roles = {'first': cohort_utils.FAP, 'last': cohort_utils.LAP}
+    rows = []
+    for count, (i, row) in enumerate(cohort.iterrows()):
+        if np.isnan(row['age (actual)']) or (row['dblp_pubs'] is None):
+            continue
+        if k_birth is None:
+            k_birth_years = [row['first_child_birth']]
+        else:
+            k_birth_years = list(k_birth[:, count])
+        if np.any([np.isnan(k) or (k >= 2017) for k in k_birth_years]):
+            continue
+
+        if author_position is None:
+            years = [entry[0] for entry in row['dblp_pubs']]
+        else:
+            years = [entry[0] for entry in row['dblp_pubs']
+                     if cohort_utils.get_author_role(row['name'], entry[1]) ==
+                     roles[author_position]]
+
+        for iteration, k_birth_year in enumerate(k_birth_years):
+            T = range(t_lower, t_upper + 1)
+            trend = []
+            for j in T:
+                if (k_birth_year + j) >= 2020:
+                    trend.append(np.nan)
+                    continue
+                adjustment = cohort_utils.adjust(k_birth_year + j) \
+                    if adjusted else 1
+                trend.append(np.count_nonzero(
+                    np.array(years) == (k_birth_year + j))*adjustment)
+            rows.extend(cohort_utils.construct_covariates(
+                trend, row, k_birth_year, i, T, iteration, 'sid'))
+
+    return pd.DataFrame(rows, columns=PANEL_COLUMNS)
+
+
+@pytest.mark.parametrize('adjusted', [True, False])
+@pytest.mark.parametrize('author_position', [None, 'first', 'last'])
+def test_control_panel_matches_reference(cohort, placebo_births, adjusted,
+                                         author_position):
+    expected = reference_publication_trend(cohort, -5, 10, adjusted,
+                                           author_position, placebo_births)
+    rows = cohort_utils.compute_publication_trend(
+        cohort, -5, 10, adjusted=adjusted, author_position=author_position,
+        control=True, predicted_k_birth=placebo_births,
+        iterations=len(placebo_births))
+    pd.testing.assert_frame_equal(rows, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('author_position', [None, 'first'])
+def test_treated_panel_matches_reference(cohort, author_position):
+    expected = reference_publication_trend(cohort, -5, 10,
+                                           author_position=author_position)
+    rows = cohort_utils.compute_publication_trend(
+        cohort, -5, 10, author_position=author_position)
+    pd.testing.assert_frame_equal(rows, expected, check_dtype=False)
+
+
+def test_offset_panel_rounds_and_slices(cohort, placebo_births):
+    panel = cohort_utils.compute_publication_trend(
+        cohort, -5, 10, control=True, predicted_k_birth=placebo_births,
+        iterations=len(placebo_births), compact=True)
+    expected = reference_publication_trend(cohort, -5, 10,
+                                           k_birth=placebo_births)
+    expected = expected.sort_values(['round', 'i', 't'], kind='stable')
+    expected = expected.reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(panel.materialize(), expected,
+                                  check_dtype=False)
+    chunks = pd.concat([rows for _, rows in panel.iter_rounds(3)],
+                       ignore_index=True)
+    pd.testing.assert_frame_equal(chunks, expected, check_dtype=False)
+    assert [k for k, _ in iter_rounds(panel)] == \
+        [k for k, _ in iter_rounds(expected)]
+
+    for column, value in [('t', 0), ('c', 2), ('round', 4)]:
+        if column == 'round':
+            rows = panel.materialize(rounds=value)
+        else:
+            rows = panel.materialize(**{column: value})
+        pd.testing.assert_frame_equal(
+            rows, expected[expected[column] == value].reset_index(drop=True),
+            check_dtype=False)
+
+
+@pytest.fixture
+def control_rows(cohort, placebo_births):
+    rows = cohort_utils.compute_publication_trend(
+        cohort, -5, 10, control=True, predicted_k_birth=placebo_births,
+        iterations=len(placebo_births))
+    # Censored years give NaN y
+    assert rows['y'].isna().any()
+    rows['is_female'] = rows['i'] % 2 == 0
+    return rows
+
+
+@pytest.mark.parametrize('rounds, where', [
+    (None, {}), (None, {'is_female': True}), ((2, 5), {}),
+    ((2, 5), {'is_female': False})])
+def test_panel_summary_matches_per_t_means(control_rows, rounds, where):
+    T = list(range(-6, 11))  # No rows at t = -6
+    summary = PanelSummary(control_rows, by=['is_female'])
+    rows = control_rows
+    if rounds is not None:
+        rows = rows[(rows['round'] >= rounds[0]) & (rows['round'] < rounds[1])]
+    for column, value in where.items():
+        rows = rows[rows[column] == value]
+
+    np.testing.assert_allclose(
+        summary.mean(T, rounds, **where),
+        [rows[rows['t'] == t]['y'].mean(skipna=True) for t in T])
+    np.testing.assert_allclose(
+        summary.sem(T, rounds, **where),
+        [rows[rows['t'] == t]['y'].sem() for t in T])
+    np.testing.assert_allclose(
+        summary.cumulative_mean(T, rounds, **where),
+        cohort_utils.generate_average_cumulative(rows).reindex(T).values)
+
+
+def test_sample_by_t(control_rows):
+    T = list(range(-6, 11))
+    draws = sample_by_t(control_rows, T, 200, np.random.default_rng(0))
+    assert draws.shape == (len(T), 200)
+    assert np.isnan(draws[0]).all()
+    for t, values in zip(T[1:], draws[1:]):
+        at_t = control_rows[control_rows['t'] == t]['y']
+        assert np.isin(values[~np.isnan(values)], at_t).all()
+        if not at_t.isna().any():
+            assert not np.isnan(values).any()
+
+
+def test_panel_aggregates_of_batches(control_rows):
+    T = list(range(-6, 11))
+    aggregates = PanelAggregates(T, 20000, np.random.default_rng(0))
+    # Batches of whole rounds, as streamed by allocation.py
+    batches = [control_rows[(control_rows['round'] >= first) &
+                            (control_rows['round'] < first + 4)]
+               for first in range(0, 10, 4)]
+    for rows in batches:
+        aggregates.update(rows)
+
+    summary = PanelSummary(control_rows)
+    for statistic in ['mean', 'sem', 'cumulative_mean']:
+        np.testing.assert_allclose(
+            getattr(aggregates.summary, statistic)(T, (1, 7)),
+            getattr(summary, statistic)(T, (1, 7)))
+
+    sums, counts = aggregates.person_time_matrix()
+    expected_sums, expected_counts = regression.person_time_matrix(
+        control_rows)
+    np.testing.assert_allclose(sums[:, 1:], expected_sums)
+    np.testing.assert_array_equal(counts[:, 1:], expected_counts)
+    pre_times = [-5, -4, -3, -2]
+    pd.testing.assert_series_equal(
+        aggregates.person_means(pre_times),
+        control_rows[control_rows.t.isin(pre_times)].groupby('i')['y'].mean(),
+        check_names=False)
+
+    pd.testing.assert_frame_equal(
+        aggregates.at_birth,
+        pd.concat([rows[rows['t'] == 0] for rows in batches],
+                  ignore_index=True))
+
+    # Draws are taken from all batches alike
+    assert np.isnan(aggregates.draws[0]).all()
+    for t, values in zip(T[1:], aggregates.draws[1:]):
+        at_t = control_rows[control_rows['t'] == t]['y']
+        assert np.isin(values[~np.isnan(values)], at_t).all()
+        np.testing.assert_allclose(np.isnan(values).mean(),
+                                   at_t.isna().mean(), atol=0.02)
+        np.testing.assert_allclose(np.nanmean(values), at_t.mean(),
+                                   atol=0.05 + 0.05*at_t.std())
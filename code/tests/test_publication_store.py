@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import cohort_utils
+from scripts.publication_store import PublicationStore
+
+
+@pytest.fixture
+def store(cohort, tmp_path):
+    path = str(tmp_path / 'publications.npz')
+    PublicationStore.from_frame(cohort).save(path)
+    return PublicationStore.load(path)
+
+
+def test_store_round_trip(cohort, store):
+    assert len(store) == cohort['dblp_pubs'].notna().sum()
+    rows = store.rows(cohort['sid'], cohort['dblp_pubs'])
+    for row, pubs in zip(rows, cohort['dblp_pubs']):
+        if pubs is None:
+            assert row < 0
+        else:
+            assert store.publications(row) == pubs
+
+
+@pytest.mark.parametrize('author_position', [None, 'first', 'last'])
+def test_publication_index_matches_lists(cohort, store, author_position):
+    np.testing.assert_array_equal(
+        cohort_utils.publication_index(cohort, author_position, store),
+        cohort_utils.publication_index(cohort, author_position))
+
+
+def test_coauthor_index_matches_lists(cohort, store):
+    np.testing.assert_array_equal(cohort_utils.coauthor_index(cohort, store),
+                                  cohort_utils.coauthor_index(cohort))
+
+
+def reference_new_coauthors(pubs):
+    """ Yearly new coauthor counts, as compute_coauthor_trend tallied them """
+    by_year = {}
+    for entry in pubs:
+        by_year.setdefault(entry[0], []).extend(entry[1])
+    seen = set()
+    counts = dict.fromkeys(cohort_utils.YEARS, 0)
+    for k, (year, coauths) in enumerate(sorted(by_year.items())):
+        if year in counts:
+            counts[year] = len(set(coauths).difference(seen)) - (k == 0)
+        seen.update(coauths)
+    return list(counts.values())
+
+
+def test_new_coauthors_match_sets(cohort):
+    people = [pubs for pubs in cohort['dblp_pubs'] if pubs]
+    expected = [reference_new_coauthors(pubs) for pubs in people]
+    # Author IDs do not carry over between people or calls
+    for order in [people, people[::-1]]:
+        counts = [cohort_utils.yearly_new_coauthors(pubs) for pubs in order]
+        if order is not people:
+            counts = counts[::-1]
+        np.testing.assert_array_equal(counts, expected)
+
+
+def test_trends_match_lists(cohort, store, placebo_births):
+    pd.testing.assert_frame_equal(
+        cohort_utils.compute_publication_trend(
+            cohort, -5, 10, author_position='last', control=True,
+            predicted_k_birth=placebo_births, iterations=10,
+            publications=store),
+        cohort_utils.compute_publication_trend(
+            cohort, -5, 10, author_position='last', control=True,
+            predicted_k_birth=placebo_births, iterations=10))
+    # Any subset of the frame reads the same store
+    subset = cohort.iloc[::-3]
+    pd.testing.assert_frame_equal(
+        cohort_utils.compute_coauthor_trend(subset, -5, 10,
+                                            publications=store),
+        cohort_utils.compute_coauthor_trend(subset, -5, 10))
+
+
+def test_ambiguous_keys(cohort):
+    pubs = list(cohort['dblp_pubs'])
+    sids = list(cohort['sid'])
+
+    # The same person's record twice is stored once
+    store = PublicationStore.from_lists(sids + sids[:2], pubs + pubs[:2])
+    assert len(store) == len(PublicationStore.from_lists(sids, pubs))
+
+    with pytest.raises(ValueError):
+        PublicationStore.from_lists(sids + sids[:1], pubs + pubs[1:2])
+    with pytest.raises(ValueError):
+        PublicationStore.from_lists(sids[:-1] + [np.nan], pubs)
+
+    store = PublicationStore.from_lists(sids[1:], pubs[1:])
+    with pytest.raises(ValueError):
+        store.rows(sids, pubs)
@@ -0,0 +1,90 @@
+import csv
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import reference_data
+
+
+def reference_attach(df, prestige_path, leave_path, suffix=''):
+    """ The prestige and parental leave columns as they were, row by row """
+    pi_rank_mapping = {}
+    parental_leave_mapping = {}
+    with open(prestige_path) as rankings, open(leave_path) as parental_leave:
+        for row in csv.DictReader(rankings, dialect='excel-tab'):
+            pi_rank_mapping[row['institution']] = row
+        for row in csv.DictReader(parental_leave, dialect='excel-tab'):
+            parental_leave_mapping[row['university_name']] = row
+
+    names = df['university_name_standard']
+    df['prestige_inv'] = pd.to_numeric(names.apply(
+        lambda x: pi_rank_mapping[x]['pi'] if x in pi_rank_mapping
+        else np.nan))
+    df['prestige_rank_inv'] = pd.to_numeric(names.apply(
+        lambda x: pi_rank_mapping[x]['# u'] if x in pi_rank_mapping
+        else np.nan))
+
+    def policy(column, reported=lambda missing: missing == '0'):
+        return names.apply(
+            lambda x: parental_leave_mapping[x][column]
+            if ((x in parental_leave_mapping) and
+                reported(parental_leave_mapping[x]['missing']))
+            else np.nan)
+
+    df['parleave_objective_length_women' + suffix] = pd.to_numeric(
+        policy('paid_leave_weeks_woman'))
+    df['parleave_objective_type_women' + suffix] = policy('relief_woman')
+    df['parleave_objective_length_men' + suffix] = pd.to_numeric(
+        policy('paid_leave_weeks_man'))
+    df['parleave_objective_type_men' + suffix] = policy(
+        'relief_man', lambda missing: int(missing) == 0)
+    return df
+
+
+@pytest.fixture
+def tables(tmp_path, monkeypatch):
+    prestige = pd.DataFrame({
+        '# u': ['1', '2', '3', '4', '5'],
+        'pi': ['0.5', '3.25', '12', '7.5', '40'],
+        'institution': ['Alpha U', 'Beta College', 'Gamma Tech',
+                        # Listed twice: the last row wins
+                        'Alpha U', 'Delta State']})
+    leave = pd.DataFrame({
+        'university_name': ['Alpha U', 'Beta College', 'Gamma Tech',
+                            'Beta College', 'Epsilon U', 'Zeta U'],
+        'paid_leave_weeks_woman': ['12', '6', '', '8', '14', '0'],
+        'relief_woman': ['paid', 'unpaid', '', 'paid', 'paid', 'none'],
+        'paid_leave_weeks_man': ['4', '0', '', '2', '6', '0'],
+        'relief_man': ['paid', 'none', '', 'unpaid', 'paid', 'none'],
+        # Policies are only used where they are not missing
+        'missing': ['0', '1', '2', '0', '0', '1']})
+
+    prestige_path = str(tmp_path / '%s_vertexlist.txt')
+    leave_path = str(tmp_path / 'parental_leave.tsv')
+    prestige.to_csv(prestige_path % 'CS', sep='\t', index=False)
+    leave.to_csv(leave_path, sep='\t', index=False)
+
+    monkeypatch.setattr(reference_data, 'PRESTIGE', prestige_path)
+    monkeypatch.setattr(reference_data, 'PARENTAL_LEAVE', leave_path)
+    monkeypatch.setattr(reference_data, '_tables', {})
+    return prestige_path % 'CS', leave_path
+
+
+@pytest.mark.parametrize('suffix', ['', '_inv'])
+def test_attach_institution_data_matches_reference(tables, suffix):
+    names = ['Alpha U', 'Beta College', 'Gamma Tech', 'Delta State',
+             'Epsilon U', 'Zeta U', 'Unknown U', np.nan, 'Alpha U']
+    # Responses are concatenated from several frames, with repeated labels
+    df = pd.DataFrame({'university_name_standard': names,
+                       'pid': range(len(names))}, index=[0, 1, 2, 3, 4, 5,
+                                                         0, 1, 2])
+
+    expected = reference_attach(df.copy(), *tables, suffix=suffix)
+    attached = reference_data.attach_institution_data(df.copy(), 'CS',
+                                                      suffix=suffix)
+
+    pd.testing.assert_frame_equal(attached, expected, check_dtype=False)
+    assert attached['prestige_inv'].iloc[0] == 7.5
+    assert attached['parleave_objective_length_women' + suffix].iloc[1] == 8
+    assert attached['parleave_objective_type_men' + suffix].isna().sum() == 5
@@ -0,0 +1,104 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+
+from scripts import cohort_utils, regression
+from scripts.regression import T
+
+
+@pytest.fixture
+def panel(cohort):
+    df = cohort_utils.compute_publication_trend(cohort, -5, 10)
+    # Publications from 2020 on are censored (NaN y)
+    assert df['y'].isna().any()
+    df['i_t'] = pd.Categorical(df['i_t'])
+    return df
+
+
+def drawn_ids(df, N, seed):
+    """ Cluster IDs of N replicates, as drawn by the bootstrap helpers """
+    ids = np.sort(df['i'].unique())
+    return ids[np.random.default_rng(seed).integers(0, len(ids),
+                                                    size=(N, len(ids)))]
+
+
+def reference_sample(df, ids):
+    """
+    get_sample as it was, for the drawn IDs. The old sample kept a cluster
+    drawn several times once (isin); here it appears once per draw, as it
+    does in the new helpers.
+    """
+    return pd.concat([df[df['i'] == i] for i in ids], ignore_index=True)
+
+
+def reference_trajectory(sample, cumulative):
+    """ Per-t mean y of a sample, as get_bootstrap_trajectories was """
+    means = [sample[sample['t'] == t]['y'].mean() for t in T]
+    return np.cumsum(means) if cumulative else means
+
+
+def test_samples_match_reference(panel):
+    ids = drawn_ids(panel, 20, 0)
+    # Some clusters are drawn more than once
+    assert any(len(np.unique(draw)) < len(draw) for draw in ids)
+
+    take, starts = regression.bootstrap_indices(
+        panel, 20, rng=np.random.default_rng(0))
+    for k in range(20):
+        pd.testing.assert_frame_equal(
+            panel.iloc[take[starts[k]:starts[k + 1]]].reset_index(drop=True),
+            reference_sample(panel, ids[k]))
+    pd.testing.assert_frame_equal(
+        regression.get_sample(panel, rng=np.random.default_rng(0)),
+        reference_sample(panel, ids[0]))
+
+
+def test_person_time_matrix(panel):
+    sums, counts = regression.person_time_matrix(panel)
+    grouped = panel.groupby(['i', 't'])['y']
+    np.testing.assert_allclose(
+        sums, grouped.sum().unstack().reindex(columns=T, fill_value=0))
+    np.testing.assert_array_equal(
+        counts, grouped.count().unstack().reindex(columns=T, fill_value=0))
+
+
+@pytest.mark.parametrize('cumulative', [True, False])
+@pytest.mark.parametrize('chunk_size', [1000, 7])
+def test_trajectories_match_reference(panel, cumulative, chunk_size):
+    expected = scipy.stats.sem(
+        [reference_trajectory(reference_sample(panel, draw), cumulative)
+         for draw in drawn_ids(panel, 20, 0)], axis=0)
+    np.testing.assert_allclose(
+        regression.get_bootstrap_trajectories(
+            panel, 20, cumulative, rng=np.random.default_rng(0),
+            chunk_size=chunk_size),
+        expected)
+
+
+def test_interval_matches_per_t_models(panel):
+    expected = []
+    for draw in drawn_ids(panel, 3, 0):
+        sample = reference_sample(panel, draw)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            mod = regression.build_model(sample)
+            expectation = [np.mean(regression.build_model(sample, t).predict())
+                           for t in T]
+        expected.append([mod.params[regression.LABEL % t] / expectation[j]
+                         for j, t in enumerate(T)])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        interval = regression.get_bootstrap_interval(
+            panel, 3, rng=np.random.default_rng(0))
+    np.testing.assert_allclose(interval, scipy.stats.sem(expected, axis=0),
+                               rtol=1e-6, atol=1e-12)
+
+
+def test_empty_frame(panel):
+    take, starts = regression.bootstrap_indices(panel.iloc[:0], 3)
+    assert len(take) == 0 and list(starts) == [0, 0, 0, 0]
+    assert len(regression.get_sample(panel.iloc[:0])) == 0
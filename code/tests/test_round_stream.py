@@ -0,0 +1,98 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scripts.did_fitter import DiDFitter, fit_stream
+from scripts.round_stream import RoundRing
+
+FORMULA = 'y ~ t + C(t>0) + t:C(t>0) + C(parent) + C(parent):t + \
+                  C(parent):C(t>0) + C(parent):C(t>0):t + pi'
+
+
+def rounds(n_rounds, n, parent, seed):
+    rng = np.random.default_rng(seed)
+    t = np.tile(np.arange(-5, 11), n*n_rounds)
+    rows = pd.DataFrame({
+        'y': rng.poisson(2.0, len(t)).astype(float), 't': t,
+        'pi': np.tile(np.repeat(rng.random(n), 16), n_rounds),
+        'parent': parent,
+        'round': np.repeat(np.arange(n_rounds), n*16)})
+    rows.loc[rows.index[::29], 'y'] = np.nan
+    return rows
+
+
+def test_ring_round_trip(tmp_path):
+    control = rounds(6, 10, False, 0)
+    batches = [('treated', rounds(1, 8, True, 1))] + \
+        [('control', rows) for _, rows in control.groupby('round')]
+
+    # A shallow ring makes the producer wait for the consumer
+    producer = RoundRing(str(tmp_path), depth=2, poll=0.01).open()
+
+    def produce():
+        for source, rows in batches:
+            producer.put(source, rows)
+        producer.close()
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    received = list(RoundRing(str(tmp_path), poll=0.01))
+    thread.join()
+
+    assert [source for source, _ in received] == \
+        [source for source, _ in batches]
+    for (_, rows), (_, expected) in zip(received, batches):
+        pd.testing.assert_frame_equal(rows,
+                                      expected.reset_index(drop=True))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_fit_stream_matches_per_round_fits():
+    treated = rounds(1, 8, True, 1)
+    control = rounds(6, 10, False, 0)
+    batches = [('treated', treated)] + \
+        [('control', control[control['round'].isin(chunk)])
+         for chunk in [[0, 1], [2, 3, 4], [5]]]
+
+    estimates = fit_stream(
+        {'parents': (FORMULA, 'treated', ['control'], 'parent')},
+        iter(batches), 2, exact=True)['parents']
+
+    fitter = DiDFitter(FORMULA, treated,
+                       pd.concat([treated, control[control['round'] == 0]]))
+    fits = [fitter.fit(rows) for _, rows in control.groupby('round')]
+    assert estimates.n == len(fits)
+    for name in fitter.columns:
+        assert np.isclose(estimates.mean(name),
+                          np.mean([fit.params[name] for fit in fits]))
+
+
+def test_fit_stream_stops_at_tolerance():
+    treated = rounds(1, 8, True, 1)
+    control = rounds(6, 10, False, 0)
+    batches = [('treated', treated)] + \
+        [('control', control[control['round'].isin(chunk)])
+         for chunk in [[0, 1], [2, 3, 4], [5]]]
+    read = []
+
+    def reading():
+        for batch in batches:
+            read.append(batch[0])
+            yield batch
+
+    # With a large tolerance, fitting stops after the first batch
+    estimates = fit_stream(
+        {'parents': (FORMULA, 'treated', ['control'], 'parent')},
+        reading(), 2, exact=True, tolerance=1e6)['parents']
+
+    fitter = DiDFitter(FORMULA, treated,
+                       pd.concat([treated, control[control['round'] == 0]]))
+    fits = [fitter.fit(control[control['round'] == k]) for k in [0, 1]]
+    assert estimates.n == 2
+    for name in fitter.columns:
+        assert np.isclose(estimates.mean(name),
+                          np.mean([fit.params[name] for fit in fits]))
+    # The stream is still read to the end
+    assert len(read) == len(batches)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import scipy.stats
+
+from scripts.running_stats import P2Quantile, RunningEstimates
+
+
+@pytest.fixture
+def rounds():
+    rng = np.random.default_rng(0)
+    return np.column_stack([rng.normal(1, 2, 20000), rng.exponential(1, 20000),
+                            rng.uniform(-1, 1, 20000),
+                            rng.standard_t(3, 20000)])
+
+
+@pytest.mark.parametrize('q', [0.025, 0.5, 0.975])
+def test_p2_quantile_matches_np_quantile(rounds, q):
+    rounds = rounds[:5000]
+    sketch = P2Quantile(q, rounds.shape[1])
+    for x in rounds[:3]:
+        sketch.add(x)
+    # Fewer than five rounds are exact
+    np.testing.assert_allclose(sketch.value(),
+                               np.quantile(rounds[:3], q, axis=0))
+    for x in rounds[3:]:
+        sketch.add(x)
+    lower, upper = np.quantile(rounds, [0.025, 0.975], axis=0)
+    assert np.all(np.abs(sketch.value() - np.quantile(rounds, q, axis=0)) <
+                  0.05*(upper - lower))
+
+
+@pytest.mark.parametrize('n, buffer', [(3, 1000), (500, 1000),
+                                       (5000, 100)])
+def test_running_estimates_match_numpy(rounds, n, buffer):
+    estimates = RunningEstimates(list('abcd'), buffer=buffer)
+    exact = RunningEstimates(list('abcd'), exact=True)
+    for x in rounds[:n]:
+        estimates.add(x)
+        exact.add(x)
+
+    for j, name in enumerate('abcd'):
+        values = rounds[:n, j]
+        summary = estimates.summary(name)
+        assert np.isclose(summary['mean'], values.mean())
+        assert np.isclose(summary['std'], values.std())
+        assert np.isclose(summary['sem'], scipy.stats.sem(values))
+        ttest = scipy.stats.ttest_1samp(values, 0)
+        assert np.isclose(summary['ttest'].statistic, ttest.statistic)
+        assert np.isclose(summary['ttest'].pvalue, ttest.pvalue)
+
+        lower, upper = np.quantile(values, [0.025, 0.975])
+        assert np.isclose(exact.ci(name)['lower'], lower)
+        assert np.isclose(exact.ci(name)['upper'], upper)
+        if n <= buffer:
+            assert np.isclose(summary['lower'], lower)
+            assert np.isclose(summary['upper'], upper)
+        else:
+            tolerance = 0.05*(upper - lower)
+            assert abs(summary['lower'] - lower) < tolerance
+            assert abs(summary['upper'] - upper) < tolerance
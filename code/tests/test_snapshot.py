@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+
+from scripts import snapshot
+
+
+def build_from(source, builds):
+    """ build() of a frame read from the source file, counting the calls """
+    def build():
+        builds.append(source)
+        df = pd.read_csv(source)
+        df['pubs'] = [[[2000 + k, ['A B']]] for k in range(len(df))]
+        return df
+    return build
+
+
+def test_snapshot_round_trip_and_invalidation(tmp_path, cohort):
+    source = str(tmp_path / 'source.csv')
+    directory = str(tmp_path / 'snapshot')
+    cohort[['sid', 'name', 'age (actual)']].to_csv(source, index=False)
+    builds = []
+    build = build_from(source, builds)
+
+    expected = build()
+    builds.clear()
+    first = snapshot.cached(directory, [source], build)
+    second = snapshot.cached(directory, [source], build)
+    assert len(builds) == 1
+    pd.testing.assert_frame_equal(first, expected)
+    pd.testing.assert_frame_equal(second, expected)
+
+    # Touched but unchanged: still served
+    os.utime(source, (1, 1))
+    pd.testing.assert_frame_equal(snapshot.cached(directory, [source], build),
+                                  expected)
+    assert len(builds) == 1
+
+    # Changed: rebuilt
+    cohort[['sid', 'name']].to_csv(source, index=False)
+    changed = snapshot.cached(directory, [source], build)
+    assert len(builds) == 2
+    assert list(changed.columns) == ['sid', 'name', 'pubs']
+    pd.testing.assert_frame_equal(snapshot.read_snapshot(directory, [source]),
+                                  changed)
+
+    # Without a directory, always built
+    snapshot.cached(None, [source], build)
+    assert len(builds) == 3
+
+
+def test_source_edited_during_build(tmp_path, cohort):
+    source = str(tmp_path / 'source.csv')
+    directory = str(tmp_path / 'snapshot')
+    cohort[['sid', 'name']].to_csv(source, index=False)
+    builds = []
+    build = build_from(source, builds)
+
+    def slow_build():
+        df = build()
+        # The source changes after the build has read it
+        cohort[['sid']].to_csv(source, index=False)
+        return df
+
+    stale = snapshot.cached(directory, [source], slow_build)
+    assert 'name' in stale.columns
+    fresh = snapshot.cached(directory, [source], build)
+    assert len(builds) == 2
+    assert 'name' not in fresh.columns
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from scripts import cohort_utils
+
+
+@pytest.mark.parametrize('relative_to', ['first_child_birth',
+                                         'first_asst_job_year'])
+@pytest.mark.parametrize('adjusted', [True, False])
+def test_cached_trends_match_uncached(cohort, relative_to, adjusted):
+    cache = cohort_utils.TrendCache()
+    subsets = [cohort[cohort.index % 2 == 0], cohort,
+               cohort[cohort.index % 4 == 3], cohort.iloc[::-1],
+               pd.concat([cohort.iloc[20:], cohort.iloc[:10]])]
+    for subset in subsets:
+        expected = cohort_utils.compute_publication_trend(
+            subset, -5, 10, adjusted=adjusted, relative_to=relative_to)
+        rows = cohort_utils.compute_publication_trend(
+            subset, -5, 10, adjusted=adjusted, relative_to=relative_to,
+            cache=cache)
+        pd.testing.assert_frame_equal(rows, expected)
+
+    empty = cohort_utils.compute_publication_trend(
+        cohort.iloc[:0], -5, 10, adjusted=adjusted, relative_to=relative_to,
+        cache=cache)
+    assert len(empty) == 0
+
+
+def test_cached_author_position_trends(cohort):
+    cache = cohort_utils.TrendCache()
+    for author_position in [None, 'first', 'last']:
+        expected = cohort_utils.compute_publication_trend(
+            cohort, -5, 10, author_position=author_position)
+        rows = cohort_utils.compute_publication_trend(
+            cohort, -5, 10, author_position=author_position, cache=cache)
+        pd.testing.assert_frame_equal(rows, expected)
+
+
+def test_cache_refuses_another_frame(cohort):
+    cache = cohort_utils.TrendCache()
+    cohort_utils.compute_publication_trend(cohort, -5, 10, cache=cache)
+    other = cohort.copy()
+    other['sid'] += 1
+    with pytest.raises(ValueError):
+        cohort_utils.compute_publication_trend(other, -5, 10, cache=cache)
@@ -0,0 +1,16 @@
+import numpy as np
+
+from scripts.variance_diagnostic import variance_reduction_diagnostic
+
+
+def test_diagnostic_compares_shock_and_slope(cohort):
+    cohort = cohort.assign(k_birth_year=cohort['first_child_birth'])
+    treated, control = cohort.iloc[::2], cohort.iloc[1::2]
+    diagnostic = variance_reduction_diagnostic(
+        treated, control, 4, 'bootstrap', 'stratified', repeats=3,
+        rng=np.random.default_rng(0))
+    assert sorted(diagnostic) == ['shock', 'slope']
+    for estimate in diagnostic.values():
+        assert estimate['plain'] > 0 and estimate['reduced'] > 0
+        assert np.isclose(estimate['ratio'],
+                          estimate['plain'] / estimate['reduced'])